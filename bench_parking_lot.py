@@ -0,0 +1,126 @@
+"""
+Benchmarks for the hot path of parking_lot.py, run with pytest-benchmark:
+
+    pytest bench_parking_lot.py --benchmark-save=baseline
+    pytest bench_parking_lot.py --benchmark-compare --benchmark-compare-fail=median:50%
+
+The first run stores a baseline under .benchmarks/; later runs compare against
+the latest one saved and fail if any benchmark's median is half again as slow.
+The operations on small lots take well under a microsecond, so a tighter bound
+fails on noise. Add -k "not 1M" to leave out the largest lots.
+
+Every lot is laid out and occupied from a seed, so runs are comparable. Each
+timed park or unpark is paired with one untimed the other way, so a lot is the
+same before and after every round and can be shared between benchmarks.
+"""
+
+from functools import lru_cache
+from random import Random
+
+import pytest
+
+from parking_lot import PLACEMENT_POLICIES, ParkingLot, plan_van_runs
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = {"10": 10, "1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+OCCUPANCIES = {"empty": 0.0, "half": 0.5, "99pct": 0.99}
+
+
+@lru_cache(maxsize=None)
+def make_lot(size: int, occupancy: float, seed: int = 0) -> ParkingLot:
+    """
+    Return a lot of `size` spaces, mostly car spaces as in simulate, with
+    `occupancy` of them taken by a vehicle of their own type.
+    """
+    rng = Random(seed)
+    layout = bytearray(rng.choices(b"MCCCV", k=size))
+    for space in rng.sample(range(size), int(size * occupancy)):
+        layout[space] = layout[space] | 0x20  # lower case: taken
+    return ParkingLot.from_layout(layout)
+
+
+@pytest.fixture(params=SIZES.values(), ids=SIZES.keys())
+def size(request):
+    return request.param
+
+
+@pytest.fixture(params=OCCUPANCIES.values(), ids=OCCUPANCIES.keys())
+def occupancy(request):
+    return request.param
+
+
+@pytest.fixture(params=PLACEMENT_POLICIES)
+def policy(request):
+    return request.param
+
+
+@pytest.fixture
+def lot(size, occupancy, policy):
+    lot = make_lot(size, occupancy)
+    lot.policy = policy
+    return lot
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+def test_how_many_remain(benchmark, lot):
+    benchmark(lot.how_many_remain)
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+def test_to_list(benchmark, lot):
+    result = benchmark(lot.to_list)
+    assert len(result) == lot.total_spaces
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+def test_to_layout(benchmark, lot):
+    result = benchmark(lot.to_layout)
+    assert len(result) == lot.total_spaces
+
+
+def test_park_car(benchmark, lot):
+    parked = []
+
+    def setup():
+        if parked:
+            lot.unpark(parked.pop())
+        return (), {}
+
+    def park():
+        parked.append(lot.park("car"))
+
+    benchmark.pedantic(park, setup=setup, rounds=5000, warmup_rounds=100)
+    lot.unpark(parked.pop())
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+def test_unpark_car(benchmark, lot):
+    def setup():
+        return (lot.park("car"),), {}
+
+    benchmark.pedantic(lot.unpark, setup=setup, rounds=5000, warmup_rounds=100)
+
+
+def test_van_in_car_spaces_search(benchmark, lot):
+    # The search park("van") makes once the van spaces are all taken.
+    benchmark(lot._choose_van_run)
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+def test_changes_since(benchmark, lot):
+    version = lot.changes.version
+    parked = [lot.park("car") for _ in range(10)]
+    benchmark(lot.changes_since, version)
+    for space_number in reversed(parked):
+        lot.unpark(space_number)
+
+
+@pytest.mark.parametrize("policy", ["lowest-id"], indirect=True)
+@pytest.mark.parametrize("occupancy", [0.5], indirect=True)
+@pytest.mark.parametrize("size", [1_000, 100_000], ids=["1k", "100k"], indirect=True)
+def test_plan_van_runs(benchmark, lot):
+    # Enough runs that most need vehicles moved out of them.
+    layout = lot.to_layout()
+    runs = layout.count(b"C") // 4
+    assert benchmark(plan_van_runs, layout, runs) is not None
@@ -0,0 +1,9 @@
+"""
+Put the Django app's directory on the path, so that parking_lot.py can import
+the code it shares with the app's parking_place package.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent / "parking_lot"))
@@ -1,7 +1,111 @@
-from random import randrange
-from typing import List, Tuple
+import argparse
+import re
+from collections import deque
+from functools import lru_cache
+from heapq import heappop, heappush
+from itertools import combinations, compress, islice
+from random import Random
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import pytest
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Shared with the Django app's in-memory backend, so kept in its package, which
+# is all the Docker image holds. conftest.py puts it on the path for the tests;
+# run this as PYTHONPATH=parking_lot python parking_lot.py.
+from parking_place.runs import VAN_RUN_LENGTH, OpenRuns, plan_van_runs
+
+# Ways of choosing which open space a vehicle is given. See ParkingLot.park.
+PLACEMENT_POLICIES = ("arbitrary", "lowest-id", "best-fit", "protect-runs")
+
+# A layout is a snapshot of a lot, one byte a space: the upper case initial of
+# an open space's type, lower case once it's taken, and x for each of the three
+# car spaces a van takes. "MCVmcxxx" is an open motorcycle, car, and van space,
+# a taken motorcycle and car space, then a van parked in three car spaces.
+LAYOUT_LETTERS = b"MCVmcvx"
+
+# How each layout letter reads in to_list.
+LAYOUT_LABELS = {
+    ord("M"): "motorcycle:open",
+    ord("m"): "motorcycle:full",
+    ord("C"): "car:open",
+    ord("c"): "car:full",
+    ord("V"): "van:open",
+    ord("v"): "van:full",
+    ord("x"): "car:full",
+}
+
+# The layout letter of each label, but for vans in car spaces, also "car:full".
+LABEL_LETTERS = {
+    label: letter for letter, label in LAYOUT_LABELS.items() if letter != ord("x")
+}
+
+# How many changes to a lot's spaces are kept for changes_since.
+CHANGE_LOG_LENGTH = 10_000
+
+
+def check_layout(layout: Union[bytes, str]) -> bytes:
+    """Return the layout as bytes, or raise ValueError if it isn't one."""
+    if isinstance(layout, str):
+        layout = layout.encode("ascii", "replace")
+    layout = bytes(layout)
+    if layout.translate(None, LAYOUT_LETTERS):
+        raise ValueError(f"Layouts may only hold the letters {LAYOUT_LETTERS.decode()}.")
+    return layout
+
+
+def van_middles(layout: bytes) -> Iterator[int]:
+    """Return the middle space of each van parked in car spaces in a layout."""
+    if b"x" not in layout:
+        return
+    for run in re.finditer(rb"x+", layout):
+        start, end = run.span()
+        if (end - start) % VAN_RUN_LENGTH:
+            raise ValueError(f"Van spaces at {start} aren't a whole number of vans.")
+        yield from range(start + 1, end, VAN_RUN_LENGTH)
+
+
+def spaces_with(layout: bytes, letter: int) -> Iterator[int]:
+    """Return the spaces in a layout that hold the letter, without a Python loop."""
+    is_letter = bytes(code == letter for code in range(256))
+    return compress(range(len(layout)), layout.translate(is_letter))
+
+
+class ChangeLog:
+    """
+    The spaces changed by the last `length` changes to a lot, so that a client
+    holding a snapshot can catch up on what changed since, rather than take a
+    new one. `version` counts the changes; a client notes it with a snapshot.
+    """
+
+    def __init__(self, length: int = CHANGE_LOG_LENGTH):
+        self.version = 0
+        self.spaces: deque[int] = deque(maxlen=length)
+
+    def record(self, space: int) -> None:
+        self.version += 1
+        self.spaces.append(space)
+
+    def reset(self) -> None:
+        """Start again, as when every space has changed."""
+        self.version += 1
+        self.spaces.clear()
+
+    def since(self, version: int) -> Optional[set[int]]:
+        """
+        Return the spaces changed after `version`, or None if that was too long
+        ago to tell.
+        """
+        behind = self.version - version
+        if behind < 0:
+            raise ValueError(f"Version {version} is newer than the lot's.")
+        if behind > len(self.spaces):
+            return None
+        return set(islice(reversed(self.spaces), behind))
+
 
 class ParkingLot:
     """
@@ -12,10 +116,19 @@ class ParkingLot:
 
     Methods are provided to park vehicles, unpark vehicles, count remaining spaces,
     determine whether the lot is full, and count how much space vans are taking.
+
+    `policy` decides which open space a vehicle is given; it only matters for
+    how well vans can still be parked later. See `park`. The layout of spaces
+    is random, the same for the same `seed`; `from_layout` builds a given one.
     """
 
-    def __init__(self, count: int = 20):
+    def __init__(
+        self, count: int = 20, policy: str = "arbitrary", seed: Optional[int] = None
+    ):
+        if policy not in PLACEMENT_POLICIES:
+            raise ValueError(f"Unknown placement policy: {policy}")
         self.total_spaces = count
+        self.policy = policy
         """
         Each of following will hold the ids of parking spaces, so for instance
         a van space will be in either `open_van_spaces` or `full_van_spaces`, and
@@ -28,20 +141,61 @@ class ParkingLot:
         self.open_motorcycle_spaces: set[int] = set()
         self.full_motorcycle_spaces: set[int] = set()
         self.vans_in_car_spaces: set[int] = set()
-        self.create_random_lot()
+        # Runs of contiguous open car spaces, for parking vans in car spaces.
+        self.open_car_runs = OpenRuns()
+        # Heaps of the open motorcycle and van spaces, for the lowest id. They
+        # may also hold spaces taken since, which are skipped; see _open.
+        self.motorcycle_heap: List[int] = []
+        self.van_heap: List[int] = []
+        # What to_list gives for each space, kept up to date as it changes.
+        self.labels: List[str] = []
+        self.changes = ChangeLog()
+        self.create_random_lot(seed)
 
-    def create_random_lot(self):
+    def create_random_lot(self, seed: Optional[int] = None):
         """
-        Create a lot with a random assortment of motorcycle, car, and van spaces.
+        Create a lot with a random assortment of motorcycle, car, and van spaces,
+        the same assortment for the same seed.
         """
-        for i in range(self.total_spaces):
-            which = randrange(3)
-            if which == 0:
-                self.open_motorcycle_spaces.add(i)
-            elif which == 1:
-                self.open_car_spaces.add(i)
-            else:
-                self.open_van_spaces.add(i)
+        self.load_layout(bytes(Random(seed).choices(b"MCV", k=self.total_spaces)))
+
+    @classmethod
+    def from_layout(
+        cls, layout: Union[bytes, str], policy: str = "arbitrary"
+    ) -> "ParkingLot":
+        """Return a lot with the spaces and vehicles of a layout. See LAYOUT_LETTERS."""
+        lot = cls(0, policy)
+        lot.load_layout(layout)
+        return lot
+
+    def load_layout(self, layout: Union[bytes, str]) -> None:
+        """Replace the lot's spaces and vehicles with those of a layout."""
+        layout = check_layout(layout)
+        # Check the vans before changing anything.
+        vans = set(van_middles(layout))
+        self.total_spaces = len(layout)
+        self.open_motorcycle_spaces = set(spaces_with(layout, ord("M")))
+        self.full_motorcycle_spaces = set(spaces_with(layout, ord("m")))
+        self.open_car_spaces = set(spaces_with(layout, ord("C")))
+        self.full_car_spaces = set(spaces_with(layout, ord("c")))
+        self.open_van_spaces = set(spaces_with(layout, ord("V")))
+        # A sorted list is a heap.
+        self.motorcycle_heap = sorted(self.open_motorcycle_spaces)
+        self.van_heap = sorted(self.open_van_spaces)
+        self.full_van_spaces = set(spaces_with(layout, ord("v")))
+        self.vans_in_car_spaces = vans
+        self.open_car_runs = OpenRuns.from_runs(
+            [(run.start(), run.end() - 1) for run in re.finditer(rb"C+", layout)]
+        )
+        self.labels = list(map(LAYOUT_LABELS.__getitem__, layout))
+        self.changes.reset()
+
+    def to_layout(self) -> bytes:
+        """Return the lot's spaces and vehicles as a layout. See LAYOUT_LETTERS."""
+        layout = bytearray(map(LABEL_LETTERS.__getitem__, self.labels))
+        for space in self.vans_in_car_spaces:
+            layout[space - 1 : space + 2] = b"xxx"
+        return bytes(layout)
 
     def to_list(self) -> List[str]:
         """
@@ -50,34 +204,23 @@ class ParkingLot:
         If three car spaces have a van in them they will all be represented as
         "car:full", not as "van:full".
         """
-        res = ["car" for _ in range(self.total_spaces)]
-        for space_set in [
-            self.open_car_spaces,
-            self.full_car_spaces,
-            self.open_van_spaces,
-            self.full_van_spaces,
-            self.open_motorcycle_spaces,
-            self.full_motorcycle_spaces,
-            self.vans_in_car_spaces,
-        ]:
-            for space in space_set:
-                if space_set is self.open_car_spaces:
-                    res[space] = "car:open"
-                elif space_set is self.full_car_spaces:
-                    res[space] = "car:full"
-                elif space_set is self.open_motorcycle_spaces:
-                    res[space] = "motorcycle:open"
-                elif space_set is self.full_motorcycle_spaces:
-                    res[space] = "motorcycle:full"
-                elif space_set is self.open_van_spaces:
-                    res[space] = "van:open"
-                elif space_set is self.full_van_spaces:
-                    res[space] = "van:full"
-                elif space_set is self.vans_in_car_spaces:
-                    res[space] = "car:full"
-                    res[space - 1] = "car:full"
-                    res[space + 1] = "car:full"
-        return res
+        return self.labels.copy()
+
+    def changes_since(self, version: int) -> Optional[Dict[int, str]]:
+        """
+        Return what to_list now gives for each space that has changed since
+        `changes.version` was `version`, so that a copy of to_list taken then can
+        be brought up to date. Return None if that was too many changes ago to
+        tell, in which case take to_list again.
+        """
+        spaces = self.changes.since(version)
+        if spaces is None:
+            return None
+        return {space: self.labels[space] for space in spaces}
+
+    def _label(self, space_number: int, label: str) -> None:
+        self.labels[space_number] = label
+        self.changes.record(space_number)
 
     def set_space(self, space_number: int, vehicle_type: str) -> None:
         """
@@ -88,14 +231,34 @@ class ParkingLot:
 
         # First, discard from all three sets, then add to correct set.
         self.open_motorcycle_spaces.discard(space_number)
-        self.open_car_spaces.discard(space_number)
+        if space_number in self.open_car_spaces:
+            self.open_car_spaces.remove(space_number)
+            self.open_car_runs.remove(space_number)
         self.open_van_spaces.discard(space_number)
         if vehicle_type == "motorcycle":
-            self.open_motorcycle_spaces.add(space_number)
+            self._open(self.open_motorcycle_spaces, space_number)
         elif vehicle_type == "car":
             self.open_car_spaces.add(space_number)
+            self.open_car_runs.add(space_number)
         else:
-            self.open_van_spaces.add(space_number)
+            vehicle_type = "van"
+            self._open(self.open_van_spaces, space_number)
+        self._label(space_number, f"{vehicle_type}:open")
+
+    def _heap(self, open_spaces: set[int]) -> List[int]:
+        if open_spaces is self.open_motorcycle_spaces:
+            return self.motorcycle_heap
+        return self.van_heap
+
+    def _open(self, open_spaces: set[int], space_number: int) -> None:
+        """Add a motorcycle or van space to its open spaces and their heap."""
+        open_spaces.add(space_number)
+        heap = self._heap(open_spaces)
+        heappush(heap, space_number)
+        # Spaces taken by the arbitrary policy are never popped, so now and
+        # then rebuild the heap to drop them.
+        if len(heap) > 2 * len(open_spaces) + 16:
+            heap[:] = sorted(open_spaces)
 
     def is_full(self) -> bool:
         """
@@ -122,65 +285,129 @@ class ParkingLot:
         """Return the total number of spaces used by vans."""
         return len(self.vans_in_car_spaces) * 3 + len(self.full_van_spaces)
 
+    def plan_van_runs(
+        self, count: int
+    ) -> Optional[Tuple[List[int], List[Tuple[int, int]]]]:
+        """
+        Return the runs and the fewest moves between car spaces that would open
+        `count` runs of car spaces for vans, or None. See plan_van_runs.
+        """
+        return plan_van_runs(self.to_layout(), count)
+
+    def _choose_car_space(self) -> int:
+        """Return the open car space the placement policy would take next."""
+        runs = self.open_car_runs
+        if self.policy == "arbitrary":
+            return next(iter(self.open_car_spaces))
+        if self.policy == "lowest-id":
+            return runs.starts[0]
+        if self.policy == "best-fit":
+            length = min(runs.runs_by_length)
+        else:
+            # protect-runs: first runs too short for a van, then runs whose
+            # length isn't a multiple of a van's, so that taking their first
+            # space doesn't reduce how many vans the run can hold.
+            length = min(
+                runs.runs_by_length,
+                key=lambda n: (n >= runs.min_length, n % runs.min_length == 0, n),
+            )
+        return next(iter(runs.runs_by_length[length]))
+
+    def _choose_van_run(self) -> Optional[Tuple[int, int]]:
+        """Return the run of open car spaces the placement policy would give a van."""
+        runs = self.open_car_runs
+        if not runs.long_runs or self.policy == "arbitrary":
+            return runs.find_long_run()
+        if self.policy == "lowest-id":
+            start = min(runs.long_runs)
+        else:
+            length = min(n for n in runs.runs_by_length if n >= runs.min_length)
+            start = next(iter(runs.runs_by_length[length]))
+        return start, runs.start_to_end[start]
+
+    def _take_space(self, open_spaces: set[int], full_spaces: set[int]) -> int:
+        """Move the space chosen by the placement policy from open to full."""
+        if open_spaces is self.open_car_spaces:
+            space_number = self._choose_car_space()
+            open_spaces.remove(space_number)
+            self.open_car_runs.remove(space_number)
+        elif self.policy == "arbitrary":
+            space_number = open_spaces.pop()
+        else:
+            # Only car spaces are adjacency-sensitive, so every other policy
+            # takes the lowest id, from the heap, passing spaces already taken.
+            heap = self._heap(open_spaces)
+            space_number = heappop(heap)
+            while space_number not in open_spaces:
+                space_number = heappop(heap)
+            open_spaces.remove(space_number)
+        full_spaces.add(space_number)
+        if full_spaces is self.full_motorcycle_spaces:
+            self._label(space_number, "motorcycle:full")
+        elif full_spaces is self.full_car_spaces:
+            self._label(space_number, "car:full")
+        else:
+            self._label(space_number, "van:full")
+        return space_number
+
     def park(self, type: str) -> int:
         """
         Attempt to park a vehicle (motorcycle, car, or van). If succesful, return
         space number. Otherwise, return -1.
+
+        Which space is taken depends on the lot's policy:
+            arbitrary: whichever the underlying set gives up first.
+            lowest-id: the lowest-numbered suitable space.
+            best-fit: car spaces from the shortest run of open car spaces.
+            protect-runs: car spaces from runs that can't hold a van, or where
+                taking one space doesn't reduce how many vans the run can hold.
         """
 
         # Move a space from an "open" set to a "full" set. For each incoming
         # vehicle type check for open spaces in increasing order of size.
 
-        # Note that, for any given vehicle to be parked, a space is chosen at random,
-        # meaning that over time vans may become more difficult to park. I believe
-        # that Python sets are lrus, but choosing from an ordered list might be more
-        # efficient.
+        # Note that with the arbitrary policy vans may become more difficult
+        # to park over time, as car spaces get taken from the middle of runs.
         if self.is_full():
             return -1
 
         if type == "motorcycle":
             # Check first for motorcycle spaces, then cars spaces, then van spaces.
             if self.open_motorcycle_spaces:
-                space_number = self.open_motorcycle_spaces.pop()
-                self.full_motorcycle_spaces.add(space_number)
-            elif self.open_car_spaces:
-                space_number = self.open_car_spaces.pop()
-                self.full_car_spaces.add(space_number)
-            else:
-                space_number = self.open_van_spaces.pop()
-                self.full_van_spaces.add(space_number)
-            return space_number
+                return self._take_space(
+                    self.open_motorcycle_spaces, self.full_motorcycle_spaces
+                )
+            if self.open_car_spaces:
+                return self._take_space(self.open_car_spaces, self.full_car_spaces)
+            return self._take_space(self.open_van_spaces, self.full_van_spaces)
         elif type == "car":
             # Check first for car spaces, then for van spaces.
             if self.open_car_spaces:
-                space_number = self.open_car_spaces.pop()
-                self.full_car_spaces.add(space_number)
-            else:
-                space_number = self.open_van_spaces.pop()
-                self.full_van_spaces.add(space_number)
-            return space_number
+                return self._take_space(self.open_car_spaces, self.full_car_spaces)
+            if self.open_van_spaces:
+                return self._take_space(self.open_van_spaces, self.full_van_spaces)
+            # Only motorcycle spaces are left.
+            return -1
         else:
             # It's a van. Look for van spaces, if not available try for three
             # car spaces.
             if self.open_van_spaces:
-                space_number = self.open_van_spaces.pop()
-                self.full_van_spaces.add(space_number)
-            elif len(self.open_car_spaces) > 2:
-                for space_number in self.open_car_spaces:
-                    if (
-                        space_number - 1 in self.open_car_spaces
-                        and space_number + 1 in self.open_car_spaces
-                    ):
-                        self.vans_in_car_spaces.add(space_number)
-                        for i in range(-1, 2):
-                            # Not moving these to full car spaces, so
-                            # later retrieval will be safer.
-                            self.open_car_spaces.remove(space_number + i)
-                        break
-            else:
+                return self._take_space(self.open_van_spaces, self.full_van_spaces)
+            run = self._choose_van_run()
+            if run is None:
                 # There were no van spaces and not enough car spaces.
                 return -1
-        return space_number
+            # Take the first three spaces of the run; the van is recorded
+            # by the middle one.
+            space_number = run[0] + 1
+            self.vans_in_car_spaces.add(space_number)
+            for i in range(-1, 2):
+                # Not moving these to full car spaces, so
+                # later retrieval will be safer.
+                self.open_car_spaces.remove(space_number + i)
+                self.open_car_runs.remove(space_number + i)
+                self._label(space_number + i, "car:full")
+            return space_number
 
     def unpark(self, space_number: int) -> bool:
         """
@@ -190,25 +417,321 @@ class ParkingLot:
         """
         if space_number in self.full_motorcycle_spaces:
             self.full_motorcycle_spaces.remove(space_number)
-            self.open_motorcycle_spaces.add(space_number)
+            self._open(self.open_motorcycle_spaces, space_number)
+            self._label(space_number, "motorcycle:open")
             return True
         if space_number in self.full_car_spaces:
             self.full_car_spaces.remove(space_number)
             self.open_car_spaces.add(space_number)
+            self.open_car_runs.add(space_number)
+            self._label(space_number, "car:open")
             return True
         if space_number in self.full_van_spaces:
             self.full_van_spaces.remove(space_number)
-            self.open_van_spaces.add(space_number)
+            self._open(self.open_van_spaces, space_number)
+            self._label(space_number, "van:open")
             return True
         if space_number in self.vans_in_car_spaces:
             self.vans_in_car_spaces.remove(space_number)
             for i in range(-1, 2):
                 # These were only removed from open, not put anywhere else.
                 self.open_car_spaces.add(space_number + i)
+                self.open_car_runs.add(space_number + i)
+                self._label(space_number + i, "car:open")
             return True
         return False
 
 
+class CompactParkingLot:
+    """
+    A ParkingLot that keeps each space's type and state in NumPy uint8 arrays
+    instead of Python sets, two bytes a space, so that lots of millions of
+    spaces fit comfortably in memory. It has the same methods and placement
+    policies as ParkingLot, except that "arbitrary" behaves like "lowest-id".
+    Counts are kept up to date as vehicles come and go; searches for a space
+    are vectorized scans of the arrays. Requires NumPy.
+    """
+
+    KINDS = ("motorcycle", "car", "van")
+    MOTORCYCLE, CAR, VAN = range(3)
+    # A van in car spaces is recorded by its middle space, as in
+    # ParkingLot.vans_in_car_spaces; the spaces either side are VAN_SIDE.
+    OPEN, FULL, VAN_MIDDLE, VAN_SIDE = range(4)
+    # What to_list gives for each space, indexed by kind * 2 + whether it's taken.
+    LABELS = tuple(f"{kind}:{state}" for kind in KINDS for state in ("open", "full"))
+
+    def __init__(
+        self, count: int = 20, policy: str = "arbitrary", seed: Optional[int] = None
+    ):
+        if np is None:
+            raise ImportError("CompactParkingLot requires NumPy.")
+        if policy not in PLACEMENT_POLICIES:
+            raise ValueError(f"Unknown placement policy: {policy}")
+        self.total_spaces = count
+        self.policy = policy
+        self.kinds = np.zeros(count, dtype=np.uint8)
+        self.states = np.zeros(count, dtype=np.uint8)
+        # Open spaces of each kind, indexed as KINDS.
+        self.open_counts = [0, 0, 0]
+        self.full_van_spaces = 0
+        self.vans_in_car_spaces = 0
+        self.changes = ChangeLog()
+        self.create_random_lot(seed)
+
+    def create_random_lot(self, seed: Optional[int] = None):
+        """
+        Create a lot with a random assortment of motorcycle, car, and van spaces,
+        the same assortment for the same seed.
+        """
+        rng = np.random.default_rng(seed)
+        self.kinds[:] = rng.integers(0, 3, self.total_spaces)
+        self.states[:] = self.OPEN
+        self.open_counts = np.bincount(self.kinds, minlength=3).tolist()
+        self.full_van_spaces = 0
+        self.vans_in_car_spaces = 0
+        self.changes.reset()
+
+    @classmethod
+    def from_layout(
+        cls, layout: Union[bytes, str], policy: str = "arbitrary"
+    ) -> "CompactParkingLot":
+        """Return a lot with the spaces and vehicles of a layout. See LAYOUT_LETTERS."""
+        lot = cls(0, policy)
+        lot.load_layout(layout)
+        return lot
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _layout_letters(cls):
+        """Return the layout letter of each kind and state, indexed [kind, state]."""
+        letters = np.zeros((3, 4), dtype=np.uint8)
+        letters[:, cls.OPEN] = list(b"MCV")
+        letters[:, cls.FULL] = list(b"mcv")
+        letters[:, [cls.VAN_MIDDLE, cls.VAN_SIDE]] = ord("x")
+        letters.flags.writeable = False
+        return letters
+
+    def load_layout(self, layout: Union[bytes, str]) -> None:
+        """Replace the lot's spaces and vehicles with those of a layout."""
+        layout = check_layout(layout)
+        middles = np.fromiter(van_middles(layout), dtype=np.int64)
+        codes = np.frombuffer(layout, dtype=np.uint8)
+        kinds = np.zeros(256, dtype=np.uint8)
+        states = np.zeros(256, dtype=np.uint8)
+        for (kind, state), letter in np.ndenumerate(self._layout_letters()):
+            if state != self.VAN_MIDDLE:
+                kinds[letter] = kind
+                states[letter] = state
+        # x is a car space either side of a van; the middles are marked below.
+        kinds[ord("x")] = self.CAR
+        self.kinds = kinds[codes]
+        self.states = states[codes]
+        self.states[middles] = self.VAN_MIDDLE
+        self.total_spaces = len(layout)
+        is_open = self.states == self.OPEN
+        self.open_counts = np.bincount(self.kinds[is_open], minlength=3).tolist()
+        self.full_van_spaces = int(
+            np.count_nonzero((self.kinds == self.VAN) & (self.states == self.FULL))
+        )
+        self.vans_in_car_spaces = len(middles)
+        self.changes.reset()
+
+    def to_layout(self) -> bytes:
+        """Return the lot's spaces and vehicles as a layout. See LAYOUT_LETTERS."""
+        return self._layout_letters()[self.kinds, self.states].tobytes()
+
+    def to_list(self) -> List[str]:
+        """
+        Return list representation of the types of spaces in a parking lot and
+        whether each is full, as ParkingLot.to_list does.
+        """
+        labels = np.array(self.LABELS)
+        return labels[self.kinds * 2 + (self.states != self.OPEN)].tolist()
+
+    def changes_since(self, version: int) -> Optional[Dict[int, str]]:
+        """
+        Return what to_list now gives for each space that has changed since
+        `changes.version` was `version`, as ParkingLot.changes_since does.
+        """
+        spaces = self.changes.since(version)
+        if spaces is None:
+            return None
+        return {
+            space: self.LABELS[self.kinds[space] * 2 + (self.states[space] != self.OPEN)]
+            for space in spaces
+        }
+
+    def set_space(self, space_number: int, vehicle_type: str) -> None:
+        """
+        For space_number, set as a given vehicle type. As with ParkingLot, this
+        is only safe before any vehicles have been parked.
+        """
+        kind = self.VAN
+        if vehicle_type in ("motorcycle", "car"):
+            kind = self.KINDS.index(vehicle_type)
+        if self.states[space_number] == self.OPEN:
+            self.open_counts[self.kinds[space_number]] -= 1
+            self.open_counts[kind] += 1
+        self.kinds[space_number] = kind
+        self.changes.record(space_number)
+
+    def is_full(self) -> bool:
+        """Return True if lot is full, False otherwise."""
+        return sum(self.open_counts) == 0
+
+    def how_many_remain(self) -> Tuple[int, int, int]:
+        """Return a tuple of remaining open spaces: (motorcycle, car, van)."""
+        return tuple(self.open_counts)
+
+    def how_many_space_are_vans(self) -> int:
+        """Return the total number of spaces used by vans."""
+        return self.vans_in_car_spaces * 3 + self.full_van_spaces
+
+    def plan_van_runs(
+        self, count: int
+    ) -> Optional[Tuple[List[int], List[Tuple[int, int]]]]:
+        """See ParkingLot.plan_van_runs."""
+        return plan_van_runs(self.to_layout(), count)
+
+    def _open_mask(self, kind: int):
+        return (self.kinds == kind) & (self.states == self.OPEN)
+
+    def _car_runs(self):
+        """Return the first spaces and the lengths of the runs of open car spaces."""
+        edges = np.diff(np.concatenate(([0], self._open_mask(self.CAR), [0])).astype(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        return starts, np.flatnonzero(edges == -1) - starts
+
+    def _choose_space(self, kind: int) -> int:
+        """Return the open space of the given kind the placement policy would take."""
+        if kind != self.CAR or self.policy in ("arbitrary", "lowest-id"):
+            return int(self._open_mask(kind).argmax())
+        starts, lengths = self._car_runs()
+        if self.policy == "best-fit":
+            return int(starts[lengths.argmin()])
+        # protect-runs, ordered as in ParkingLot._choose_car_space.
+        key = (
+            (lengths >= VAN_RUN_LENGTH) * 2 + (lengths % VAN_RUN_LENGTH == 0)
+        ) * (self.total_spaces + 1) + lengths
+        return int(starts[key.argmin()])
+
+    def _choose_van_run(self) -> Optional[int]:
+        """Return the first of three open car spaces to give a van, or None."""
+        if self.policy in ("arbitrary", "lowest-id"):
+            # A window sums to VAN_RUN_LENGTH where all its spaces are open.
+            windows = np.convolve(
+                self._open_mask(self.CAR).view(np.uint8),
+                np.ones(VAN_RUN_LENGTH, dtype=np.uint8),
+                "valid",
+            )
+            hits = np.flatnonzero(windows == VAN_RUN_LENGTH)
+            return int(hits[0]) if hits.size else None
+        starts, lengths = self._car_runs()
+        fits = lengths >= VAN_RUN_LENGTH
+        if not fits.any():
+            return None
+        return int(starts[fits][lengths[fits].argmin()])
+
+    def park(self, type: str) -> int:
+        """
+        Attempt to park a vehicle (motorcycle, car, or van). If succesful, return
+        space number. Otherwise, return -1.
+        """
+        if self.is_full():
+            return -1
+        preference = {
+            "motorcycle": (self.MOTORCYCLE, self.CAR, self.VAN),
+            "car": (self.CAR, self.VAN),
+        }.get(type, (self.VAN,))
+        for kind in preference:
+            if self.open_counts[kind]:
+                space_number = self._choose_space(kind)
+                self.states[space_number] = self.FULL
+                self.open_counts[kind] -= 1
+                if kind == self.VAN:
+                    self.full_van_spaces += 1
+                self.changes.record(space_number)
+                return space_number
+        if type in ("motorcycle", "car"):
+            return -1
+        start = self._choose_van_run()
+        if start is None:
+            return -1
+        self.states[start : start + 3] = (self.VAN_SIDE, self.VAN_MIDDLE, self.VAN_SIDE)
+        self.open_counts[self.CAR] -= 3
+        self.vans_in_car_spaces += 1
+        for space_number in range(start, start + 3):
+            self.changes.record(space_number)
+        return start + 1
+
+    def unpark(self, space_number: int) -> bool:
+        """
+        Remove the vehicle from a space. Return True if the space was taken, False
+        otherwise.
+        """
+        if not 0 <= space_number < self.total_spaces:
+            return False
+        state = self.states[space_number]
+        kind = self.kinds[space_number]
+        if state == self.FULL:
+            self.states[space_number] = self.OPEN
+            self.open_counts[kind] += 1
+            if kind == self.VAN:
+                self.full_van_spaces -= 1
+            self.changes.record(space_number)
+            return True
+        if state == self.VAN_MIDDLE:
+            self.states[space_number - 1 : space_number + 2] = self.OPEN
+            self.open_counts[self.CAR] += 3
+            self.vans_in_car_spaces -= 1
+            for i in range(-1, 2):
+                self.changes.record(space_number + i)
+            return True
+        return False
+
+
+def simulate(
+    policy: str,
+    count: int = 1000,
+    steps: int = 100_000,
+    seed: int = 0,
+    arrival_rate: float = 0.6,
+    compact: bool = False,
+) -> Dict[str, float]:
+    """
+    Run a random stream of arrivals and departures through a lot that uses the
+    given placement policy, and return the fraction of arrivals of each vehicle
+    type that were parked. Each step is an arrival with probability
+    `arrival_rate`, otherwise a departure, so above 0.5 the lot runs near full.
+    The layout and the stream depend only on `seed`, so runs with different
+    policies are comparable. `compact` runs it on a CompactParkingLot.
+    """
+    rng = Random(seed)
+    lot = (CompactParkingLot if compact else ParkingLot)(count, policy)
+    for i in range(count):
+        lot.set_space(i, rng.choice(["motorcycle", "car", "car", "car", "van"]))
+    arrived = {"motorcycle": 0, "car": 0, "van": 0}
+    parked_counts = dict(arrived)
+    parked: List[int] = []
+    for _ in range(steps):
+        if rng.random() < arrival_rate or not parked:
+            vehicle = rng.choice(["motorcycle", "car", "car", "car", "van"])
+            arrived[vehicle] += 1
+            space_number = lot.park(vehicle)
+            if space_number != -1:
+                parked_counts[vehicle] += 1
+                parked.append(space_number)
+        else:
+            # A random vehicle leaves.
+            i = rng.randrange(len(parked))
+            parked[i], parked[-1] = parked[-1], parked[i]
+            lot.unpark(parked.pop())
+    return {
+        vehicle: parked_counts[vehicle] / arrived[vehicle] if arrived[vehicle] else 1.0
+        for vehicle in arrived
+    }
+
+
 def test_set_and_to_list():
     lot = ParkingLot(5)
     for i in range(5):
@@ -339,3 +862,273 @@ def test_how_many_space_are_vans():
     lot.set_space(4, "van")
     lot.park("van")
     assert lot.how_many_space_are_vans() == 4
+
+
+def test_open_runs_merge_and_split():
+    runs = OpenRuns()
+    for i in [0, 1, 3, 4]:
+        runs.add(i)
+    assert runs.start_to_end == {0: 1, 3: 4}
+    assert runs.find_long_run() is None
+    runs.add(2)
+    assert runs.start_to_end == {0: 4}
+    assert runs.runs_by_length == {5: {0}}
+    assert runs.find_long_run() == (0, 4)
+    runs.remove(3)
+    assert runs.start_to_end == {0: 2, 4: 4}
+    assert runs.runs_by_length == {3: {0}, 1: {4}}
+    assert runs.run_containing(1) == (0, 2)
+    assert runs.run_containing(3) is None
+    runs.remove(0)
+    assert runs.find_long_run() is None
+
+
+def test_park_van_uses_car_runs():
+    lot = ParkingLot(7)
+    for i in range(7):
+        lot.set_space(i, "car")
+    lot.set_space(2, "motorcycle")
+    # Runs are 0-1 and 3-6, so the van must go in the second.
+    assert lot.park("van") == 4
+    assert lot.to_list()[3:6] == ["car:full", "car:full", "car:full"]
+    assert lot.park("van") == -1
+    lot.unpark(4)
+    assert lot.open_car_runs.start_to_end == {0: 1, 3: 6}
+
+
+def make_car_lot(count: int, policy: str, taken: List[int]) -> ParkingLot:
+    """Return a lot of all car spaces, with the spaces in `taken` parked in."""
+    layout = bytearray(b"C" * count)
+    for i in taken:
+        layout[i] = ord("c")
+    return ParkingLot.from_layout(layout, policy)
+
+
+def test_policy_lowest_id():
+    lot = make_car_lot(8, "lowest-id", [4])
+    assert lot.park("car") == 0
+    assert lot.park("van") == 2
+
+
+def test_policy_best_fit():
+    # Runs are 0-3 and 5-7.
+    lot = make_car_lot(8, "best-fit", [4])
+    assert lot.park("car") == 5
+    # Only the 4-run can still hold a van.
+    assert lot.park("van") == 1
+
+
+def test_policy_protect_runs():
+    # Runs are 0-3 and 5-7; taking from the 4-run leaves both able to hold a van.
+    lot = make_car_lot(8, "protect-runs", [4])
+    assert lot.park("car") == 0
+    assert {lot.park("van"), lot.park("van")} == {2, 6}
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ParkingLot(5, "random")
+
+
+def test_lowest_id_motorcycle_and_van_spaces():
+    rng = Random(5)
+    lot = ParkingLot.from_layout(bytes(rng.choices(b"MV", k=60)))
+    for _ in range(2000):
+        # Spaces the arbitrary policy takes are left in the heaps.
+        lot.policy = rng.choice(["arbitrary", "lowest-id"])
+        vehicle_type = rng.choice(["motorcycle", "van"])
+        open_spaces = (
+            lot.open_motorcycle_spaces
+            if vehicle_type == "motorcycle"
+            else lot.open_van_spaces
+        )
+        lowest = min(open_spaces, default=None)
+        if rng.random() < 0.5 and lowest is not None:
+            space_number = lot.park(vehicle_type)
+            if lot.policy == "lowest-id":
+                assert space_number == lowest
+        else:
+            lot.unpark(rng.randrange(60))
+    assert len(lot.motorcycle_heap) <= 2 * len(lot.open_motorcycle_spaces) + 16
+
+
+def test_park_car_with_only_motorcycle_spaces():
+    lot = ParkingLot(1)
+    lot.set_space(0, "motorcycle")
+    assert lot.park("car") == -1
+
+
+def test_simulate_is_deterministic():
+    assert simulate("best-fit", 50, 500, seed=3) == simulate("best-fit", 50, 500, seed=3)
+
+
+def test_changes_since():
+    lot = ParkingLot.from_layout("CCCCM", "lowest-id")
+    lot.changes = ChangeLog(length=4)
+    version = lot.changes.version
+    snapshot = lot.to_list()
+    assert lot.changes_since(version) == {}
+    assert lot.park("car") == 0
+    assert lot.park("van") == 2
+    changes = lot.changes_since(version)
+    assert changes == {0: "car:full", 1: "car:full", 2: "car:full", 3: "car:full"}
+    for space, label in changes.items():
+        snapshot[space] = label
+    assert snapshot == lot.to_list()
+    lot.unpark(2)
+    # Only the last four changes are kept.
+    assert lot.changes_since(version) is None
+    assert lot.changes_since(version + 4) == {1: "car:open", 2: "car:open", 3: "car:open"}
+    with pytest.raises(ValueError):
+        lot.changes_since(lot.changes.version + 1)
+
+
+def test_seeded_lot_is_reproducible():
+    assert ParkingLot(100, seed=1).to_layout() == ParkingLot(100, seed=1).to_layout()
+    assert ParkingLot(100, seed=1).to_layout() != ParkingLot(100, seed=2).to_layout()
+
+
+def test_layout_round_trip():
+    layout = b"MCVmcvxxxCCCCxxxxxxC"
+    lot = ParkingLot.from_layout(layout, "lowest-id")
+    assert lot.to_layout() == layout
+    assert lot.how_many_remain() == (1, 6, 1)
+    assert lot.how_many_space_are_vans() == 10
+    # The van in 13-15 leaves; after the van space, the next van takes 9-11.
+    assert lot.unpark(14)
+    assert lot.park("van") == 2
+    assert lot.park("van") == 10
+    assert lot.to_layout() == b"MCvmcvxxxxxxCCCCxxxC"
+
+
+def test_layout_rejects_bad_input():
+    with pytest.raises(ValueError):
+        ParkingLot.from_layout("MCQ")
+    with pytest.raises(ValueError):
+        ParkingLot.from_layout("CxxC")
+
+
+def test_plan_van_runs():
+    # The open run at 7-9 costs nothing; of the rest, 1-3 needs only 2 moved,
+    # which goes to the lone open space at 12 rather than break up 15-16.
+    layout = b"MCcCxxxCCCMcCcVCC"
+    lot = ParkingLot.from_layout(layout, "lowest-id")
+    assert lot.plan_van_runs(0) == ([], [])
+    assert lot.plan_van_runs(1) == ([7], [])
+    assert lot.plan_van_runs(2) == ([1, 7], [(2, 12)])
+    lot = ParkingLot.from_layout(b"MCCCxxxCCCMcccVCC", "lowest-id")
+    assert [lot.park("van") for _ in range(4)] == [14, 2, 8, -1]
+    # Two runs take six open car spaces, and there are five.
+    assert ParkingLot.from_layout("CCcCCCc").plan_van_runs(2) is None
+    assert ParkingLot.from_layout("CCCCCCMCC").plan_van_runs(3) is None
+
+
+def test_plan_van_runs_is_fewest_moves():
+    rng = Random(3)
+    for _ in range(300):
+        layout = bytes(rng.choices(b"CCCcccMVx", k=rng.randrange(16)))
+        count = rng.randrange(4)
+        windows = [
+            space
+            for space in range(len(layout) - 2)
+            if not layout[space : space + 3].strip(b"Cc")
+        ]
+        fewest = min(
+            (
+                sum(layout.count(b"c", space, space + 3) for space in runs)
+                for runs in combinations(windows, count)
+                if all(b - a >= 3 for a, b in zip(runs, runs[1:]))
+            ),
+            default=None,
+        )
+        if layout.count(b"C") < 3 * count:
+            fewest = None
+        plan = plan_van_runs(layout, count)
+        if plan is None:
+            assert fewest is None
+            continue
+        runs, moves = plan
+        assert len(moves) == fewest
+        after = bytearray(layout)
+        for space, to in moves:
+            assert (after[space], after[to]) == (ord("c"), ord("C"))
+            after[space], after[to] = after[to], after[space]
+        assert all(after[space : space + 3] == b"CCC" for space in runs)
+        assert all(b - a >= 3 for a, b in zip(runs, runs[1:]))
+
+
+@pytest.mark.skipif(np is None, reason="CompactParkingLot requires NumPy")
+def test_compact_matches_parking_lot():
+    rng = Random(7)
+    for _ in range(20):
+        lot = ParkingLot(40, "lowest-id")
+        compact = CompactParkingLot(40, "lowest-id")
+        for i in range(40):
+            vehicle_type = rng.choice(["motorcycle", "car", "car", "van"])
+            lot.set_space(i, vehicle_type)
+            compact.set_space(i, vehicle_type)
+        version = lot.changes.version
+        for _ in range(200):
+            if rng.random() < 0.6:
+                vehicle_type = rng.choice(["motorcycle", "car", "van"])
+                assert lot.park(vehicle_type) == compact.park(vehicle_type)
+            else:
+                space_number = rng.randrange(40)
+                assert lot.unpark(space_number) == compact.unpark(space_number)
+            assert lot.to_list() == compact.to_list()
+            assert lot.how_many_remain() == compact.how_many_remain()
+            assert lot.how_many_space_are_vans() == compact.how_many_space_are_vans()
+            assert lot.is_full() == compact.is_full()
+            assert lot.to_layout() == compact.to_layout()
+            assert lot.changes_since(version) == compact.changes_since(version)
+
+
+@pytest.mark.skipif(np is None, reason="CompactParkingLot requires NumPy")
+def test_compact_layout_round_trip():
+    layout = b"MCVmcvxxxCCCCxxxxxxC"
+    lot = ParkingLot.from_layout(layout, "lowest-id")
+    compact = CompactParkingLot.from_layout(layout, "lowest-id")
+    assert compact.to_layout() == layout
+    assert compact.how_many_remain() == lot.how_many_remain()
+    assert compact.how_many_space_are_vans() == lot.how_many_space_are_vans()
+    assert compact.unpark(14) and compact.unpark(13) is False
+    assert compact.park("van") == 2
+    assert compact.park("van") == 10
+
+
+@pytest.mark.skipif(np is None, reason="CompactParkingLot requires NumPy")
+def test_compact_policies():
+    for policy, car, vans in [
+        ("best-fit", 5, {1}),
+        ("protect-runs", 0, {2, 6}),
+    ]:
+        lot = CompactParkingLot(8, policy)
+        for i in range(8):
+            lot.set_space(i, "car")
+        lot.set_space(4, "motorcycle")
+        lot.park("motorcycle")
+        # Runs are 0-3 and 5-7.
+        assert lot.park("car") == car
+        assert {lot.park("van") for _ in vans} == vans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare placement policies by how many arrivals get parked."
+    )
+    parser.add_argument("--spaces", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--arrival-rate", type=float, default=0.6)
+    parser.add_argument(
+        "--compact", action="store_true", help="Use CompactParkingLot (needs NumPy)."
+    )
+    args = parser.parse_args()
+    for policy in PLACEMENT_POLICIES:
+        rates = simulate(
+            policy, args.spaces, args.steps, args.seed, args.arrival_rate, args.compact
+        )
+        print(
+            f"{policy:>13}: van {rates['van']:.1%}, car {rates['car']:.1%}, "
+            f"motorcycle {rates['motorcycle']:.1%} parked"
+        )
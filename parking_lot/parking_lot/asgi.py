@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parking_lot.settings")
 
-application = get_asgi_application()
+# Event streams are served outside Django, which can't stream from async code.
+from parking_place.events import with_events  # noqa: E402
+
+application = with_events(get_asgi_application())
@@ -82,9 +82,89 @@ DATABASES = {
         "NAME": os.environ.get("DB_NAME"),
         "USER": os.environ.get("DB_USER"),
         "PASSWORD": os.environ.get("DB_PASS"),
+        # Seconds to keep a connection open between requests; the request path
+        # is a few small queries, so opening one per request would dominate.
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
     }
 }
 
+# Connections are per thread, so this is the most a process opens for the async
+# views' database work. See parking_place.views.db_executor.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+
+# Prepare the queries on the parking path once per connection. Turn off behind a
+# pooler that shares server connections between clients, e.g. PgBouncer in
+# transaction mode. See parking_place/prepared.py.
+DB_PREPARE_STATEMENTS = os.environ.get("DB_PREPARE_STATEMENTS", "1") == "1"
+
+
+# Which empty place a vehicle is given: "lowest-id", or "best-fit" or
+# "protect-runs" to keep runs of car places free for vans. From the database,
+# those two choose among the lowest empty car places only; see
+# parking_place.views.RUN_CANDIDATES.
+PARKING_PLACEMENT_POLICY = os.environ.get("PARKING_PLACEMENT_POLICY", "lowest-id")
+
+# Number of rows each occupancy count is split across, so that concurrent parks
+# don't all update the same counter row. See parking_place.models.OccupancyCounter.
+OCCUPANCY_COUNTER_SLOTS = int(os.environ.get("OCCUPANCY_COUNTER_SLOTS", 8))
+
+# "database" answers every request from the database. "memory" loads each lot
+# into this process and answers from memory, writing changes through to the
+# database every PARKING_ENGINE_FLUSH_INTERVAL seconds (0 for at the end of
+# each request). An error is logged once changes have gone unwritten for
+# PARKING_ENGINE_MAX_LAG seconds. Only one process may serve a lot in memory;
+# see parking_place/engine.py.
+PARKING_BACKEND = os.environ.get("PARKING_BACKEND", "database")
+PARKING_ENGINE_FLUSH_INTERVAL = float(os.environ.get("PARKING_ENGINE_FLUSH_INTERVAL", 0.1))
+PARKING_ENGINE_MAX_LAG = float(os.environ.get("PARKING_ENGINE_MAX_LAG", 60))
+
+# The park, unpark and read views are async. Under ASGI their database work
+# runs in the event loop's worker threads, rather than the one thread Django
+# runs synchronous code in, unless this is set. Tests set it, as a TestCase's
+# data is only visible on its own connection.
+PARKING_DB_THREAD_SENSITIVE = os.environ.get("PARKING_DB_THREAD_SENSITIVE") == "1"
+
+# /events streams each lot's changes, gathered for PARKING_EVENTS_INTERVAL
+# seconds (0 to send each at once), with a keepalive every
+# PARKING_EVENTS_KEEPALIVE seconds of quiet. On PostgreSQL, writes are sent to
+# every process's streams with NOTIFY unless PARKING_EVENTS_NOTIFY is off. See
+# parking_place/events.py.
+PARKING_EVENTS_INTERVAL = float(os.environ.get("PARKING_EVENTS_INTERVAL", 0.1))
+PARKING_EVENTS_KEEPALIVE = float(os.environ.get("PARKING_EVENTS_KEEPALIVE", 15))
+PARKING_EVENTS_NOTIFY = os.environ.get("PARKING_EVENTS_NOTIFY", "1") == "1"
+
+# The read endpoints' answers from the database are cached until the lot next
+# changes, or for PARKING_READ_CACHE_TIMEOUT seconds. The default cache is local
+# to each process; with several, set CACHE_BACKEND and CACHE_LOCATION to a
+# shared one. See parking_place/read_cache.py.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "parking-lot"),
+    }
+}
+PARKING_READ_CACHE = os.environ.get("PARKING_READ_CACHE", "1") == "1"
+PARKING_READ_CACHE_TIMEOUT = float(os.environ.get("PARKING_READ_CACHE_TIMEOUT", 300))
+
+# Changes in free places are logged, and added to per-minute and per-hour
+# rollups for /stats/history, in batches every PARKING_EVENT_LOG_INTERVAL
+# seconds (0 for at each commit). See parking_place/occupancy_log.py.
+PARKING_EVENT_LOG_INTERVAL = float(os.environ.get("PARKING_EVENT_LOG_INTERVAL", 1))
+
+# Unparks and edits to places are written only if the places haven't changed
+# since they were read, and otherwise retried, up to PARKING_WRITE_ATTEMPTS times
+# in all, after a random wait that starts at up to PARKING_WRITE_RETRY_DELAY
+# seconds and doubles each time. See parking_place.models.retry_on_conflict.
+PARKING_WRITE_ATTEMPTS = int(os.environ.get("PARKING_WRITE_ATTEMPTS", 5))
+PARKING_WRITE_RETRY_DELAY = float(os.environ.get("PARKING_WRITE_RETRY_DELAY", 0.005))
+
+# How long /hold keeps a space for a vehicle that hasn't arrived. Expired holds
+# are released in bulk by the expire_holds command, which should be run every
+# few seconds with --every; until then they aren't counted as free.
+PARKING_HOLD_SECONDS = int(os.environ.get("PARKING_HOLD_SECONDS", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -1,17 +1,50 @@
-from django.test import Client, TestCase
+import asyncio
 import json
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from random import Random
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import (
+    AsyncClient,
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from parking_place.models import ParkingPlace
+from parking_place import engine, events, occupancy_log, read_cache, views
+from parking_place.management.commands.load_test import Replay
+from parking_place.models import (
+    ConcurrentUpdate,
+    Lot,
+    OccupancyCounter,
+    OccupancyEvent,
+    OccupancyRollup,
+    ParkingPlace,
+    ParkingSession,
+    retry_on_conflict,
+)
+from parking_place.prepared import Statement
 
 from parking_place.views import (
-    free_space,
-    how_many_spaces_are_vans,
-    is_full,
-    park,
+    claim_car_run,
+    park_in_lot,
     set_place_values,
-    unpark,
 )
 
 
@@ -33,12 +66,24 @@ def create_parking_lot(num_places, **options):
     return lot
 
 
-class ParkingLotApiTests(TestCase):
+class CounterAssertions:
+    def assertCountersMatch(self, lot_id: int) -> None:
+        """Assert that the lot's occupancy counters agree with a count of its places."""
+        self.assertEqual(OccupancyCounter.totals(lot_id), OccupancyCounter.recount(lot_id))
+
+
+@override_settings(PARKING_EVENT_LOG_INTERVAL=0, PARKING_DB_THREAD_SENSITIVE=True)
+class ParkingLotApiTests(CounterAssertions, TestCase):
     """
-    Note that in all following tests the id numbers are dependent on the order
-    in which the tests are run, so it's a bit fragile.
+    Ids are taken from the places each test creates, as the database's id
+    sequence is not reset between tests.
     """
 
+    def setUp(self):
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(occupancy_log.reset)
+
     def test_create_parking_place(self):
         space = create_parking_place()
         self.assertEqual(str(space), "Car:Empty")
@@ -105,7 +150,7 @@ class ParkingLotApiTests(TestCase):
         lot = create_parking_lot(5)
         res = c.get("/park/car/")
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(23, json.loads(res.content)["id"])
+        self.assertEqual(lot[0].id, json.loads(res.content)["id"])
         lot = ParkingPlace.objects.all().order_by("id")
         self.assertEqual(
             [str(l) for l in lot],
@@ -114,10 +159,10 @@ class ParkingLotApiTests(TestCase):
 
     def test_park_car_failure(self):
         c = Client()
-        create_parking_lot(1)
+        lot = create_parking_lot(1)
         res = c.get("/park/car/")
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(22, json.loads(res.content)["id"])
+        self.assertEqual(lot[0].id, json.loads(res.content)["id"])
         res = c.get("/park/car/")
         self.assertEqual(res.status_code, 200)
         self.assertEqual(-1, json.loads(res.content)["id"])
@@ -128,7 +173,7 @@ class ParkingLotApiTests(TestCase):
         set_place_values(lot[4].id, vehicle_type="Van")
         res = c.get("/park/van/")
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(37, json.loads(res.content)["id"])
+        self.assertEqual(lot[4].id, json.loads(res.content)["id"])
         lot = ParkingPlace.objects.all().order_by("id")
         self.assertEqual(
             [str(l) for l in lot],
@@ -140,7 +185,7 @@ class ParkingLotApiTests(TestCase):
         lot = create_parking_lot(5)
         res = c.get("/park/van/")
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(29, json.loads(res.content)["id"])
+        self.assertEqual(lot[1].id, json.loads(res.content)["id"])
         lot = ParkingPlace.objects.all().order_by("id")
         self.assertEqual(
             [str(l) for l in lot],
@@ -154,7 +199,7 @@ class ParkingLotApiTests(TestCase):
         res = c.get("/park/van/")
         self.assertEqual(res.status_code, 200)
         return_id = json.loads(res.content)["id"]
-        self.assertEqual(44, return_id)
+        self.assertEqual(lot[1].id, return_id)
         lot = ParkingPlace.objects.all().order_by("id")
         self.assertEqual(
             [str(l) for l in lot],
@@ -170,3 +215,931 @@ class ParkingLotApiTests(TestCase):
             [str(l) for l in lot],
             ["Car:Empty", "Car:Empty", "Car:Empty", "Car:Empty", "Car:Empty"]
         )
+
+    def test_park_motorcycle_falls_back_to_car_then_van(self):
+        c = Client()
+        lot = create_parking_lot(2)
+        set_place_values(lot[0].id, vehicle_type="Van")
+        res = c.get("/park/motorcycle/")
+        self.assertEqual(lot[1].id, json.loads(res.content)["id"])
+        res = c.get("/park/motorcycle/")
+        self.assertEqual(lot[0].id, json.loads(res.content)["id"])
+        res = c.get("/park/motorcycle/")
+        self.assertEqual(-1, json.loads(res.content)["id"])
+
+    def test_park_van_skips_broken_car_runs(self):
+        c = Client()
+        lot = create_parking_lot(6)
+        set_place_values(lot[2].id, status="Full")
+        res = c.get("/park/van/")
+        self.assertEqual(lot[4].id, json.loads(res.content)["id"])
+        res = c.get("/park/van/")
+        self.assertEqual(-1, json.loads(res.content)["id"])
+
+    def test_best_fit_takes_long_runs_by_id(self):
+        layout = "C" * 14 + "MCCM" + "C" * views.RUN_REACH
+        call_command(
+            "create_parking_lot", "--layout", layout, "--row-length", "40", stdout=StringIO()
+        )
+        ids = list(ParkingPlace.objects.order_by("id").values_list("id", flat=True))
+        with override_settings(PARKING_PLACEMENT_POLICY="best-fit"):
+            parked = [park_in_lot(None, "car") for _ in range(3)]
+        # The run of two first, then runs too long to measure, lowest id first.
+        self.assertEqual([ids[15], ids[16], ids[0]], parked)
+
+    def test_park_bad_vehicle_type(self):
+        c = Client()
+        create_parking_lot(1)
+        res = c.get("/park/bus/")
+        self.assertEqual(-1, json.loads(res.content)["id"])
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 1)
+
+    def test_park_query_count(self):
+        """
+        Parking a car is one claim of a place, locked and skipping any that are
+        locked, one UPDATE, one upsert of the occupancy counters, and one
+        opening the session. A van in car places first fails to claim a van
+        place, then finds a run and locks it. The default lot's id is cached,
+        so it isn't looked up. Any NOTIFY is sent by the UPDATE.
+        """
+        create_parking_lot(5)
+        views.get_lot_id(None)
+        claim = "SELECT id FROM parking_place_parkingplace"
+        update = 'UPDATE "parking_place_parkingplace"'
+        if events.notifying():
+            update = f"WITH updated AS ({update}"
+        write = [
+            update,
+            "INSERT INTO parking_place_occupancycounter",
+            "INSERT INTO parking_place_parkingsession",
+        ]
+        run = [
+            'SELECT level, "row", position',
+            'SELECT "parking_place_parkingplace"."id"',
+        ]
+        for vehicle_type, expected in [("car", [claim]), ("van", [claim] + run)]:
+            with CaptureQueriesContext(connection) as ctx:
+                park_in_lot(None, vehicle_type)
+            queries = [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+            self.assertEqual(len(expected + write), len(queries), queries)
+            for prefix, sql in zip(expected + write, queries):
+                self.assertTrue(sql.startswith(prefix), sql)
+            if connection.features.has_select_for_update_skip_locked:
+                self.assertIn("SKIP LOCKED", queries[0])
+
+    def test_unpark_by_ticket(self):
+        c = Client()
+        lot = create_parking_lot(5)
+        parked = [
+            json.loads(c.get(f"/park/{t}/").content) for t in ["van", "car", "motorcycle"]
+        ]
+        self.assertEqual([lot[1].id, lot[3].id, lot[4].id], [p["id"] for p in parked])
+        van, car, motorcycle = parked
+        self.assertEqual([lot[1].id, lot[0].id, lot[2].id], van["places"])
+        self.assertEqual([lot[3].id], car["places"])
+        session = ParkingSession.objects.get(ticket=van["ticket"])
+        self.assertEqual(("Van", "Car"), (session.vehicle_type, session.place_type))
+        self.assertEqual([lot[1].id, lot[0].id, lot[2].id], session.places)
+        self.assertIsNone(session.left_at)
+
+        # Leaving by ticket is one UPDATE of the session, one of the places,
+        # and the counters; the default lot's id is cached by the parks.
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(views.leave_lot(None, session.ticket))
+        queries = [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(queries), 3)
+        res = c.get(f"/unpark/ticket/{motorcycle['ticket']}/")
+        self.assertTrue(json.loads(res.content)["success"])
+        self.assertEqual(
+            [str(p) for p in ParkingPlace.objects.order_by("id")],
+            ["Car:Empty", "Car:Empty", "Car:Empty", "Car:Full", "Car:Empty"],
+        )
+        self.assertCountersMatch(lot[0].lot_id)
+        # A ticket is good for one unpark, and unparking by space ends it too.
+        res = c.get(f"/unpark/ticket/{van['ticket']}/")
+        self.assertFalse(json.loads(res.content)["success"])
+        self.assertTrue(json.loads(c.get(f"/unpark/{car['id']}/").content)["success"])
+        res = c.get(f"/unpark/ticket/{car['ticket']}/")
+        self.assertFalse(json.loads(res.content)["success"])
+        self.assertFalse(ParkingSession.objects.filter(left_at=None).exists())
+        self.assertEqual(c.get(f"/unpark/ticket/{car['ticket'][:-1]}/").status_code, 404)
+
+    def test_park_replaces_session_left_open(self):
+        c = Client()
+        lot = create_parking_lot(1)
+        old = json.loads(c.get("/park/car/").content)["ticket"]
+        # Emptied outside the api, so its session isn't ended.
+        set_place_values(lot[0].id, status="Empty")
+        new = json.loads(c.get("/park/car/").content)["ticket"]
+        self.assertFalse(json.loads(c.get(f"/unpark/ticket/{old}/").content)["success"])
+        self.assertEqual(ParkingPlace.objects.get().status, "Full")
+        self.assertTrue(json.loads(c.get(f"/unpark/ticket/{new}/").content)["success"])
+
+    def test_hold_and_confirm(self):
+        c = Client()
+        lot = create_parking_lot(5)
+        car = json.loads(c.get("/hold/car/").content)
+        van = json.loads(c.get("/hold/van/").content)
+        self.assertEqual([lot[0].id, lot[2].id], [car["id"], van["id"]])
+        self.assertEqual(
+            [str(p) for p in ParkingPlace.objects.order_by("id")],
+            ["Car:Held", "Car:Held", "Car:Held", "Car:Held", "Car:Empty"],
+        )
+        # Held places aren't free, and can't be parked in or unparked.
+        self.assertEqual({"motorcycle": 0, "car": 1, "van": 0}, json.loads(c.get("/free").content))
+        self.assertEqual(lot[4].id, json.loads(c.get("/park/car/").content)["id"])
+        self.assertEqual(-1, json.loads(c.get("/hold/car/").content)["id"])
+        self.assertFalse(json.loads(c.get(f"/unpark/{car['id']}/").content)["success"])
+
+        self.assertTrue(json.loads(c.get(f"/confirm/{car['hold']}/").content)["success"])
+        self.assertFalse(json.loads(c.get(f"/confirm/{car['hold']}/").content)["success"])
+        self.assertEqual("Car:Full", str(ParkingPlace.objects.get(id=car["id"])))
+        # Expired holds are released in bulk, and can't be confirmed.
+        later = timezone.now() + timedelta(seconds=settings.PARKING_HOLD_SECONDS + 1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertFalse(json.loads(c.get(f"/confirm/{van['hold']}/").content)["success"])
+            out = StringIO()
+            call_command("expire_holds", stdout=out)
+        self.assertIn("1 expired holds released.", out.getvalue())
+        self.assertEqual(
+            [str(p) for p in ParkingPlace.objects.order_by("id")],
+            ["Car:Full", "Car:Empty", "Car:Empty", "Car:Empty", "Car:Full"],
+        )
+        self.assertEqual(0, views.expire_holds(later))
+        # The hold id is the ticket, and a hold can be given up with it too.
+        self.assertTrue(json.loads(c.get(f"/unpark/ticket/{car['hold']}/").content)["success"])
+        van = json.loads(c.get("/hold/van/").content)
+        self.assertTrue(json.loads(c.get(f"/unpark/ticket/{van['hold']}/").content)["success"])
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 4)
+        self.assertCountersMatch(lot[0].lot_id)
+
+    def test_stats_history(self):
+        c = Client()
+        with self.captureOnCommitCallbacks(execute=True):
+            lot = create_parking_lot(5)
+        for path in ["/park/car/", "/park/van/", f"/unpark/{lot[0].id}/"]:
+            with self.captureOnCommitCallbacks(execute=True):
+                c.get(path)
+        # One event per change committed, for the places made and each call.
+        self.assertEqual(8, OccupancyEvent.objects.count())
+        for period, seconds in [("minute", 60), ("hour", 3600)]:
+            rollups = OccupancyRollup.objects.filter(
+                seconds=seconds, vehicle_type="Car"
+            ).values_list("free_change", "taken", "freed")
+            self.assertEqual((2, 4, 6), tuple(map(sum, zip(*rollups))))
+            res = c.get(f"/stats/history?period={period}&periods=3")
+            self.assertEqual(res.status_code, 200)
+            history = json.loads(res.content)
+            self.assertEqual(seconds, history["seconds"])
+            periods = history["periods"]
+            self.assertEqual(3, len(periods))
+            self.assertEqual({"motorcycle": 0, "car": 2, "van": 0}, periods[-1]["free"])
+            self.assertEqual(4, sum(p["taken"]["car"] for p in periods))
+            self.assertEqual(6, sum(p["freed"]["car"] for p in periods))
+            # Counted back to before the places were made.
+            self.assertEqual(0, periods[0]["free"]["car"])
+            self.assertIn("free", history["forecast"])
+        self.assertEqual(c.get("/stats/history?period=day").status_code, 400)
+        self.assertEqual(c.get("/stats/history?periods=0").status_code, 400)
+        self.assertEqual(c.get("/lots/0/stats/history").status_code, 404)
+
+    def test_event_log_failure_does_not_fail_a_park(self):
+        c = Client()
+        create_parking_lot(2)
+        with mock.patch.object(
+            occupancy_log, "write", side_effect=ConnectionError
+        ), self.assertLogs("parking_place.occupancy_log", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = c.get("/park/car/")
+        self.assertEqual(200, res.status_code)
+        # The event is kept, and written with the next.
+        with self.captureOnCommitCallbacks(execute=True):
+            c.get("/park/car/")
+        self.assertEqual(2, OccupancyEvent.objects.count())
+
+    def test_stale_place_is_not_overwritten(self):
+        place = create_parking_place()
+        stale = ParkingPlace.objects.get(id=place.id)
+        set_place_values(place.id, status="Full")
+        stale.vehicle_type = "Van"
+        with self.assertRaises(ConcurrentUpdate):
+            stale.save()
+        self.assertEqual("Car:Full", str(ParkingPlace.objects.get(id=place.id)))
+        self.assertEqual(1, ParkingPlace.objects.get(id=place.id).version)
+        self.assertCountersMatch(place.lot_id)
+
+    @override_settings(PARKING_WRITE_ATTEMPTS=3, PARKING_WRITE_RETRY_DELAY=0.01)
+    def test_retry_on_conflict(self):
+        lot = create_parking_lot(3)
+        van = park_in_lot(None, "van")
+        real_set_statuses = views.set_statuses
+        attempts = []
+
+        def set_statuses_after_another_unpark(lot_id, statuses, versions=None):
+            # The first attempt finds the van unparked since it read the places.
+            if not attempts:
+                ParkingPlace.objects.filter(id=lot[0].id).update(
+                    status="Empty", version=F("version") + 1
+                )
+            attempts.append(statuses)
+            real_set_statuses(lot_id, statuses, versions)
+
+        with mock.patch.object(
+            views, "set_statuses", set_statuses_after_another_unpark
+        ), mock.patch("parking_place.models.time.sleep") as sleep:
+            self.assertEqual([True], views.unpark_in_lot(None, [van]))
+        self.assertEqual(2, len(attempts))
+        self.assertTrue(0 <= sleep.call_args[0][0] <= 0.01)
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 3)
+        self.assertCountersMatch(lot[0].lot_id)
+
+        # Attempts are bounded, with a longer wait allowed before each.
+        conflict = mock.Mock(side_effect=ConcurrentUpdate)
+        with mock.patch("parking_place.models.time.sleep") as sleep:
+            with self.assertRaises(ConcurrentUpdate):
+                retry_on_conflict(conflict)
+        self.assertEqual(3, conflict.call_count)
+        delays = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(2, len(delays))
+        self.assertTrue(0 <= delays[0] <= 0.01 and 0 <= delays[1] <= 0.02)
+
+    def test_park_car_placement_policies(self):
+        c = Client()
+        lot = create_parking_lot(8)
+        # Runs are 0-3 and 5-7.
+        set_place_values(lot[4].id, status="Full")
+        with override_settings(PARKING_PLACEMENT_POLICY="best-fit"):
+            res = c.get("/park/car/")
+        self.assertEqual(lot[5].id, json.loads(res.content)["id"])
+        set_place_values(lot[5].id, status="Empty")
+        with override_settings(PARKING_PLACEMENT_POLICY="protect-runs"):
+            res = c.get("/park/car/")
+        self.assertEqual(lot[0].id, json.loads(res.content)["id"])
+        # Both runs can still hold a van.
+        self.assertNotEqual(-1, json.loads(c.get("/park/van/").content)["id"])
+        self.assertNotEqual(-1, json.loads(c.get("/park/van/").content)["id"])
+
+    def test_stats(self):
+        c = Client()
+        lot = create_parking_lot(6)
+        set_place_values(lot[0].id, "Motorcycle", "Empty")
+        set_place_values(lot[5].id, "Van", "Full")
+        c.get("/park/van/")
+        with CaptureQueriesContext(connection) as ctx:
+            res = c.get("/stats")
+        # Only the counters; the default lot's id is cached by the park.
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            {
+                "free": {"motorcycle": 1, "car": 1, "van": 0},
+                "full": False,
+                "van-usage": 4,
+            },
+            json.loads(res.content),
+        )
+
+    def test_read_cache(self):
+        c = Client()
+        lot = create_parking_lot(3)
+        east = Lot.objects.create(name="east")
+        c.get("/free")
+        with self.assertNumQueries(0):
+            res = c.get("/free")
+            c.get("/is-full")
+        self.assertEqual({"motorcycle": 0, "car": 3, "van": 0}, json.loads(res.content))
+        # Parking changes the lot's version, so the next read is fresh.
+        c.get("/park/car/")
+        res = c.get("/free")
+        self.assertEqual({"motorcycle": 0, "car": 2, "van": 0}, json.loads(res.content))
+        # As does any other change to the lot's places, but not another lot's.
+        set_place_values(lot[2].id, "Van")
+        c.get(f"/lots/{east.id}/park/car/")
+        res = c.get("/free")
+        self.assertEqual({"motorcycle": 0, "car": 1, "van": 1}, json.loads(res.content))
+        c.get("/free")
+        # A lot that doesn't exist is a miss, and isn't cached.
+        self.assertEqual(404, c.get("/lots/0/free").status_code)
+        self.assertEqual(404, c.get("/lots/0/free").status_code)
+        self.assertEqual(
+            {"free": {"hits": 2, "misses": 5}, "is-full": {"hits": 1, "misses": 0}},
+            json.loads(c.get("/cache-stats").content),
+        )
+
+    def test_counters_follow_park_and_unpark(self):
+        c = Client()
+        lot = create_parking_lot(5)
+        set_place_values(lot[4].id, "Motorcycle")
+        van = json.loads(c.get("/park/van/").content)["id"]
+        c.get("/park/motorcycle/")
+        self.assertCountersMatch(lot[0].lot_id)
+        c.get(f"/unpark/{van}/")
+        self.assertCountersMatch(lot[0].lot_id)
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+
+    def test_rebuild_counters(self):
+        lot = create_parking_lot(3)
+        # QuerySet.update bypasses the counters.
+        ParkingPlace.objects.filter(id=lot[0].id).update(status="Full")
+        with self.assertRaises(CommandError):
+            call_command("rebuild_counters", "--check", stdout=StringIO())
+        call_command("rebuild_counters", stdout=StringIO())
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+        self.assertEqual(
+            {("Car", "Empty"): 2, ("Car", "Full"): 1},
+            OccupancyCounter.totals(lot[0].lot_id),
+        )
+
+    def test_places_are_stored_as_codes(self):
+        place = create_parking_place(vehicle_type="Van", status="Full")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT vehicle_type, status FROM parking_place_parkingplace WHERE id = %s",
+                [place.id],
+            )
+            self.assertEqual(cursor.fetchone(), (2, 2))
+        self.assertEqual(
+            ("Van", "Full"),
+            ParkingPlace.objects.values_list("vehicle_type", "status").get(id=place.id),
+        )
+        with self.assertRaises(ValueError):
+            ParkingPlace.objects.filter(status="Parked").count()
+
+    def test_claim_car_run(self):
+        lot = create_parking_lot(9)
+        set_place_values(lot[5].id, status="Full")
+        # Runs are 0-4 and 6-8.
+        lot_id = lot[0].lot_id
+        with transaction.atomic():
+            self.assertEqual([l.id for l in lot[:5]], claim_car_run(lot_id, 5))
+            self.assertEqual([l.id for l in lot[:3]], claim_car_run(lot_id, 3))
+            self.assertIsNone(claim_car_run(lot_id, 6))
+        with override_settings(PARKING_PLACEMENT_POLICY="best-fit"):
+            with transaction.atomic():
+                self.assertEqual([l.id for l in lot[6:]], claim_car_run(lot_id, 3))
+                self.assertEqual([l.id for l in lot[:4]], claim_car_run(lot_id, 4))
+
+    def test_claim_car_run_reads_past_runs_taken(self):
+        lot = create_parking_lot(11)
+        for place in [lot[3], lot[7]]:
+            set_place_values(place.id, status="Full")
+        # Runs are 0-2, 4-6, and 8-10, and the first is taken once it's found.
+        lot_id = lot[0].lot_id
+        car_run_starts = views.car_run_starts
+
+        def taken_meanwhile(*args):
+            starts = car_run_starts(*args)
+            set_place_values(lot[1].id, status="Full")
+            return starts
+
+        with mock.patch.multiple(views, CAR_RUN_BATCH=1, car_run_starts=taken_meanwhile):
+            for policy in ["lowest-id", "best-fit"]:
+                set_place_values(lot[1].id, status="Empty")
+                with override_settings(PARKING_PLACEMENT_POLICY=policy):
+                    with transaction.atomic():
+                        runs = [claim_car_run(lot_id, 3), claim_car_run(lot_id, 4)]
+                self.assertEqual([[l.id for l in lot[4:7]], None], runs)
+
+    def test_park_batch(self):
+        c = Client()
+        lot = create_parking_lot(6)
+        set_place_values(lot[5].id, "Motorcycle")
+        res = c.post(
+            "/park/batch",
+            {"vehicle_types": ["motorcycle", "car", "bus", "van", "motorcycle"]},
+            content_type="application/json",
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [lot[5].id, lot[0].id, -1, lot[3].id, lot[1].id],
+            json.loads(res.content)["ids"],
+        )
+        tickets = json.loads(res.content)["tickets"]
+        self.assertIsNone(tickets[2])
+        self.assertEqual(
+            [lot[5].id, lot[0].id, lot[3].id, lot[1].id],
+            [ParkingSession.objects.get(ticket=t).place_id for t in tickets if t],
+        )
+        lot = ParkingPlace.objects.all().order_by("id")
+        self.assertEqual(
+            [str(l) for l in lot],
+            ["Car:Full", "Car:Full", "Car:Adjacent", "Car:Van", "Car:Adjacent", "Motorcycle:Full"],
+        )
+        self.assertCountersMatch(lot[0].lot_id)
+
+    def test_unpark_batch(self):
+        c = Client()
+        lot = create_parking_lot(5)
+        van = json.loads(c.get("/park/van/").content)["id"]
+        car = json.loads(c.get("/park/car/").content)["id"]
+        res = c.post(
+            "/unpark/batch",
+            {"ids": [van - 1, van, car, car, 0]},
+            content_type="application/json",
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([False, True, True, False, False], json.loads(res.content)["success"])
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 5)
+        self.assertCountersMatch(lot[0].lot_id)
+
+    def test_batch_bad_request(self):
+        c = Client()
+        res = c.post("/park/batch", {"vehicle_types": "car"}, content_type="application/json")
+        self.assertEqual(res.status_code, 400)
+        res = c.post("/unpark/batch", "not json", content_type="application/json")
+        self.assertEqual(res.status_code, 400)
+        res = c.get("/park/batch")
+        self.assertEqual(res.status_code, 405)
+
+    def test_create_parking_lot_command(self):
+        call_command("create_parking_lot", "--layout", "CCV M", "--size", "7", stdout=StringIO())
+        lot = ParkingPlace.objects.all().order_by("id")
+        self.assertEqual(
+            [str(l) for l in lot],
+            [
+                "Car:Empty",
+                "Car:Empty",
+                "Van:Empty",
+                "Motorcycle:Empty",
+                "Car:Empty",
+                "Car:Empty",
+                "Van:Empty",
+            ],
+        )
+        call_command("create_parking_lot", "--vans", "2", "--batch-size", "1", stdout=StringIO())
+        self.assertEqual(ParkingPlace.objects.filter(vehicle_type="Van").count(), 4)
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("create_parking_lot", "--layout", "CB", stdout=StringIO())
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+    def test_create_parking_lot_command_copies(self):
+        # On PostgreSQL places are loaded with COPY, which must fill every
+        # column without a default in the database.
+        call_command(
+            "create_parking_lot", "--layout", "CMV", "--batch-size", "2", stdout=StringIO()
+        )
+        places = ParkingPlace.objects.order_by("position")
+        self.assertEqual(
+            [("Car", 0), ("Motorcycle", 0), ("Van", 0)],
+            list(places.values_list("vehicle_type", "version")),
+        )
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+        res = Client().get("/park/car/")
+        self.assertEqual(res.status_code, 200)
+
+    def test_plan_van_runs_command(self):
+        call_command("create_parking_lot", "--layout", "CCCCM", stdout=StringIO())
+        call_command(
+            "create_parking_lot", "--layout", "CC", "--row", "1", stdout=StringIO()
+        )
+        c = Client()
+        places = [json.loads(c.get("/park/car/").content)["id"] for _ in range(4)]
+        c.get(f"/unpark/{places[1]}/")
+        # Row 0 is cCccM and row 1 CC, which isn't a run for a van, as the rows
+        # aren't adjacent. Two cars must move to row 1 to open one in row 0.
+        out = StringIO()
+        call_command("plan_van_runs", "1", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertIn("row 1, position 0", lines[1])
+        self.assertIn("row 1, position 1", lines[3])
+        self.assertIn("1 runs for vans in lot default after 2 moves.", lines[-1])
+        with self.assertRaises(CommandError):
+            call_command("plan_van_runs", "2", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("plan_van_runs", "1", "--lot", "nowhere", stdout=StringIO())
+
+    def test_lots_are_independent(self):
+        c = Client()
+        create_parking_lot(3)
+        east = Lot.objects.create(name="east")
+        # Placed out of id order: adjacency comes from positions in a row.
+        for position in [2, 0, 3, 1]:
+            create_parking_place(lot=east, row=1, position=position)
+        create_parking_place(lot=east, row=2)
+        places = ParkingPlace.objects.filter(lot=east).order_by("row", "position")
+        res = c.get(f"/lots/{east.id}/park/van/")
+        self.assertEqual(places[1].id, json.loads(res.content)["id"])
+        self.assertEqual(
+            [str(p) for p in places],
+            ["Car:Adjacent", "Car:Van", "Car:Adjacent", "Car:Empty", "Car:Empty"],
+        )
+        # The last place of row 1 and the one place in row 2 are not adjacent.
+        res = c.get(f"/lots/{east.id}/park/van/")
+        self.assertEqual(-1, json.loads(res.content)["id"])
+        res = c.get(f"/lots/{east.id}/stats")
+        self.assertEqual({"motorcycle": 0, "car": 2, "van": 0}, json.loads(res.content)["free"])
+        # The default lot is untouched, and can't unpark the other lot's van.
+        res = c.get("/stats")
+        self.assertEqual({"motorcycle": 0, "car": 3, "van": 0}, json.loads(res.content)["free"])
+        res = c.get(f"/unpark/{places[1].id}/")
+        self.assertFalse(json.loads(res.content)["success"])
+        res = c.get(f"/lots/{east.id}/unpark/{places[1].id}/")
+        self.assertTrue(json.loads(res.content)["success"])
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 8)
+        self.assertCountersMatch(east.id)
+        self.assertEqual(c.get("/lots/0/stats").status_code, 404)
+
+    def test_create_parking_lot_command_rows(self):
+        call_command(
+            "create_parking_lot", "--lot", "west", "--size", "5", "--layout", "C",
+            "--level", "1", "--row-length", "2", stdout=StringIO(),
+        )
+        west = Lot.objects.get(name="west")
+        self.assertEqual(
+            [(1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1), (1, 2, 0)],
+            list(
+                ParkingPlace.objects.filter(lot=west)
+                .order_by("id")
+                .values_list("level", "row", "position")
+            ),
+        )
+        self.assertEqual(0, ParkingPlace.objects.exclude(lot=west).count())
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+
+    def test_prepared_statement_placeholders(self):
+        statement = Statement("example", "SELECT %s WHERE x %% 3 = %s AND y = %s")
+        self.assertEqual("SELECT $1 WHERE x % 3 = $2 AND y = $3", statement.server_sql)
+        self.assertEqual(3, statement.params)
+        # Elsewhere than PostgreSQL, statements run as plain SQL.
+        with connection.cursor() as cursor:
+            statement = Statement("example", "SELECT %s %% 3")
+            statement.execute(cursor, [7])
+            self.assertEqual((1,), cursor.fetchone())
+
+    async def test_async_views(self):
+        lot = await sync_to_async(create_parking_lot)(5)
+        c = AsyncClient()
+        ids = await asyncio.gather(*[c.get("/park/car/") for _ in range(6)])
+        ids = sorted(json.loads(res.content)["id"] for res in ids)
+        self.assertEqual([-1] + [l.id for l in lot], ids)
+        res = await c.get("/is-full")
+        self.assertTrue(json.loads(res.content)["full"])
+        res = await c.get(f"/unpark/{lot[2].id}/")
+        self.assertTrue(json.loads(res.content)["success"])
+        res = await c.get("/free")
+        self.assertEqual({"motorcycle": 0, "car": 1, "van": 0}, json.loads(res.content))
+
+
+@override_settings(
+    PARKING_BACKEND="memory",
+    PARKING_ENGINE_FLUSH_INTERVAL=0,
+    PARKING_EVENT_LOG_INTERVAL=0,
+    PARKING_DB_THREAD_SENSITIVE=True,
+)
+class MemoryBackendTests(CounterAssertions, TestCase):
+    """The api with lots held in memory and written through to the database."""
+
+    def setUp(self):
+        engine.reset()
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(engine.reset)
+        self.addCleanup(occupancy_log.reset)
+
+    def test_memory_backend_matches_database(self):
+        layout = "CCCCVCCMCCCCCCVMCCC"
+        for policy in ["lowest-id", "best-fit", "protect-runs"]:
+            with self.subTest(policy=policy), override_settings(
+                PARKING_PLACEMENT_POLICY=policy
+            ):
+                lots = []
+                for backend in ["database", "memory"]:
+                    name = f"{policy}-{backend}"
+                    call_command(
+                        "create_parking_lot", "--lot", name, "--layout", layout,
+                        "--row-length", "10", stdout=StringIO(),
+                    )
+                    lots.append(Lot.objects.get(name=name))
+                # Replay the same requests against both lots, by place number.
+                results = {}
+                for backend, lot in zip(["database", "memory"], lots):
+                    ids = list(lot.places.order_by("id").values_list("id", flat=True))
+                    rng = Random(0)
+                    c = Client()
+                    results[backend] = []
+                    with override_settings(PARKING_BACKEND=backend):
+                        for _ in range(200):
+                            if rng.random() < 0.6:
+                                vehicle_type = rng.choice(["motorcycle", "car", "van"])
+                                res = c.get(f"/lots/{lot.id}/park/{vehicle_type}/")
+                                places = json.loads(res.content)["places"]
+                                results[backend].append([ids.index(p) for p in places])
+                            else:
+                                space_number = ids[rng.randrange(len(ids))]
+                                res = c.get(f"/lots/{lot.id}/unpark/{space_number}/")
+                                results[backend].append(json.loads(res.content)["success"])
+                        results[backend].append(
+                            json.loads(c.get(f"/lots/{lot.id}/stats").content)
+                        )
+                self.assertEqual(results["database"], results["memory"])
+                self.assertEqual(
+                    [str(p) for p in lots[0].places.order_by("id")],
+                    [str(p) for p in lots[1].places.order_by("id")],
+                )
+                call_command("rebuild_counters", "--check", stdout=StringIO())
+
+    def test_writer_reports_changes_left_unwritten(self):
+        lot = create_parking_lot(2)
+        writer = engine.Writer(1, max_lag=0)
+        writer.submit({lot[0].id: "Full"}, Counter())
+        with mock.patch.object(
+            OccupancyCounter, "adjust", side_effect=ConnectionError
+        ), self.assertLogs("parking_place.engine", "ERROR") as logs:
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    writer.flush()
+        # Reported once, and kept to retry.
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual({lot[0].id: "Full"}, writer.statuses)
+        with self.assertLogs("parking_place.engine", "WARNING"):
+            writer.flush()
+        self.assertEqual("Car:Full", str(ParkingPlace.objects.get(id=lot[0].id)))
+        self.assertIsNone(writer.failing_since)
+
+    def test_reads_are_served_from_memory(self):
+        c = Client()
+        create_parking_lot(5)
+        c.get("/park/van/")
+        with self.assertNumQueries(0):
+            res = c.get("/stats")
+        self.assertEqual(
+            {"free": {"motorcycle": 0, "car": 2, "van": 0}, "full": False, "van-usage": 3},
+            json.loads(res.content),
+        )
+        self.assertEqual(c.get("/lots/0/stats").status_code, 404)
+
+    @override_settings(PARKING_ENGINE_FLUSH_INTERVAL=3600)
+    def test_changes_are_written_in_batches(self):
+        c = Client()
+        lot = create_parking_lot(5)
+        c.get("/stats")
+        with self.assertNumQueries(0):
+            car = json.loads(c.get("/park/car/").content)["id"]
+            c.get(f"/unpark/{car}/")
+            c.get("/park/car/")
+            c.post(
+                "/park/batch",
+                {"vehicle_types": ["car", "motorcycle"]},
+                content_type="application/json",
+            )
+        self.assertEqual(ParkingPlace.objects.filter(status="Empty").count(), 5)
+        with CaptureQueriesContext(connection) as ctx:
+            engine.get_writer().flush()
+        queries = [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+        # One UPDATE for the places now full and one upsert of the counters.
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            [str(l) for l in ParkingPlace.objects.order_by("id")],
+            ["Car:Full", "Car:Full", "Car:Full", "Car:Empty", "Car:Empty"],
+        )
+        self.assertCountersMatch(lot[0].lot_id)
+
+    @override_settings(PARKING_ENGINE_FLUSH_INTERVAL=3600)
+    async def test_async_views_answer_from_memory(self):
+        lot = await sync_to_async(create_parking_lot)(100)
+        c = AsyncClient()
+        await c.get("/stats")
+        # Nothing is handed to a thread, and the ORM refuses to run on the loop.
+        with mock.patch.object(views, "in_db_thread", side_effect=AssertionError):
+            responses = await asyncio.gather(
+                *[c.get("/park/car/") for _ in range(101)], c.get("/vans-usage")
+            )
+        ids = sorted(json.loads(res.content)["id"] for res in responses[:-1])
+        self.assertEqual([-1] + [l.id for l in lot], ids)
+        await sync_to_async(engine.get_writer().flush)()
+        self.assertEqual(
+            100, await sync_to_async(ParkingPlace.objects.filter(status="Full").count)()
+        )
+
+
+def read_event(chunk: bytes) -> dict:
+    """Return the event in one chunk of a text/event-stream."""
+    data = chunk.decode()
+    assert data.startswith("data: ") and data.endswith("\n\n"), data
+    return json.loads(data[len("data: ") :])
+
+
+@override_settings(
+    PARKING_EVENTS_INTERVAL=0,
+    PARKING_EVENTS_NOTIFY=False,
+    PARKING_EVENT_LOG_INTERVAL=0,
+    PARKING_DB_THREAD_SENSITIVE=True,
+)
+class EventStreamTests(TestCase):
+    """Changes reach the streams in this process, as a NOTIFY needs a commit."""
+
+    def setUp(self):
+        events.reset()
+        engine.reset()
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(engine.reset)
+        self.addCleanup(events.reset)
+        self.addCleanup(occupancy_log.reset)
+
+    def test_event_stream(self):
+        lot = create_parking_lot(4)
+        c = Client()
+        res = c.get("/events")
+        self.assertEqual("text/event-stream", res["Content-Type"])
+        stream = iter(res.streaming_content)
+        self.assertEqual(
+            {
+                "free": {"motorcycle": 0, "car": 4, "van": 0},
+                "full": False,
+                "van-usage": 0,
+                "places": {},
+            },
+            read_event(next(stream)),
+        )
+        # Changes are sent once committed.
+        with self.captureOnCommitCallbacks(execute=True):
+            c.get("/park/van/")
+        event = read_event(next(stream))
+        self.assertEqual(
+            {str(lot[0].id): "Adjacent", str(lot[1].id): "Van", str(lot[2].id): "Adjacent"},
+            event["places"],
+        )
+        self.assertEqual({"motorcycle": 0, "car": 1, "van": 0}, event["free"])
+        self.assertEqual(3, event["van-usage"])
+        res.close()
+        self.assertFalse(events.get_broadcaster().is_watched(lot[0].lot_id))
+        self.assertEqual(404, c.get("/lots/0/events").status_code)
+
+    @override_settings(PARKING_BACKEND="memory", PARKING_ENGINE_FLUSH_INTERVAL=0)
+    async def test_asgi_event_stream(self):
+        lot = await sync_to_async(create_parking_lot)(2)
+        application = events.with_events(None)
+        sent = asyncio.Queue()
+        hung_up = asyncio.Event()
+
+        async def receive():
+            await hung_up.wait()
+            return {"type": "http.disconnect"}
+
+        scope = {"type": "http", "method": "GET", "path": "/events"}
+        task = asyncio.ensure_future(application(scope, receive, sent.put))
+        self.assertEqual(200, (await sent.get())["status"])
+        self.assertEqual(2, read_event((await sent.get())["body"])["free"]["car"])
+        await AsyncClient().get("/park/car/")
+        event = read_event((await sent.get())["body"])
+        self.assertEqual({str(lot[0].id): "Full"}, event["places"])
+        self.assertEqual(1, event["free"]["car"])
+        hung_up.set()
+        await asyncio.wait_for(task, 5)
+        self.assertFalse(events.get_broadcaster().is_watched(lot[0].lot_id))
+        scope["path"] = "/lots/0/events"
+        await application(scope, receive, sent.put)
+        self.assertEqual(404, (await sent.get())["status"])
+
+
+@skipUnless(connection.vendor == "postgresql", "NOTIFY needs PostgreSQL")
+@override_settings(
+    PARKING_EVENTS_INTERVAL=0,
+    PARKING_EVENTS_KEEPALIVE=0.5,
+    PARKING_EVENTS_NOTIFY=True,
+    PARKING_EVENT_LOG_INTERVAL=0,
+)
+class NotifyEventStreamTests(TransactionTestCase):
+    """Changes reach the streams by NOTIFY, which is delivered once committed."""
+
+    def setUp(self):
+        events.reset()
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(events.reset)
+        self.addCleanup(occupancy_log.reset)
+
+    def test_notified_changes_are_sent_at_once(self):
+        lot = create_parking_lot(4)
+        stream = events.stream(lot[0].lot_id)
+        self.assertEqual({}, read_event(next(stream))["places"])
+        # A park before the listener LISTENs isn't heard, so park until one is.
+        parked = []
+        for _ in range(4):
+            parked.append(park_in_lot(None, "car"))
+            chunk = next(stream)
+            if chunk != events.sse(None):
+                break
+        else:
+            self.fail("No change was sent.")
+        event = read_event(chunk)
+        self.assertTrue(event["places"])
+        for place, status in event["places"].items():
+            self.assertIn(int(place), parked)
+            self.assertEqual("Full", status)
+        stream.close()
+        self.assertFalse(events.get_broadcaster().is_watched(lot[0].lot_id))
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+@override_settings(PARKING_EVENT_LOG_INTERVAL=0)
+class ConcurrencyTests(TransactionTestCase):
+    """
+    Parks and unparks from many threads at once, each with its own connection.
+    SQLite allows only one writer at a time, so this needs PostgreSQL.
+    """
+
+    THREADS = 8
+    CALLS = 60
+
+    def setUp(self):
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(occupancy_log.reset)
+
+    def test_concurrent_parks_and_unparks_keep_counters_consistent(self):
+        call_command(
+            "create_parking_lot", "--layout", "CCCCMV", "--size", "48", stdout=StringIO()
+        )
+        lot_id = Lot.default().id
+        ids = list(ParkingPlace.objects.values_list("id", flat=True))
+        everyone = threading.Barrier(self.THREADS, timeout=30)
+        lock = threading.Lock()
+        outcomes = Counter()
+
+        def work(seed):
+            rng = Random(seed)
+            tickets = []
+            everyone.wait()
+            try:
+                for _ in range(self.CALLS):
+                    r = rng.random()
+                    if r < 0.5:
+                        ticket = uuid.uuid4()
+                        vehicle_type = rng.choice(["motorcycle", "car", "van"])
+                        if views.park_in_lot(lot_id, vehicle_type, ticket) != -1:
+                            tickets.append(ticket)
+                            with lock:
+                                outcomes["parked"] += 1
+                    elif r < 0.7 and tickets:
+                        ticket = tickets.pop(rng.randrange(len(tickets)))
+                        if views.leave_lot(lot_id, ticket):
+                            with lock:
+                                outcomes["left"] += 1
+                    else:
+                        # Any space at all, so threads race to unpark the same
+                        # vehicle, including those parked under another's ticket.
+                        views.unpark_in_lot(lot_id, [rng.choice(ids)])
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            list(pool.map(work, range(self.THREADS)))
+
+        self.assertGreater(outcomes["parked"], 0)
+        self.assertGreater(outcomes["left"], 0)
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+        statuses = Counter(ParkingPlace.objects.values_list("status", flat=True))
+        # Each van in car places still has both its sides, and every vehicle
+        # still parked has the one session that's still open.
+        self.assertEqual(2 * statuses["Van"], statuses["Adjacent"])
+        self.assertEqual(
+            ParkingSession.objects.filter(left_at=None).count(),
+            statuses["Full"] + statuses["Van"],
+        )
+
+
+@override_settings(PARKING_EVENT_LOG_INTERVAL=0)
+class LoadTestCommandTests(TransactionTestCase):
+    """load_test serves the project from its own threads, so data is committed."""
+
+    def setUp(self):
+        read_cache.reset()
+        occupancy_log.reset()
+        self.addCleanup(occupancy_log.reset)
+
+    def test_load_test_replays_a_stream(self):
+        out = StringIO()
+        call_command("load_test", "--generate", "200", "--seed", "3", stdout=out)
+        ops = Counter(json.loads(line)["op"] for line in out.getvalue().splitlines())
+        self.assertEqual(200, sum(ops.values()))
+        self.assertTrue(ops["park"] and ops["unpark"])
+        call_command(
+            "create_parking_lot", "--layout", "CCCCMV", "--size", "60", stdout=StringIO()
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as stream:
+            stream.write(out.getvalue())
+            stream.flush()
+            out = StringIO()
+            call_command(
+                "load_test", stream.name, "--serve", "--workers", "1", stdout=out
+            )
+        report = out.getvalue()
+        self.assertIn("200 calls in", report)
+        self.assertRegex(report, r"park: +\d+ calls, p50 [\d.]+ ms, p95 [\d.]+ ms, p99")
+        self.assertNotIn("error", report)
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+
+    def test_load_test_checks_every_place_a_van_takes(self):
+        replay = Replay("localhost", 0, "")
+        van = {"op": "park", "vehicle_type": "van"}
+        replay.record({**van, "key": "v1"}, {"id": 2, "places": [2, 1, 3]}, 0.0)
+        replay.record({**van, "key": "v2"}, {"id": 4, "places": [4, 3, 5]}, 0.0)
+        self.assertEqual(
+            ["place 3 given to v2 while held by v1"], replay.double_allocations
+        )
+        self.assertEqual("/unpark/2/", replay.path({"op": "unpark", "key": "v1"}))
+        self.assertEqual({4: "v2", 3: "v2", 5: "v2"}, replay.holders)
@@ -5,10 +5,25 @@ from parking_place import views
 
 app_name = "parking_lot"
 
-urlpatterns = [
+# The api for one lot. At the top level it acts on the default lot.
+lot_patterns = [
+    path("park/batch", views.park_batch),
     path("park/<str:vehicle_type>/", views.park),
     path("vans-usage", views.how_many_spaces_are_vans),
     path("free", views.free_space),
     path("is-full", views.is_full),
+    path("stats", views.stats),
+    path("stats/history", views.stats_history),
+    path("events", views.event_stream),
+    path("unpark/batch", views.unpark_batch),
     path("unpark/<int:space_number>/", views.unpark),
+    path("unpark/ticket/<uuid:ticket>/", views.unpark_ticket),
+    path("hold/<str:vehicle_type>/", views.hold),
+    path("confirm/<uuid:hold_id>/", views.confirm),
+]
+
+urlpatterns = [
+    path("cache-stats", views.cache_stats),
+    path("", include(lot_patterns)),
+    path("lots/<int:lot_id>/", include(lot_patterns)),
 ]
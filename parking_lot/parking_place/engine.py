@@ -0,0 +1,416 @@
+"""
+The in-memory backend, used when settings.PARKING_BACKEND is "memory".
+
+Each lot is loaded from its places into a LotEngine the first time a request
+needs it, and from then on this process answers parks, unparks, and the read
+endpoints from memory, in the manner of ParkingLot in parking_lot.py. Every
+change is also queued for the database and written through in batches by a
+background thread, every settings.PARKING_ENGINE_FLUSH_INTERVAL seconds, or at
+the end of each request if that is 0.
+
+Consistency model:
+    - Exactly one process may own a lot. Its memory is the truth for that lot;
+      other processes, and the database backend, must not change its places
+      while it runs, or the two will disagree.
+    - The database lags memory by at most one flush interval, plus the time a
+      flush takes. Each flush is one transaction, so the database always holds
+      a state memory was in, counters included.
+    - A crash loses the changes not yet flushed. A failed flush is retried
+      with the next one, on a fresh connection if the old one broke, and an
+      error is logged once changes have gone unwritten for
+      settings.PARKING_ENGINE_MAX_LAG seconds.
+    - Places added to a lot after it was loaded aren't seen until reset() is
+      called or the process restarts.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+
+from parking_place import events
+from parking_place.models import (
+    SPACE_PREFERENCE,
+    Lot,
+    OccupancyCounter,
+    ParkingPlace,
+)
+from parking_place.runs import VAN_RUN_LENGTH, OpenRuns
+
+logger = logging.getLogger(__name__)
+
+PLACEMENT_POLICIES = ("lowest-id", "best-fit", "protect-runs")
+
+
+class LotEngine:
+    """
+    One lot's places, held in memory. Places are numbered by slot in (level,
+    row, position) order, with a slot left empty wherever two places aren't
+    adjacent, so places are adjacent exactly when their slots are consecutive.
+
+    Public methods take the engine's lock, so one engine may be shared by the
+    threads of a process.
+    """
+
+    def __init__(
+        self,
+        lot_id: int,
+        places: Iterable[Tuple[int, str, str, int, int, int]],
+        policy: str,
+        writer: "Writer",
+    ):
+        """places holds (id, vehicle_type, status, level, row, position) for each place."""
+        if policy not in PLACEMENT_POLICIES:
+            raise ImproperlyConfigured(f"Unknown placement policy: {policy}")
+        self.lot_id = lot_id
+        self.policy = policy
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.places: Dict[int, List[str]] = {}
+        # Ids of the empty places of each vehicle_type, sorted.
+        self.open: Dict[str, List[int]] = {t: [] for t in ("Motorcycle", "Car", "Van")}
+        self.counts: Counter = Counter()
+        self.slot_of: Dict[int, int] = {}
+        self.id_at: Dict[int, int] = {}
+        self.open_car_runs = OpenRuns()
+        slot = -2
+        last = None
+        for place_id, vehicle_type, status, level, row, position in sorted(
+            places, key=lambda p: p[3:]
+        ):
+            slot += 1 if last == (level, row, position - 1) else 2
+            last = (level, row, position)
+            self.slot_of[place_id] = slot
+            self.id_at[slot] = place_id
+            self.places[place_id] = [vehicle_type, status]
+            self.counts[(vehicle_type, status)] += 1
+            if status == "Empty":
+                self.open[vehicle_type].append(place_id)
+                if vehicle_type == "Car":
+                    self.open_car_runs.add(slot)
+        for ids in self.open.values():
+            ids.sort()
+        # Changes made by the current call, handed to the writer when it ends.
+        self.statuses: Dict[int, str] = {}
+        self.changes: Counter = Counter()
+
+    @classmethod
+    def load(cls, lot_id: int, writer: "Writer") -> "LotEngine":
+        return cls(
+            lot_id,
+            ParkingPlace.objects.filter(lot_id=lot_id).values_list(
+                "id", "vehicle_type", "status", "level", "row", "position"
+            ),
+            settings.PARKING_PLACEMENT_POLICY,
+            writer,
+        )
+
+    def _set_status(self, place_id: int, status: str) -> None:
+        place = self.places[place_id]
+        vehicle_type, old_status = place
+        if old_status == status:
+            return
+        if old_status == "Empty":
+            ids = self.open[vehicle_type]
+            del ids[bisect_left(ids, place_id)]
+            if vehicle_type == "Car":
+                self.open_car_runs.remove(self.slot_of[place_id])
+        elif status == "Empty":
+            insort(self.open[vehicle_type], place_id)
+            if vehicle_type == "Car":
+                self.open_car_runs.add(self.slot_of[place_id])
+        place[1] = status
+        self.counts[(vehicle_type, old_status)] -= 1
+        self.counts[(vehicle_type, status)] += 1
+        self.statuses[place_id] = status
+        self.changes[(self.lot_id, vehicle_type, old_status)] -= 1
+        self.changes[(self.lot_id, vehicle_type, status)] += 1
+
+    def _submit(self) -> Dict[int, str]:
+        """Hand the call's changes to the writer, and return the statuses it set."""
+        statuses = self.statuses
+        self.writer.submit(statuses, self.changes)
+        self.statuses = {}
+        self.changes = Counter()
+        return statuses
+
+    def _announce(self, statuses: Dict[int, str]) -> None:
+        """Send a call's changes to the lot's event streams, once the lock is released."""
+        if statuses:
+            events.get_broadcaster().changed(self.lot_id, statuses)
+
+    def _choose_car_place(self) -> int:
+        """Return the empty car place the placement policy would take next."""
+        if self.policy == "lowest-id":
+            return self.open["Car"][0]
+        runs = self.open_car_runs
+        if self.policy == "best-fit":
+            length = min(runs.runs_by_length)
+        else:
+            # protect-runs: first runs too short for a van, then runs whose
+            # length isn't a multiple of a van's.
+            length = min(
+                runs.runs_by_length,
+                key=lambda n: (n >= runs.min_length, n % runs.min_length == 0, n),
+            )
+        return self.id_at[min(runs.runs_by_length[length])]
+
+    def _choose_van_run(self) -> Optional[int]:
+        """Return the first slot of the run of car places a van should take."""
+        runs = self.open_car_runs
+        if not runs.long_runs:
+            return None
+        if self.policy == "lowest-id":
+            return min(runs.long_runs, key=self.id_at.__getitem__)
+        length = min(n for n in runs.runs_by_length if n >= runs.min_length)
+        return min(runs.runs_by_length[length])
+
+    def _park(self, vehicle_type: str) -> int:
+        vehicle_type = vehicle_type.lower()
+        if vehicle_type not in SPACE_PREFERENCE:
+            return -1
+        for place_type in SPACE_PREFERENCE[vehicle_type]:
+            if self.open[place_type]:
+                if place_type == "Car":
+                    space_number = self._choose_car_place()
+                else:
+                    space_number = self.open[place_type][0]
+                self._set_status(space_number, "Full")
+                return space_number
+        if vehicle_type != "van":
+            return -1
+        start = self._choose_van_run()
+        if start is None:
+            return -1
+        run = [self.id_at[start + i] for i in range(VAN_RUN_LENGTH)]
+        for place_id in run:
+            self._set_status(place_id, "Adjacent")
+        self._set_status(run[1], "Van")
+        return run[1]
+
+    def _unpark(self, space_number: int) -> List[int]:
+        """Empty a space and return the places freed, none if it can't be unparked."""
+        place = self.places.get(space_number)
+        if place is None or place[1] in ("Adjacent", "Held"):
+            # An adjacent place is freed through the van's middle place, and a
+            # held one through its hold.
+            return []
+        freed = [space_number]
+        if place[1] == "Van":
+            slot = self.slot_of[space_number]
+            freed += [self.id_at[slot - 1], self.id_at[slot + 1]]
+        for place_id in freed:
+            self._set_status(place_id, "Empty")
+        return freed
+
+    def park(self, vehicle_type: str) -> int:
+        """Park one vehicle, as views.park_vehicle does, and return its space number or -1."""
+        places = self.park_places(vehicle_type)
+        return places[0] if places else -1
+
+    def park_places(self, vehicle_type: str) -> List[int]:
+        """Park one vehicle and return the places it takes, its space number first."""
+        with self.lock:
+            space_number = self._park(vehicle_type)
+            statuses = self._submit()
+        self._announce(statuses)
+        if space_number == -1:
+            return []
+        return [space_number] + [place for place in statuses if place != space_number]
+
+    def park_many(self, vehicle_types: List[str]) -> List[int]:
+        """Park each vehicle in turn and return their space numbers, -1 for any that didn't fit."""
+        with self.lock:
+            space_numbers = [self._park(t) for t in vehicle_types]
+            statuses = self._submit()
+        self._announce(statuses)
+        return space_numbers
+
+    def unpark(self, space_numbers: List[int]) -> List[bool]:
+        """Empty the given spaces and return, for each, whether a vehicle was removed."""
+        successes = []
+        freed = set()
+        with self.lock:
+            for space_number in space_numbers:
+                # As in views.unpark_places, a space can only be freed once.
+                if space_number in freed:
+                    successes.append(False)
+                    continue
+                places = self._unpark(space_number)
+                freed.update(places)
+                successes.append(bool(places))
+            statuses = self._submit()
+        self._announce(statuses)
+        return successes
+
+    def stats(self) -> dict:
+        """Return what views.lot_stats would, from memory."""
+        counts = self.counts
+        free = {
+            "motorcycle": counts[("Motorcycle", "Empty")],
+            "car": counts[("Car", "Empty")],
+            "van": counts[("Van", "Empty")],
+        }
+        return {
+            "free": free,
+            "full": sum(free.values()) == 0,
+            # Each van in car places has two adjacent places and takes three.
+            "van-usage": counts[("Van", "Full")] + counts[("Car", "Adjacent")] // 2 * 3,
+        }
+
+
+class Writer:
+    """
+    Writes the engines' changes to the database. Changes are merged as they
+    arrive, so a place changed several times between flushes is written once,
+    and each flush is one UPDATE per status plus one counter upsert.
+    """
+
+    def __init__(self, interval: float, max_lag: float):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.lock = threading.Lock()
+        self.statuses: Dict[int, str] = {}
+        self.changes: Counter = Counter()
+        self.thread: Optional[threading.Thread] = None
+        # When the first of a run of failed flushes failed, and whether that
+        # run has been reported as too long.
+        self.failing_since: Optional[float] = None
+        self.reported = False
+
+    def submit(self, statuses: Dict[int, str], changes: Counter) -> None:
+        with self.lock:
+            self.statuses.update(statuses)
+            self.changes.update(changes)
+            if self.interval > 0 and self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="parking-engine-writer", daemon=True
+                )
+                self.thread.start()
+        if self.interval <= 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write every pending change in one transaction."""
+        with self.lock:
+            statuses, self.statuses = self.statuses, {}
+            changes, self.changes = self.changes, Counter()
+        if not statuses:
+            return
+        try:
+            by_status: Dict[str, List[int]] = {}
+            for place_id, status in statuses.items():
+                by_status.setdefault(status, []).append(place_id)
+            with transaction.atomic():
+                for status, ids in by_status.items():
+                    ParkingPlace.objects.filter(id__in=ids).update(
+                        status=status, version=F("version") + 1
+                    )
+                OccupancyCounter.adjust(changes)
+        except Exception:
+            # Put the changes back, under any made since, to retry next time.
+            with self.lock:
+                self.statuses = {**statuses, **self.statuses}
+                self.changes.update(changes)
+            self.failed(len(statuses))
+            raise
+        if self.reported:
+            logger.warning(
+                "Parking changes written after %.0f seconds; the database has "
+                "caught up with memory.",
+                time.monotonic() - self.failing_since,
+            )
+        self.failing_since = None
+        self.reported = False
+
+    def failed(self, unwritten: int) -> None:
+        """Note a failed flush, and report changes left unwritten too long, once."""
+        now = time.monotonic()
+        if self.failing_since is None:
+            self.failing_since = now
+        if not self.reported and now - self.failing_since >= self.max_lag:
+            self.reported = True
+            logger.error(
+                "Changes to %d parking places have gone unwritten for %.0f "
+                "seconds; the database is behind memory until they're written.",
+                unwritten,
+                now - self.failing_since,
+            )
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            # Replace a connection broken by a database restart or an idle
+            # timeout, as at the start of a request, rather than fail every
+            # flush on it.
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't write parking changes; will retry.")
+
+
+_engines: Dict[int, LotEngine] = {}
+_default_lot_id: Optional[int] = None
+_writer: Optional[Writer] = None
+_registry_lock = threading.Lock()
+
+
+def get_writer() -> Writer:
+    global _writer
+    with _registry_lock:
+        if _writer is None:
+            _writer = Writer(
+                settings.PARKING_ENGINE_FLUSH_INTERVAL, settings.PARKING_ENGINE_MAX_LAG
+            )
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def is_loaded(lot_id: Optional[int]) -> bool:
+    """Return whether get_engine can return the lot's engine without a query."""
+    if lot_id is None:
+        lot_id = _default_lot_id
+    return lot_id in _engines
+
+
+def get_engine(lot_id: Optional[int]) -> LotEngine:
+    """
+    Return the engine for the lot a request is for: the one in its url, or the
+    default lot for the top-level routes, loading it if need be. Raise Http404
+    if there is no such lot.
+    """
+    global _default_lot_id
+    if lot_id is None:
+        if _default_lot_id is None:
+            _default_lot_id = Lot.default().id
+        lot_id = _default_lot_id
+    engine = _engines.get(lot_id)
+    if engine is not None:
+        return engine
+    writer = get_writer()
+    with _registry_lock:
+        if lot_id not in _engines:
+            get_object_or_404(Lot, id=lot_id)
+            _engines[lot_id] = LotEngine.load(lot_id, writer)
+        return _engines[lot_id]
+
+
+def reset() -> None:
+    """Write pending changes and forget every engine, so lots are loaded afresh."""
+    global _default_lot_id, _writer
+    if _writer is not None:
+        _writer.flush()
+    with _registry_lock:
+        _engines.clear()
+        _default_lot_id = None
+        _writer = None
@@ -0,0 +1,310 @@
+"""
+A stream of each lot's changes, sent as server-sent events from /events (and
+/lots/<id>/events), so that displays are pushed availability rather than poll
+for it.
+
+A stream opens with the lot's stats, as /stats gives them, under "places": {}.
+Then, whenever places change, it sends the lot's stats again, with "places"
+holding the new status of each place that changed, by id. Changes are gathered
+for settings.PARKING_EVENTS_INTERVAL seconds (0 to send each at once), and the
+stats are read once per lot for every stream in the process, however many
+there are. A comment is sent every PARKING_EVENTS_KEEPALIVE seconds of quiet.
+
+Changes reach the process's Broadcaster in one of two ways:
+    - On PostgreSQL, unless settings.PARKING_EVENTS_NOTIFY is off, each write
+      sends a NOTIFY in the statement that writes the places, which is
+      delivered on commit to every process LISTENing, so every process's
+      streams see every process's writes.
+    - Otherwise, and for lots held in memory (which only one process may
+      serve), changes go straight to this process's Broadcaster once committed.
+
+Django 3.2 can't stream from async code, so under ASGI the streams are served
+by with_events, which wraps the project's application; see asgi.py. Under
+WSGI, views.events serves them, holding a thread for each open stream.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import re
+import select
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.http import Http404
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "parking_places"
+# Places per NOTIFY, keeping each payload well under PostgreSQL's 8000 bytes.
+NOTIFY_CHUNK = 250
+
+EVENTS_PATH = re.compile(r"^/(?:lots/(\d+)/)?events$")
+
+
+def notifying() -> bool:
+    """Return whether changes are sent between processes with NOTIFY."""
+    return connection.vendor == "postgresql" and settings.PARKING_EVENTS_NOTIFY
+
+
+def places_changed(lot_id: int, statuses: Dict[int, str]) -> List[str]:
+    """
+    Announce the new statuses of places written in the current transaction, to
+    be sent to the lot's streams once it commits. When changes are sent with
+    NOTIFY, return the payloads for the caller to send on CHANNEL in the
+    statement that writes the places (see views.set_statuses), so that it costs
+    no round trip of its own; otherwise return none.
+    """
+    if not statuses:
+        return []
+    if notifying():
+        items = list(statuses.items())
+        return [
+            json.dumps({"lot": lot_id, "places": dict(items[i : i + NOTIFY_CHUNK])})
+            for i in range(0, len(items), NOTIFY_CHUNK)
+        ]
+    if get_broadcaster().is_watched(lot_id):
+        transaction.on_commit(lambda: get_broadcaster().changed(lot_id, statuses))
+    return []
+
+
+def sse(event: Optional[dict]) -> bytes:
+    """Return an event in the text/event-stream format, or a keepalive comment for None."""
+    if event is None:
+        return b": keepalive\n\n"
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+class Broadcaster:
+    """
+    Sends each change to every stream watching its lot, from one thread per
+    process. Changes to a lot are merged until the thread next wakes, so a
+    burst of parks costs one read of the lot's stats. With an interval of 0,
+    each change is sent at once, and the thread is only started to LISTEN.
+    """
+
+    def __init__(self, interval: float, stats: Callable[[int], dict]):
+        self.interval = interval
+        self.stats = stats
+        self.lock = threading.Lock()
+        # Each lot's watchers, each a function that takes an event.
+        self.watchers: Dict[int, set] = {}
+        self.pending: Dict[int, Dict[int, str]] = {}
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def watch(self, lot_id: int, deliver: Callable[[dict], None]) -> Callable:
+        """Send the lot's events to deliver until the returned function is called."""
+        with self.lock:
+            self.watchers.setdefault(lot_id, set()).add(deliver)
+            if (self.interval > 0 or notifying()) and self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="parking-events", daemon=True
+                )
+                self.thread.start()
+
+        def unwatch():
+            with self.lock:
+                watchers = self.watchers.get(lot_id, set())
+                watchers.discard(deliver)
+                if not watchers:
+                    self.watchers.pop(lot_id, None)
+
+        return unwatch
+
+    def is_watched(self, lot_id: int) -> bool:
+        return lot_id in self.watchers
+
+    def changed(self, lot_id: int, statuses: Dict[int, str]) -> None:
+        """Note places' new statuses, to be sent to the lot's watchers."""
+        if not self.is_watched(lot_id):
+            return
+        with self.lock:
+            self.pending.setdefault(lot_id, {}).update(statuses)
+        if self.interval > 0:
+            self.wake.set()
+        else:
+            self.send()
+
+    def send(self) -> None:
+        """Send every pending change, with the stats of its lot as they are now."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for lot_id, statuses in pending.items():
+            try:
+                event = {**self.stats(lot_id), "places": statuses}
+            except Exception:
+                logger.exception("Couldn't read the stats of lot %s.", lot_id)
+                continue
+            with self.lock:
+                watchers = list(self.watchers.get(lot_id, ()))
+            for deliver in watchers:
+                deliver(event)
+
+    def run(self) -> None:
+        listener = None
+        while True:
+            try:
+                if notifying() and listener is None:
+                    listener = self.listen()
+                if listener is None:
+                    self.wake.wait()
+                elif self.interval > 0:
+                    # Changes from this process may also come without a NOTIFY.
+                    self.receive(listener, self.interval)
+                else:
+                    # Those are sent at once, so only notifications are waited on.
+                    self.receive(listener, None)
+                self.wake.clear()
+                if self.interval > 0:
+                    # Let a burst of changes gather.
+                    time.sleep(self.interval)
+                if listener is not None:
+                    self.receive(listener, 0)
+                close_old_connections()
+                self.send()
+            except Exception:
+                logger.exception("Couldn't send parking events; will retry.")
+                listener = None
+                time.sleep(1)
+
+    def listen(self):
+        """Return a connection of its own, LISTENing for every process's changes."""
+        listener = connections.create_connection("default")
+        listener.set_autocommit(True)
+        with listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return listener.connection
+
+    def receive(self, listener, timeout: Optional[float]) -> None:
+        """
+        Wait up to timeout seconds (None for as long as it takes) for
+        notifications, and note their changes.
+        """
+        select.select([listener], [], [], timeout)
+        listener.poll()
+        while listener.notifies:
+            payload = json.loads(listener.notifies.pop(0).payload)
+            places = payload["places"]
+            statuses = {int(place): status for place, status in places.items()}
+            if self.is_watched(payload["lot"]):
+                with self.lock:
+                    self.pending.setdefault(payload["lot"], {}).update(statuses)
+
+
+_broadcaster: Optional[Broadcaster] = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster() -> Broadcaster:
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            from parking_place.views import get_stats
+
+            _broadcaster = Broadcaster(settings.PARKING_EVENTS_INTERVAL, get_stats)
+        return _broadcaster
+
+
+def reset() -> None:
+    """Forget the broadcaster, so the next stream starts one with the current settings."""
+    global _broadcaster
+    with _broadcaster_lock:
+        _broadcaster = None
+
+
+def stream(lot_id: int) -> Iterator[bytes]:
+    """Yield a lot's events, for views.events, in the thread reading them."""
+    broadcaster = get_broadcaster()
+    events: queue.Queue = queue.Queue()
+    unwatch = broadcaster.watch(lot_id, events.put)
+    try:
+        yield sse({**broadcaster.stats(lot_id), "places": {}})
+        while True:
+            try:
+                yield sse(events.get(timeout=settings.PARKING_EVENTS_KEEPALIVE))
+            except queue.Empty:
+                yield sse(None)
+    finally:
+        unwatch()
+
+
+def with_events(application):
+    """
+    Return an ASGI application that serves the event streams itself, one task
+    each, and passes every other request to `application`.
+    """
+
+    async def events_application(scope, receive, send):
+        match = scope["type"] == "http" and EVENTS_PATH.match(scope["path"])
+        if not match or scope["method"] != "GET":
+            return await application(scope, receive, send)
+        from parking_place import views
+
+        lot = match.group(1)
+        try:
+            lot_id = await views.in_db_thread(views.get_lot_id)(
+                int(lot) if lot else None
+            )
+        except Http404:
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        unwatch = get_broadcaster().watch(
+            lot_id, lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+        )
+        try:
+            first = await views.call(views.get_stats, lot_id, writes=False)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream"),
+                        (b"cache-control", b"no-cache"),
+                    ],
+                }
+            )
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": sse({**first, "places": {}}),
+                    "more_body": True,
+                }
+            )
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            try:
+                while not disconnected.done():
+                    next_event = asyncio.ensure_future(events.get())
+                    await asyncio.wait(
+                        {next_event, disconnected},
+                        timeout=settings.PARKING_EVENTS_KEEPALIVE,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if next_event.done():
+                        body = sse(next_event.result())
+                    else:
+                        next_event.cancel()
+                        if disconnected.done():
+                            break
+                        body = sse(None)
+                    await send(
+                        {"type": "http.response.body", "body": body, "more_body": True}
+                    )
+            finally:
+                disconnected.cancel()
+        finally:
+            unwatch()
+
+    return events_application
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
@@ -0,0 +1,71 @@
+"""
+Implement benchmark_park, which measures how long parking takes as the
+parking_place table grows. Each lot size is built in a lot of its own and
+timed inside a transaction that is rolled back afterwards, so the real lots are
+left as they were.
+"""
+
+import time
+from random import Random
+from statistics import median, quantiles
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from parking_place import views
+from parking_place.models import Lot, ParkingPlace
+
+
+class Command(BaseCommand):
+    """Django command to benchmark park latency against lot size."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000,1000000",
+            help="Comma-separated lot sizes to time.",
+        )
+        parser.add_argument(
+            "--parks", type=int, default=200, help="Parks to time at each size."
+        )
+        parser.add_argument(
+            "--occupancy",
+            type=float,
+            default=0.5,
+            help="Fraction of places already taken before timing starts.",
+        )
+        parser.add_argument("--vehicle", default="car", help="Vehicle type to park.")
+
+    def build_lot(self, size: int, occupancy: float) -> Lot:
+        rng = Random(size)
+        lot = Lot.objects.create(name=f"benchmark-{size}")
+        batch_size = 10_000
+        for start in range(0, size, batch_size):
+            ParkingPlace.objects.bulk_create(
+                ParkingPlace(
+                    lot=lot,
+                    position=i,
+                    vehicle_type=rng.choice(["Motorcycle", "Car", "Car", "Car", "Van"]),
+                    status="Full" if rng.random() < occupancy else "Empty",
+                )
+                for i in range(start, min(start + batch_size, size))
+            )
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {ParkingPlace._meta.db_table}")
+        return lot
+
+    def handle(self, *args, **options):
+        for size in [int(s) for s in options["sizes"].split(",")]:
+            with transaction.atomic():
+                lot = self.build_lot(size, options["occupancy"])
+                times = []
+                for _ in range(options["parks"]):
+                    start = time.perf_counter()
+                    views.park_in_lot(lot.id, options["vehicle"])
+                    times.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{size:>9} places: median {median(times):.3f} ms, "
+                f"p95 {quantiles(times, n=20)[18]:.3f} ms"
+            )
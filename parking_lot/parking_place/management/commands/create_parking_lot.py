@@ -1,15 +1,164 @@
 """
-Implement create_parking_lot, which will create a parking lot with 10 spaces to
-try out the api.
+Implement create_parking_lot, which adds parking places to a lot, creating the
+lot if need be. By default it adds five car places to the default lot to try
+out the api; options describe larger layouts, which are inserted in bulk.
 """
 
-from parking_place.models import ParkingPlace
-from django.core.management.base import BaseCommand
+import io
+from collections import Counter
+from itertools import cycle, islice
+from typing import Iterator, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from parking_place.models import Lot, OccupancyCounter, ParkingPlace
+
+# Letters used in layouts, one per place.
+LAYOUT_CODES = {"M": "Motorcycle", "C": "Car", "V": "Van"}
+
+
+def parse_layout(layout: str) -> List[str]:
+    """
+    Return the vehicle types of the places in a layout string such as "CCCVVM",
+    ignoring whitespace.
+    """
+    try:
+        return [LAYOUT_CODES[c] for c in layout.upper() if not c.isspace()]
+    except KeyError as e:
+        raise CommandError(f"Unknown place {e} in layout; use M, C, or V.") from None
 
 
 class Command(BaseCommand):
+    """Django command to add parking places to a lot."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lot", default=Lot.DEFAULT_NAME, help="Name of the lot to add places to."
+        )
+        parser.add_argument(
+            "--level", type=int, default=0, help="Level to add the places on."
+        )
+        parser.add_argument(
+            "--row", type=int, default=0, help="Row to add the places to, or the first."
+        )
+        parser.add_argument(
+            "--row-length",
+            type=int,
+            help="Places per row; the layout carries on into the following rows.",
+        )
+        parser.add_argument(
+            "--motorcycles", type=int, default=0, help="Motorcycle places to add."
+        )
+        parser.add_argument("--cars", type=int, default=0, help="Car places to add.")
+        parser.add_argument("--vans", type=int, default=0, help="Van places to add.")
+        parser.add_argument(
+            "--layout",
+            help='Places to add, in order, one letter each: M, C, or V, e.g. "CCCVVM".',
+        )
+        parser.add_argument("--layout-file", help="File holding a layout.")
+        parser.add_argument(
+            "--size",
+            type=int,
+            help="Number of places to add, repeating or cutting short the layout.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=10_000, help="Places per INSERT."
+        )
+
+    def get_layout(self, options) -> List[str]:
+        if options["layout_file"]:
+            with open(options["layout_file"]) as f:
+                layout = parse_layout(f.read())
+        elif options["layout"]:
+            layout = parse_layout(options["layout"])
+        else:
+            layout = (
+                ["Motorcycle"] * options["motorcycles"]
+                + ["Car"] * options["cars"]
+                + ["Van"] * options["vans"]
+            )
+        if not layout and options["size"] is None:
+            # Just enough to try out the api.
+            layout = ["Car"] * 5
+        if options["size"] is not None:
+            if not layout:
+                raise CommandError("--size needs a layout to repeat.")
+            layout = list(islice(cycle(layout), options["size"]))
+        return layout
+
+    def get_positions(
+        self, lot: Lot, size: int, options
+    ) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yield the level, row, and position of each place to add, carrying on
+        from the end of each row.
+        """
+        level, row, row_length = options["level"], options["row"], options["row_length"]
+        while size > 0:
+            n = size if row_length is None else min(size, row_length)
+            start = ParkingPlace.next_position(lot.id, level, row)
+            for position in range(start, start + n):
+                yield level, row, position
+            size -= n
+            row += 1
+
+    def copy_places(
+        self,
+        lot: Lot,
+        layout: List[str],
+        positions: List[Tuple[int, int, int]],
+        batch_size: int,
+    ) -> None:
+        """Load the places with PostgreSQL's COPY, a batch at a time."""
+        empty = ParkingPlace.db_value("status", "Empty")
+        codes = {t: ParkingPlace.db_value("vehicle_type", t) for t in LAYOUT_CODES.values()}
+        sql = (
+            f"COPY {ParkingPlace._meta.db_table} "
+            f'(lot_id, level, "row", position, vehicle_type, status, version) '
+            "FROM STDIN"
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(layout), batch_size):
+                rows = "".join(
+                    f"{lot.id}\t{level}\t{row}\t{position}\t{codes[t]}\t{empty}\t0\n"
+                    for t, (level, row, position) in zip(
+                        layout[start : start + batch_size],
+                        positions[start : start + batch_size],
+                    )
+                )
+                cursor.copy_expert(sql, io.StringIO(rows))
 
     def handle(self, *args, **options):
-        defaults = {"vehicle_type": "Car", "status": "Empty"}
-        for i in range(5):
-            ParkingPlace.objects.create(**defaults)
+        layout = self.get_layout(options)
+        batch_size = options["batch_size"]
+        if options["row_length"] is not None and options["row_length"] < 1:
+            raise CommandError("--row-length must be at least 1.")
+        with transaction.atomic():
+            lot = Lot.objects.get_or_create(name=options["lot"])[0]
+            positions = list(self.get_positions(lot, len(layout), options))
+            if connection.vendor == "postgresql":
+                self.copy_places(lot, layout, positions, batch_size)
+            else:
+                for start in range(0, len(layout), batch_size):
+                    ParkingPlace.objects.bulk_create(
+                        ParkingPlace(
+                            lot=lot,
+                            level=level,
+                            row=row,
+                            position=position,
+                            vehicle_type=t,
+                            status="Empty",
+                        )
+                        for t, (level, row, position) in zip(
+                            layout[start : start + batch_size],
+                            positions[start : start + batch_size],
+                        )
+                    )
+            # Bulk inserts bypass ParkingPlace.save, so count the places here.
+            OccupancyCounter.adjust(
+                {(lot.id, t, "Empty"): n for t, n in Counter(layout).items()}
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Added {len(layout)} parking places to lot {lot}.")
+        )
@@ -0,0 +1,39 @@
+"""
+Implement expire_holds, which releases every hold that has expired, in every
+lot, in one transaction. With --every it keeps doing so, as a sweeper running
+beside the server, so no request has to look for expired holds itself.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from parking_place import views
+
+
+class Command(BaseCommand):
+    """Django command to release expired holds."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--every",
+            type=float,
+            metavar="SECONDS",
+            help="Keep running, releasing expired holds every SECONDS seconds.",
+        )
+
+    def handle(self, *args, **options):
+        if options["every"] is None:
+            self.stdout.write(f"{views.expire_holds()} expired holds released.")
+            return
+        while True:
+            close_old_connections()
+            try:
+                released = views.expire_holds()
+            except DatabaseError as e:
+                self.stdout.write(f"Couldn't release expired holds: {e}. Will retry.")
+            else:
+                if released:
+                    self.stdout.write(f"{released} expired holds released.")
+            time.sleep(options["every"])
@@ -0,0 +1,319 @@
+"""
+Implement load_test, which replays a stream of api calls against a running
+server, or one it starts itself, and reports latency, throughput, rejections,
+and any place handed out twice, counting every place a van takes.
+
+The stream is JSON lines, one call each:
+    {"op": "park", "vehicle_type": "car", "key": "v1"}
+    {"op": "unpark", "key": "v1"}
+    {"op": "free"}  (or "stats", "is-full", "vans-usage")
+Any call may name a "lot" id. An unpark frees the space its key's park was
+given, and is skipped if that park was rejected or hasn't returned yet.
+--generate writes such a stream instead of replaying one.
+"""
+
+import http.client
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import count
+from queue import Empty, Queue
+from random import Random
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer,
+    WSGIRequestHandler,
+    get_internal_wsgi_application,
+)
+from django.db import connections
+
+READ_OPS = ("free", "stats", "is-full", "vans-usage")
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Return the p-th percentile of sorted values, by nearest rank."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def generate(n: int, seed: int, occupancy: float, lot: Optional[int]) -> List[dict]:
+    """
+    Return n calls in which vehicles arrive, are read about, and leave, with
+    about `occupancy` of the arrivals still parked at any time.
+    """
+    rng = Random(seed)
+    parked: List[str] = []
+    keys = count()
+    calls = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.1:
+            call = {"op": rng.choice(READ_OPS)}
+        elif parked and r < 0.1 + 0.9 * (1 - occupancy):
+            key = parked.pop(rng.randrange(len(parked)))
+            call = {"op": "unpark", "key": key}
+        else:
+            key = f"v{next(keys)}"
+            parked.append(key)
+            vehicle_type = rng.choices(["motorcycle", "car", "van"], [2, 6, 2])[0]
+            call = {"op": "park", "vehicle_type": vehicle_type, "key": key}
+        if lot is not None:
+            call["lot"] = lot
+        calls.append(call)
+    return calls
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    """Serves the project, closing each request thread's connections after it."""
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            connections.close_all()
+
+
+class Replay:
+    """The state shared by the workers replaying one stream."""
+
+    def __init__(self, host: str, port: int, prefix: str):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Counter = Counter()
+        # Places given by parks not yet unparked, space number first, and the
+        # key holding each place.
+        self.places: Dict[str, List[int]] = {}
+        self.holders: Dict[int, str] = {}
+        self.double_allocations: List[str] = []
+
+    def request(self, path: str) -> dict:
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request("GET", self.prefix + path)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise http.client.HTTPException(f"{response.status} from {path}")
+            return json.loads(body)
+        finally:
+            conn.close()
+
+    def path(self, call: dict) -> Optional[str]:
+        """Return the path for a call, or None if it should be skipped."""
+        lot = f"/lots/{call['lot']}" if "lot" in call else ""
+        op = call.get("op")
+        if op == "park":
+            return f"{lot}/park/{call['vehicle_type']}/"
+        if op == "unpark":
+            with self.lock:
+                places = self.places.pop(call.get("key"), None)
+                if places is None:
+                    return None
+                # Released before the request is sent, so a park given the
+                # places before the unpark returns isn't taken for a double.
+                # A place given out twice stays with the key it went to last.
+                for place in places:
+                    if self.holders.get(place) == call.get("key"):
+                        del self.holders[place]
+            return f"{lot}/unpark/{places[0]}/"
+        if op in READ_OPS:
+            return f"{lot}/{op}"
+        raise CommandError(f"Unknown op in stream: {call!r}")
+
+    def record(self, call: dict, result: dict, latency: float) -> None:
+        op = call["op"]
+        with self.lock:
+            self.latencies[op].append(latency)
+            if op == "park":
+                space_number = result["id"]
+                if space_number == -1:
+                    self.outcomes["park rejected"] += 1
+                    return
+                self.outcomes["parked"] += 1
+                # A van in car places takes the places either side too.
+                places = result.get("places") or [space_number]
+                for place in places:
+                    holder = self.holders.get(place)
+                    if holder is not None:
+                        self.double_allocations.append(
+                            f"place {place} given to {call.get('key')} "
+                            f"while held by {holder}"
+                        )
+                    self.holders[place] = call.get("key")
+                self.places[call.get("key")] = places
+            elif op == "unpark":
+                self.outcomes["unparked" if result["success"] else "unpark failed"] += 1
+
+    def send(self, call: dict, scheduled: float) -> None:
+        """
+        Make one call. Latency runs from when it was scheduled, so time spent
+        waiting for a free worker in an open loop counts against the server.
+        """
+        path = self.path(call)
+        if path is None:
+            with self.lock:
+                self.outcomes["unpark skipped"] += 1
+            return
+        try:
+            result = self.request(path)
+        except (OSError, ValueError, http.client.HTTPException):
+            with self.lock:
+                self.outcomes[f"{call['op']} error"] += 1
+            return
+        self.record(call, result, (time.perf_counter() - scheduled) * 1000)
+
+
+class Command(BaseCommand):
+    """Django command to load test the api by replaying a stream of calls."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "stream", nargs="?", help="JSON lines file of calls to replay; - for stdin."
+        )
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000",
+            help="Server to load, unless --serve is given.",
+        )
+        parser.add_argument(
+            "--serve",
+            action="store_true",
+            help="Serve the project in this process, on a free port, and load that.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=8, help="Calls in flight at once."
+        )
+        parser.add_argument(
+            "--rps",
+            type=float,
+            help="Send at this rate (open loop). By default each worker sends "
+            "its next call when the last returns (closed loop).",
+        )
+        parser.add_argument(
+            "--generate",
+            type=int,
+            metavar="N",
+            help="Write a stream of N calls to stdout instead of replaying one.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed for --generate.")
+        parser.add_argument(
+            "--occupancy",
+            type=float,
+            default=0.7,
+            help="Share of arrivals still parked at a time, for --generate.",
+        )
+        parser.add_argument("--lot", type=int, help="Lot id for --generate.")
+
+    def read_stream(self, stream: str) -> List[dict]:
+        f = sys.stdin if stream == "-" else open(stream)
+        try:
+            return [json.loads(line) for line in f if line.strip()]
+        except ValueError as e:
+            raise CommandError(f"Bad line in stream: {e}") from None
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    def handle(self, *args, **options):
+        if options["generate"] is not None:
+            for call in generate(
+                options["generate"], options["seed"], options["occupancy"], options["lot"]
+            ):
+                self.stdout.write(json.dumps(call))
+            return
+        if not options["stream"]:
+            raise CommandError("Give a stream to replay, or --generate one.")
+        calls = self.read_stream(options["stream"])
+
+        server = None
+        if options["serve"]:
+            # As LiveServerTestCase does, so the project answers on localhost.
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "127.0.0.1"]
+            server = LoadTestServer(("127.0.0.1", 0), QuietHandler)
+            server.set_app(get_internal_wsgi_application())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port, prefix = "127.0.0.1", server.server_address[1], ""
+        else:
+            url = urlsplit(options["url"])
+            host, port, prefix = url.hostname, url.port or 80, url.path.rstrip("/")
+        replay = Replay(host, port, prefix)
+        try:
+            elapsed = self.run(replay, calls, options["workers"], options["rps"])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        self.report(replay, len(calls), elapsed)
+        if replay.double_allocations:
+            raise CommandError(
+                f"{len(replay.double_allocations)} places were given out twice."
+            )
+
+    def run(
+        self, replay: Replay, calls: List[dict], workers: int, rps: Optional[float]
+    ) -> float:
+        """Replay the calls and return how long it took, in seconds."""
+        pending: Queue = Queue()
+
+        def work():
+            while True:
+                try:
+                    item = pending.get(timeout=0.1)
+                except Empty:
+                    if done.is_set():
+                        return
+                    continue
+                call, scheduled = item
+                replay.send(call, scheduled or time.perf_counter())
+
+        done = threading.Event()
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for i, call in enumerate(calls):
+            if rps:
+                scheduled = start + i / rps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pending.put((call, scheduled))
+            else:
+                pending.put((call, None))
+        done.set()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, replay: Replay, calls: int, elapsed: float) -> None:
+        self.stdout.write(
+            f"{calls} calls in {elapsed:.2f} s: {calls / elapsed:.1f} calls/s"
+        )
+        for op, latencies in sorted(replay.latencies.items()):
+            ordered = sorted(latencies)
+            self.stdout.write(
+                f"{op:>10}: {len(ordered):>7} calls, "
+                f"p50 {percentile(ordered, 50):.2f} ms, "
+                f"p95 {percentile(ordered, 95):.2f} ms, "
+                f"p99 {percentile(ordered, 99):.2f} ms"
+            )
+        for outcome, n in sorted(replay.outcomes.items()):
+            self.stdout.write(f"{outcome:>16}: {n}")
+        for problem in replay.double_allocations:
+            self.stdout.write(self.style.ERROR(f"Double allocation: {problem}"))
@@ -0,0 +1,49 @@
+"""
+Implement plan_van_runs, which lists the fewest moves of parked cars and
+motorcycles between car places that would open a number of runs of car places
+for vans in a lot, for attendants to carry out. See parking_place.van_runs.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking_place import van_runs
+from parking_place.models import Lot
+
+
+def describe(place: van_runs.Place) -> str:
+    place_id, level, row, position = place
+    return f"level {level}, row {row}, position {position} (place {place_id})"
+
+
+class Command(BaseCommand):
+    """Django command to plan moves that open runs of car places for vans."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("runs", type=int, help="Runs of car places to open.")
+        parser.add_argument(
+            "--lot", default=Lot.DEFAULT_NAME, help="Name of the lot to plan for."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            lot = Lot.objects.get(name=options["lot"])
+        except Lot.DoesNotExist:
+            raise CommandError(f"There's no lot named {options['lot']}.") from None
+        planned = van_runs.plan(lot.id, options["runs"])
+        if planned is None:
+            raise CommandError(
+                f"Lot {lot} hasn't the car places for {options['runs']} runs for vans."
+            )
+        runs, moves = planned
+        for n, (place, to) in enumerate(moves, 1):
+            self.stdout.write(f"{n}. Move the vehicle at {describe(place)}")
+            self.stdout.write(f"   to {describe(to)}.")
+        for run in runs:
+            self.stdout.write(
+                f"Open for a van: {describe(run[0])} to position {run[-1][3]}."
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(runs)} runs for vans in lot {lot} after {len(moves)} moves."
+            )
+        )
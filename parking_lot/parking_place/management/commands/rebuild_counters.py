@@ -0,0 +1,47 @@
+"""
+Implement rebuild_counters, which recounts the places in every lot and replaces
+the occupancy counters with the result, or with --check only reports where the
+counters have drifted from the places.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from parking_place.models import Lot, OccupancyCounter
+
+
+class Command(BaseCommand):
+    """Django command to rebuild or check the occupancy counters."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drift; exit with an error if there is any.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            OccupancyCounter.rebuild()
+            self.stdout.write(self.style.SUCCESS("Occupancy counters rebuilt."))
+            return
+
+        drift = []
+        with transaction.atomic():
+            OccupancyCounter.lock_places()
+            for lot in Lot.objects.order_by("id"):
+                expected = OccupancyCounter.recount(lot.id)
+                counted = OccupancyCounter.totals(lot.id)
+                drift += [
+                    (lot, key, expected.get(key, 0), counted.get(key, 0))
+                    for key in sorted(set(expected) | set(counted))
+                    if expected.get(key, 0) != counted.get(key, 0)
+                ]
+        for lot, (vehicle_type, status), n_expected, n_counted in drift:
+            self.stdout.write(
+                f"{lot}: {vehicle_type}:{status} has {n_expected} places "
+                f"but is counted as {n_counted}."
+            )
+        if drift:
+            raise CommandError("Occupancy counters have drifted; run rebuild_counters.")
+        self.stdout.write(self.style.SUCCESS("Occupancy counters match the places."))
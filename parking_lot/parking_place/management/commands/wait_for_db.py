@@ -1,17 +1,32 @@
 """
 Implement wait_for_db() command so that Django doesn't attempt to start up
-until the db is available.
+until the db is available. With --check-pool it then also checks that a full
+pool of connections can be opened, and that each can prepare the statements on
+the parking path, failing if not.
 """
 
+import threading
 import time
 from psycopg2 import OperationalError as Psycopg2Error
-from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.utils import DatabaseError, OperationalError
+from django.core.management.base import BaseCommand, CommandError
+
+from parking_place import views
 
 
 class Command(BaseCommand):
     """Django command to wait for db."""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check-pool",
+            action="store_true",
+            help="Once the db is up, open DB_POOL_SIZE connections at once and "
+            "prepare the hot statements on each; exit with an error on failure.",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("\nWaiting for database.")
         db_up = False
@@ -33,3 +48,42 @@ class Command(BaseCommand):
                 time.sleep(1)
 
         self.stdout.write(self.style.SUCCESS("Database is available."))
+        if options["check_pool"]:
+            self.check_pool()
+
+    def check_pool(self) -> None:
+        """
+        Open a connection in every thread of the async views' pool at once, as
+        a burst of requests would, and prepare the hot statements on each.
+        """
+        size = settings.DB_POOL_SIZE
+        # Hold each thread until all have started, so each opens its own.
+        everyone = threading.Barrier(size, timeout=30)
+
+        def check_connection():
+            everyone.wait()
+            close_old_connections()
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                prepared = sum(
+                    statement.prepare(cursor) for statement in views.hot_statements()
+                )
+            return (time.perf_counter() - start) * 1000, prepared
+
+        futures = [views.db_executor().submit(check_connection) for _ in range(size)]
+        failures = 0
+        for i, future in enumerate(futures):
+            try:
+                elapsed, prepared = future.result()
+            except (DatabaseError, threading.BrokenBarrierError) as e:
+                failures += 1
+                self.stdout.write(f"Connection {i}: {type(e).__name__}: {e}")
+            else:
+                self.stdout.write(
+                    f"Connection {i}: ready in {elapsed:.1f} ms, "
+                    f"{prepared} statements prepared."
+                )
+        if failures:
+            raise CommandError(f"{failures} of {size} pooled connections failed.")
+        self.stdout.write(self.style.SUCCESS(f"Pool of {size} connections is healthy."))
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:09
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_places(apps, schema_editor):
+    ParkingPlace = apps.get_model("parking_place", "ParkingPlace")
+    OccupancyCounter = apps.get_model("parking_place", "OccupancyCounter")
+    OccupancyCounter.objects.bulk_create(
+        OccupancyCounter(
+            vehicle_type=row["vehicle_type"], status=row["status"], slot=0, count=row["n"]
+        )
+        for row in ParkingPlace.objects.values("vehicle_type", "status").annotate(
+            n=Count("id")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0008_alter_parkingplace_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccupancyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_type', models.TextField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')], max_length=10)),
+                ('status', models.TextField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van')], max_length=8)),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='occupancycounter',
+            constraint=models.UniqueConstraint(fields=('vehicle_type', 'status', 'slot'), name='unique_counter_slot'),
+        ),
+        migrations.RunPython(count_existing_places, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:10
+
+from django.db import migrations, models
+import parking_place.models
+
+
+# The codes are the positions of the values in ParkingPlace's choices.
+TEXT_TO_CODES = """
+UPDATE parking_place_parkingplace SET
+    vehicle_type_code = CASE vehicle_type
+        WHEN 'Motorcycle' THEN 0 WHEN 'Car' THEN 1 WHEN 'Van' THEN 2 END,
+    status_code = CASE status
+        WHEN 'Empty' THEN 0 WHEN 'Adjacent' THEN 1 WHEN 'Full' THEN 2 WHEN 'Van' THEN 3 END;
+"""
+
+CODES_TO_TEXT = """
+UPDATE parking_place_parkingplace SET
+    vehicle_type = CASE vehicle_type_code
+        WHEN 0 THEN 'Motorcycle' WHEN 1 THEN 'Car' WHEN 2 THEN 'Van' END,
+    status = CASE status_code
+        WHEN 0 THEN 'Empty' WHEN 1 THEN 'Adjacent' WHEN 2 THEN 'Full' WHEN 3 THEN 'Van' END;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0009_occupancycounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingplace',
+            name='vehicle_type_code',
+            field=parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')], null=True),
+        ),
+        migrations.AddField(
+            model_name='parkingplace',
+            name='status_code',
+            field=parking_place.models.ChoiceCodeField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van')], null=True),
+        ),
+        # Nullable while both columns exist, so that migrating backwards can
+        # add the text columns back before filling them in.
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='vehicle_type',
+            field=models.TextField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')], max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='status',
+            field=models.TextField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van')], max_length=8, null=True),
+        ),
+        migrations.RunSQL(TEXT_TO_CODES, CODES_TO_TEXT),
+        migrations.RemoveField(
+            model_name='parkingplace',
+            name='vehicle_type',
+        ),
+        migrations.RemoveField(
+            model_name='parkingplace',
+            name='status',
+        ),
+        migrations.RenameField(
+            model_name='parkingplace',
+            old_name='vehicle_type_code',
+            new_name='vehicle_type',
+        ),
+        migrations.RenameField(
+            model_name='parkingplace',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='status',
+            field=parking_place.models.ChoiceCodeField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van')]),
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='vehicle_type',
+            field=parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')]),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(fields=['vehicle_type', 'status'], name='place_type_status'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Motorcycle')), fields=['id'], name='empty_motorcycle_places'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Car')), fields=['id'], name='empty_car_places'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Van')), fields=['id'], name='empty_van_places'),
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:16
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+import parking_place.models
+
+
+def move_places_to_default_lot(apps, schema_editor):
+    """Put every existing place and counter in the default lot, in id order."""
+    Lot = apps.get_model("parking_place", "Lot")
+    ParkingPlace = apps.get_model("parking_place", "ParkingPlace")
+    OccupancyCounter = apps.get_model("parking_place", "OccupancyCounter")
+    lot = Lot.objects.get_or_create(name=parking_place.models.Lot.DEFAULT_NAME)[0]
+    ParkingPlace.objects.update(lot=lot, position=F("id"))
+    OccupancyCounter.objects.update(lot=lot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0010_place_codes_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(unique=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='occupancycounter',
+            name='unique_counter_slot',
+        ),
+        migrations.RemoveIndex(
+            model_name='parkingplace',
+            name='place_type_status',
+        ),
+        migrations.RemoveIndex(
+            model_name='parkingplace',
+            name='empty_motorcycle_places',
+        ),
+        migrations.RemoveIndex(
+            model_name='parkingplace',
+            name='empty_car_places',
+        ),
+        migrations.RemoveIndex(
+            model_name='parkingplace',
+            name='empty_van_places',
+        ),
+        migrations.AddField(
+            model_name='occupancycounter',
+            name='lot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking_place.lot'),
+        ),
+        migrations.AddField(
+            model_name='parkingplace',
+            name='lot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='places', to='parking_place.lot'),
+        ),
+        migrations.AddField(
+            model_name='parkingplace',
+            name='level',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='parkingplace',
+            name='row',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='parkingplace',
+            name='position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_places_to_default_lot, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='occupancycounter',
+            name='lot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking_place.lot'),
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='lot',
+            field=models.ForeignKey(default=parking_place.models.default_lot_id, on_delete=django.db.models.deletion.PROTECT, related_name='places', to='parking_place.lot'),
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='position',
+            field=models.IntegerField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(fields=['lot', 'vehicle_type', 'status'], name='place_type_status'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Motorcycle')), fields=['lot', 'id'], name='empty_motorcycle_places'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Car')), fields=['lot', 'id'], name='empty_car_places'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Van')), fields=['lot', 'id'], name='empty_van_places'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingplace',
+            index=models.Index(condition=models.Q(('status', 'Empty'), ('vehicle_type', 'Car')), fields=['lot', 'level', 'row', 'position'], name='empty_car_runs'),
+        ),
+        migrations.AddConstraint(
+            model_name='occupancycounter',
+            constraint=models.UniqueConstraint(fields=('lot', 'vehicle_type', 'status', 'slot'), name='unique_counter_slot'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingplace',
+            constraint=models.UniqueConstraint(fields=('lot', 'level', 'row', 'position'), name='unique_place_position'),
+        ),
+    ]
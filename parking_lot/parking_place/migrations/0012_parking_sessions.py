@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import parking_place.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0011_lots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingSession',
+            fields=[
+                ('ticket', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('vehicle_type', parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')])),
+                ('place_type', parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')])),
+                ('places', models.JSONField()),
+                ('parked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('left_at', models.DateTimeField(blank=True, null=True)),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='parking_place.lot')),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='parking_place.parkingplace')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['lot', 'parked_at'], name='session_history'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('left_at', None)), fields=('place',), name='one_open_session_per_place'),
+        ),
+    ]
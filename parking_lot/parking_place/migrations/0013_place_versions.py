@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0012_parking_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingplace',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:59
+
+from django.db import migrations, models
+import parking_place.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0013_place_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingsession',
+            name='held_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='occupancycounter',
+            name='status',
+            field=models.TextField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van'), ('Held', 'Held')], max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='parkingplace',
+            name='status',
+            field=parking_place.models.ChoiceCodeField(choices=[('Empty', 'Empty'), ('Adjacent', 'Adjacent'), ('Full', 'Full'), ('Van', 'Van'), ('Held', 'Held')]),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(condition=models.Q(('held_until__isnull', False), ('left_at', None)), fields=['held_until'], name='open_holds'),
+        ),
+    ]
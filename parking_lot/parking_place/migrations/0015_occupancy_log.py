@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import parking_place.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking_place', '0014_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccupancyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seconds', models.PositiveIntegerField()),
+                ('vehicle_type', parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')])),
+                ('start', models.DateTimeField()),
+                ('free_change', models.IntegerField(default=0)),
+                ('taken', models.PositiveIntegerField(default=0)),
+                ('freed', models.PositiveIntegerField(default=0)),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking_place.lot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OccupancyEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('at', models.DateTimeField()),
+                ('vehicle_type', parking_place.models.ChoiceCodeField(choices=[('Motorcycle', 'Motorcycle'), ('Car', 'Car'), ('Van', 'Van')])),
+                ('free_change', models.IntegerField()),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking_place.lot')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='occupancyrollup',
+            constraint=models.UniqueConstraint(fields=('lot', 'seconds', 'start', 'vehicle_type'), name='unique_rollup_period'),
+        ),
+    ]
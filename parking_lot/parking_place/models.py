@@ -1,4 +1,102 @@
-from django.db import models
+import io
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from random import randrange, uniform
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from parking_place import occupancy_log, read_cache
+from parking_place.prepared import Statement
+
+
+# For each incoming vehicle type, the kinds of space it may take, in the
+# order they should be tried: smallest suitable space first.
+SPACE_PREFERENCE = {
+    "motorcycle": ["Motorcycle", "Car", "Van"],
+    "car": ["Car", "Van"],
+    "van": ["Van"],
+}
+
+T = TypeVar("T")
+
+
+class ConcurrentUpdate(Exception):
+    """A place was changed by someone else between being read and being written."""
+
+
+def retry_on_conflict(func: Callable[[], T]) -> T:
+    """
+    Call func, which should be a whole transaction, and return what it returns.
+    Whenever it raises ConcurrentUpdate, call it again, up to
+    settings.PARKING_WRITE_ATTEMPTS times in all, after a random wait of up to
+    settings.PARKING_WRITE_RETRY_DELAY seconds, doubling with each attempt, so
+    that the writers who collided don't collide again. The last conflict is
+    raised if every attempt fails.
+    """
+    for attempt in range(settings.PARKING_WRITE_ATTEMPTS):
+        try:
+            return func()
+        except ConcurrentUpdate:
+            if attempt == settings.PARKING_WRITE_ATTEMPTS - 1:
+                raise
+        time.sleep(uniform(0, settings.PARKING_WRITE_RETRY_DELAY * 2 ** attempt))
+
+
+class ChoiceCodeField(models.PositiveSmallIntegerField):
+    """
+    A field holding one of the strings in its choices, stored as the index of
+    that choice, so the column is a two-byte smallint rather than text. Python
+    code reads, writes, and filters on the strings as usual. Choices may be
+    appended to, but never reordered or removed, without migrating the data.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codes = {value: code for code, (value, _) in enumerate(self.choices)}
+
+    def to_python(self, value):
+        if value is None or value in self.codes:
+            return value
+        return self.choices[super().to_python(value)][0]
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else self.choices[value][0]
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return self.codes[value]
+        except KeyError:
+            raise ValueError(f"{value!r} is not a valid {self.name}.") from None
+
+
+class Lot(models.Model):
+    """
+    A garage. Each lot's places, adjacency, locks, and occupancy counters are
+    independent of every other lot's, so lots never contend with each other.
+    The top-level routes use the lot named DEFAULT_NAME.
+    """
+
+    DEFAULT_NAME = "default"
+
+    name = models.TextField(unique=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def default(cls) -> "Lot":
+        return cls.objects.get_or_create(name=cls.DEFAULT_NAME)[0]
+
+
+def default_lot_id() -> int:
+    return Lot.default().id
 
 
 class ParkingPlace(models.Model):
@@ -6,6 +104,12 @@ class ParkingPlace(models.Model):
     A parking lot is a ParkingPlace table where each row is a parking space.
     Theoretically this is actually a many-many table for VehicleType and
     StatusType, but that's not how it's getting used here.
+
+    Places belong to a lot and sit at a position in a row on a level. Two
+    places are adjacent if they're at consecutive positions in the same row.
+
+    Every write to a place adds one to its version, so a write can be made
+    conditional on the place being as it was read; see save.
     """
 
     """
@@ -20,14 +124,573 @@ class ParkingPlace(models.Model):
         ("Adjacent", "Adjacent"),  # In use by an adjacent vehicle.
         ("Full", "Full"),  # Has something parked in it.
         ("Van", "Van"), # Specifically to mark a car with a van in it.
+        ("Held", "Held"),  # Reserved by a hold not yet confirmed or expired.
     )
     VEHICLE_CHOICES = (
         ("Motorcycle", "Motorcycle"),
         ("Car", "Car"),
         ("Van", "Van"),
     )
-    vehicle_type = models.TextField(max_length=10, blank=False, choices=VEHICLE_CHOICES)
-    status = models.TextField(max_length=8, blank=False, choices=STATUS_CHOICES)
+    vehicle_type = ChoiceCodeField(blank=False, choices=VEHICLE_CHOICES)
+    status = ChoiceCodeField(blank=False, choices=STATUS_CHOICES)
+    lot = models.ForeignKey(
+        Lot, on_delete=models.PROTECT, related_name="places", default=default_lot_id
+    )
+    level = models.PositiveSmallIntegerField(default=0)
+    row = models.PositiveSmallIntegerField(default=0)
+    # Set to the end of the row on first save if not given.
+    position = models.IntegerField(blank=True)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lot", "level", "row", "position"], name="unique_place_position"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["lot", "vehicle_type", "status"], name="place_type_status"),
+            # Claiming a place reads the lowest id from one of these, so parking
+            # doesn't depend on how many places are already taken.
+            models.Index(
+                fields=["lot", "id"],
+                condition=models.Q(vehicle_type="Motorcycle", status="Empty"),
+                name="empty_motorcycle_places",
+            ),
+            models.Index(
+                fields=["lot", "id"],
+                condition=models.Q(vehicle_type="Car", status="Empty"),
+                name="empty_car_places",
+            ),
+            models.Index(
+                fields=["lot", "id"],
+                condition=models.Q(vehicle_type="Van", status="Empty"),
+                name="empty_van_places",
+            ),
+            # Searches for runs of empty car places read this in row order.
+            models.Index(
+                fields=["lot", "level", "row", "position"],
+                condition=models.Q(vehicle_type="Car", status="Empty"),
+                name="empty_car_runs",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.vehicle_type}:{self.status}"
+
+    @classmethod
+    def db_value(cls, field_name: str, value: str) -> int:
+        """Return how value is stored in the named field, for raw queries."""
+        return cls._meta.get_field(field_name).get_prep_value(value)
+
+    @classmethod
+    def next_position(cls, lot_id: int, level: int, row: int) -> int:
+        """Return the position after the last place in a row."""
+        last = cls.objects.filter(lot_id=lot_id, level=level, row=row).aggregate(
+            last=models.Max("position")
+        )["last"]
+        return 0 if last is None else last + 1
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        place = super().from_db(db, field_names, values)
+        place._counted_as = (place.lot_id, place.vehicle_type, place.status)
+        return place
+
+    def save(self, *args, **kwargs):
+        """
+        Save the place and move it between OccupancyCounters in the same
+        transaction. Bulk writes, such as QuerySet.update, bypass this and must
+        call OccupancyCounter.adjust and add one to the version themselves.
+
+        A place that's already saved is written with one UPDATE that only
+        matches if its version is still the one read, and ConcurrentUpdate is
+        raised if it doesn't, rather than overwrite the other change.
+        """
+        key = (self.lot_id, self.vehicle_type, self.status)
+        changes = {key: 1}
+        counted_as = getattr(self, "_counted_as", None)
+        if counted_as:
+            changes[counted_as] = changes.get(counted_as, 0) - 1
+        with transaction.atomic():
+            if self.position is None:
+                self.position = self.next_position(self.lot_id, self.level, self.row)
+            if self._state.adding:
+                super().save(*args, **kwargs)
+            else:
+                self.save_if_unchanged()
+            OccupancyCounter.adjust(changes)
+        self._counted_as = key
+
+    def save_if_unchanged(self) -> None:
+        """Write every field of the place if its version is still the one read."""
+        values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.name != "version"
+        }
+        updated = type(self).objects.filter(id=self.id, version=self.version).update(
+            version=models.F("version") + 1, **values
+        )
+        if not updated:
+            raise ConcurrentUpdate(f"Place {self.id} changed since it was read.")
+        self.version += 1
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            OccupancyCounter.adjust({self._counted_as: -1})
+            return super().delete(*args, **kwargs)
+
+
+class OccupancyCounter(models.Model):
+    """
+    The number of places of each vehicle_type in each status in each lot, kept
+    up to date in the same transaction as every change to ParkingPlace, so that
+    the read endpoints look up a handful of rows instead of counting places.
+
+    Each count is split across settings.OCCUPANCY_COUNTER_SLOTS rows, and each
+    transaction adds its changes to one slot at random, so concurrent parks
+    rarely wait on each other's counter rows. The true count is the sum over
+    slots; an individual slot may be negative.
+    """
+
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name="+")
+    vehicle_type = models.TextField(
+        max_length=10, choices=ParkingPlace.VEHICLE_CHOICES
+    )
+    status = models.TextField(max_length=8, choices=ParkingPlace.STATUS_CHOICES)
+    slot = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lot", "vehicle_type", "status", "slot"],
+                name="unique_counter_slot",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.lot_id}:{self.vehicle_type}:{self.status}[{self.slot}]={self.count}"
+
+    @classmethod
+    def adjust(cls, changes: Dict[Tuple[int, str, str], int]) -> None:
+        """
+        Add each change to the count for its (lot id, vehicle_type, status), in
+        one upsert, invalidate the cached answers of the lots changed, and log
+        the changes to free places once committed. Should be called in the
+        transaction that changed the places.
+        """
+        # Sorted, so concurrent upserts lock rows in the same order.
+        changes = sorted((key, n) for key, n in changes.items() if n)
+        if not changes:
+            return
+        slot = randrange(settings.OCCUPANCY_COUNTER_SLOTS)
+        params = [
+            v
+            for (lot_id, vehicle_type, status), n in changes
+            for v in (lot_id, vehicle_type, status, slot, n)
+        ]
+        with connection.cursor() as cursor:
+            cls.adjust_statement(len(changes)).execute(cursor, params)
+        for lot_id in {lot_id for (lot_id, _, _), _ in changes}:
+            read_cache.lot_changed(lot_id)
+        occupancy_log.record(
+            [
+                (lot_id, vehicle_type, n)
+                for (lot_id, vehicle_type, status), n in changes
+                if status == "Empty"
+            ]
+        )
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def adjust_statement(cls, rows: int) -> Statement:
+        """Return the upsert adding to `rows` counters."""
+        table = cls._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * rows)
+        return Statement(
+            f"adjust_counters_{rows}",
+            f"""INSERT INTO {table} (lot_id, vehicle_type, status, slot, count)
+                VALUES {values}
+                ON CONFLICT (lot_id, vehicle_type, status, slot)
+                DO UPDATE SET count = {table}.count + EXCLUDED.count""",
+        )
+
+    @classmethod
+    def totals(cls, lot_id: int) -> Dict[Tuple[str, str], int]:
+        """Return the count for every (vehicle_type, status) a lot has places of."""
+        return {
+            (row["vehicle_type"], row["status"]): row["total"]
+            for row in cls.objects.filter(lot_id=lot_id)
+            .values("vehicle_type", "status")
+            .annotate(total=models.Sum("count"))
+            if row["total"]
+        }
+
+    @classmethod
+    def recount(cls, lot_id: int) -> Dict[Tuple[str, str], int]:
+        """Return what totals should be, by counting the lot's places themselves."""
+        return {
+            (row["vehicle_type"], row["status"]): row["total"]
+            for row in ParkingPlace.objects.filter(lot_id=lot_id)
+            .values("vehicle_type", "status")
+            .annotate(total=models.Count("id"))
+        }
+
+    @classmethod
+    def lock_places(cls) -> None:
+        """
+        Block changes to places until the end of the current transaction, so
+        counters and places can be compared or rebuilt consistently.
+        """
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"LOCK TABLE {ParkingPlace._meta.db_table} IN SHARE MODE"
+                )
+
+    @classmethod
+    def rebuild(cls) -> None:
+        """Replace every lot's counters with a fresh count of its places."""
+        with transaction.atomic():
+            cls.lock_places()
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                cls(
+                    lot_id=row["lot"],
+                    vehicle_type=row["vehicle_type"],
+                    status=row["status"],
+                    slot=0,
+                    count=row["total"],
+                )
+                for row in ParkingPlace.objects.values("lot", "vehicle_type", "status")
+                .annotate(total=models.Count("id"))
+            )
+            for lot_id in Lot.objects.values_list("id", flat=True):
+                read_cache.lot_changed(lot_id)
+
+
+class ParkingSession(models.Model):
+    """
+    One vehicle's stay in a lot, from the park that issued its ticket to the
+    unpark that ended it. `place` is the place its space number names, and
+    `places` every place it took, so leaving by ticket empties them without
+    looking for a van's adjacent places. A session is open until left_at is
+    set, and is then kept as history.
+
+    A session opened by a hold has its places Held until held_until. Confirming
+    it before then parks the vehicle, and clears held_until; otherwise
+    expire_holds ends it.
+
+    At most one session per place is open. Places emptied other than through
+    the api, such as by the memory backend or the admin, leave theirs open, so
+    a park replaces any open session on its place rather than fail.
+    """
+
+    ticket = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, related_name="sessions")
+    vehicle_type = ChoiceCodeField(choices=ParkingPlace.VEHICLE_CHOICES)
+    place = models.ForeignKey(
+        ParkingPlace, on_delete=models.PROTECT, related_name="sessions"
+    )
+    # The vehicle_type of the places taken, which a motorcycle's or car's may
+    # not match.
+    place_type = ChoiceCodeField(choices=ParkingPlace.VEHICLE_CHOICES)
+    places = models.JSONField()
+    parked_at = models.DateTimeField(default=timezone.now)
+    left_at = models.DateTimeField(null=True, blank=True)
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["place"],
+                condition=models.Q(left_at=None),
+                name="one_open_session_per_place",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["lot", "parked_at"], name="session_history"),
+            # Expiring holds reads the oldest from this.
+            models.Index(
+                fields=["held_until"],
+                condition=models.Q(left_at=None, held_until__isnull=False),
+                name="open_holds",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.ticket}:{self.vehicle_type}@{self.place_id}"
+
+    @classmethod
+    def db_value(cls, field_name: str, value):
+        """Return how value is passed for the named field, in raw queries."""
+        return cls._meta.get_field(field_name).get_db_prep_value(
+            value, connection, prepared=False
+        )
+
+    @classmethod
+    def open(
+        cls,
+        lot_id: int,
+        stays: List[Tuple[uuid.UUID, str, str, List[int]]],
+        held_until: Optional[datetime] = None,
+    ) -> None:
+        """
+        Open a session for each (ticket, vehicle_type, place_type, places) just
+        parked, or held until held_until, in the lot, in one upsert. The first
+        of a stay's places is the one its space number names. Should be called
+        in the transaction that claimed the places.
+        """
+        if not stays:
+            return
+        now = cls.db_value("parked_at", timezone.now())
+        held_until = cls.db_value("held_until", held_until)
+        params = [
+            v
+            for ticket, vehicle_type, place_type, places in stays
+            for v in (
+                cls.db_value("ticket", ticket),
+                lot_id,
+                cls.db_value("vehicle_type", vehicle_type),
+                places[0],
+                cls.db_value("place_type", place_type),
+                cls.db_value("places", places),
+                now,
+                held_until,
+            )
+        ]
+        statement = cls.open_statement(len(stays))
+        with connection.cursor() as cursor:
+            if len(stays) == 1:
+                statement.execute(cursor, params)
+            else:
+                # Batches vary in size, so aren't worth preparing.
+                cursor.execute(statement.sql, params)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def open_statement(cls, rows: int) -> Statement:
+        """Return the upsert opening `rows` sessions."""
+        table = cls._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * rows)
+        return Statement(
+            f"open_sessions_{rows}",
+            f"""INSERT INTO {table}
+                    (ticket, lot_id, vehicle_type, place_id, place_type, places,
+                     parked_at, held_until)
+                VALUES {values}
+                ON CONFLICT (place_id) WHERE left_at IS NULL
+                DO UPDATE SET ticket = EXCLUDED.ticket,
+                              vehicle_type = EXCLUDED.vehicle_type,
+                              place_type = EXCLUDED.place_type,
+                              places = EXCLUDED.places,
+                              parked_at = EXCLUDED.parked_at,
+                              held_until = EXCLUDED.held_until""",
+        )
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def close_statement(cls) -> Statement:
+        """Return the statement ending an open session by ticket."""
+        return Statement(
+            "close_session",
+            f"""UPDATE {cls._meta.db_table} SET left_at = %s
+                WHERE ticket = %s AND lot_id = %s AND left_at IS NULL
+                RETURNING place_type, places, held_until""",
+        )
+
+    @classmethod
+    def close(
+        cls, lot_id: int, ticket: uuid.UUID
+    ) -> Optional[Tuple[str, List[int], bool]]:
+        """
+        End the lot's open session with the ticket, and return the type of the
+        places it took, their ids, and whether they were only held, or None if
+        there is no such session. The session's row stays locked until the end
+        of the transaction.
+        """
+        params = [
+            cls.db_value("left_at", timezone.now()),
+            cls.db_value("ticket", ticket),
+            lot_id,
+        ]
+        with connection.cursor() as cursor:
+            cls.close_statement().execute(cursor, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        place_type, places, held_until = row
+        return (*cls.from_db_places(place_type, places), held_until is not None)
+
+    @classmethod
+    def from_db_places(cls, place_type: int, places: str) -> Tuple[str, List[int]]:
+        """Return place_type and places as a raw query reads them, as Python values."""
+        return (
+            cls._meta.get_field("place_type").from_db_value(place_type, None, connection),
+            cls._meta.get_field("places").from_db_value(places, None, connection),
+        )
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def confirm_statement(cls) -> Statement:
+        """Return the statement turning an unexpired hold into a stay."""
+        return Statement(
+            "confirm_hold",
+            f"""UPDATE {cls._meta.db_table} SET parked_at = %s, held_until = NULL
+                WHERE ticket = %s AND lot_id = %s AND left_at IS NULL
+                  AND held_until > %s
+                RETURNING place_type, places""",
+        )
+
+    @classmethod
+    def confirm(cls, lot_id: int, ticket: uuid.UUID) -> Optional[Tuple[str, List[int]]]:
+        """
+        Mark the lot's hold with the ticket as parked, if it hasn't expired, and
+        return the type of the places it holds and their ids, or None if there
+        is no such hold. The session's row stays locked until the end of the
+        transaction.
+        """
+        now = cls.db_value("parked_at", timezone.now())
+        with connection.cursor() as cursor:
+            cls.confirm_statement().execute(
+                cursor, [now, cls.db_value("ticket", ticket), lot_id, now]
+            )
+            row = cursor.fetchone()
+        return None if row is None else cls.from_db_places(*row)
+
+    @classmethod
+    def expire(cls, now: datetime) -> List[Tuple[int, str, List[int]]]:
+        """
+        End every open hold that expired by `now`, in one UPDATE, and return
+        the lot id, place type and place ids of each.
+        """
+        now = cls.db_value("left_at", now)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""UPDATE {cls._meta.db_table} SET left_at = %s
+                    WHERE left_at IS NULL AND held_until IS NOT NULL
+                      AND held_until <= %s
+                    RETURNING lot_id, place_type, places""",
+                [now, now],
+            )
+            return [
+                (lot_id, *cls.from_db_places(place_type, places))
+                for lot_id, place_type, places in cursor.fetchall()
+            ]
+
+    @classmethod
+    def close_at(cls, lot_id: int, place_ids: List[int]) -> None:
+        """
+        End the lot's open sessions of vehicles parked at any of the given
+        places. Holds are left open, as unparking their places fails.
+        """
+        cls.objects.filter(
+            lot_id=lot_id, place_id__in=place_ids, left_at=None, held_until=None
+        ).update(left_at=timezone.now())
+
+
+class OccupancyEvent(models.Model):
+    """
+    A change in the number of a lot's free places of one vehicle_type, as a
+    park, unpark, hold, or new place committed it. Rows are only ever
+    appended, in batches, and are read by nothing on the request path: the
+    history is read from OccupancyRollup. See occupancy_log.py.
+    """
+
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name="+")
+    at = models.DateTimeField()
+    vehicle_type = ChoiceCodeField(choices=ParkingPlace.VEHICLE_CHOICES)
+    free_change = models.IntegerField()
+
+    @classmethod
+    def append(cls, at: List[float], lots: List[int], types: List[int], changes: List[int]):
+        """
+        Append one event per index of the columns given: times in seconds since
+        the epoch, lot ids, vehicle_type codes, and changes. On PostgreSQL
+        they're loaded with one COPY.
+        """
+        times = [datetime.fromtimestamp(t, timezone.utc) for t in at]
+        if connection.vendor != "postgresql":
+            cls.objects.bulk_create(
+                cls(lot_id=lot_id, at=t, vehicle_type=code, free_change=change)
+                for t, lot_id, code, change in zip(times, lots, types, changes)
+            )
+            return
+        rows = io.StringIO(
+            "".join(
+                f"{lot_id}\t{t.isoformat()}\t{code}\t{change}\n"
+                for t, lot_id, code, change in zip(times, lots, types, changes)
+            )
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {cls._meta.db_table} (lot_id, at, vehicle_type, free_change) "
+                "FROM STDIN",
+                rows,
+            )
+
+
+class OccupancyRollup(models.Model):
+    """
+    The sum of a lot's OccupancyEvents for one vehicle_type over the period of
+    `seconds` (a minute or an hour) from `start`: the net change in free
+    places, and how many places were taken and freed. Added to as each batch
+    of events is written, in the same transaction.
+    """
+
+    MINUTE = 60
+    HOUR = 3600
+
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name="+")
+    seconds = models.PositiveIntegerField()
+    vehicle_type = ChoiceCodeField(choices=ParkingPlace.VEHICLE_CHOICES)
+    start = models.DateTimeField()
+    free_change = models.IntegerField(default=0)
+    taken = models.PositiveIntegerField(default=0)
+    freed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lot", "seconds", "start", "vehicle_type"],
+                name="unique_rollup_period",
+            )
+        ]
+
+    @classmethod
+    def add(cls, totals: Dict[Tuple[int, int, int, float], Tuple[int, int, int]]) -> None:
+        """
+        Add to the rollup for each (lot id, seconds, vehicle_type code, start in
+        seconds since the epoch) its (free_change, taken, freed), in one upsert.
+        """
+        if not totals:
+            return
+        field = cls._meta.get_field("start")
+        params = [
+            v
+            for (lot_id, seconds, code, start), sums in sorted(totals.items())
+            for v in (
+                lot_id,
+                seconds,
+                code,
+                field.get_db_prep_value(
+                    datetime.fromtimestamp(start, timezone.utc), connection
+                ),
+                *sums,
+            )
+        ]
+        table = cls._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(totals))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""INSERT INTO {table}
+                        (lot_id, seconds, vehicle_type, start, free_change, taken, freed)
+                    VALUES {values}
+                    ON CONFLICT (lot_id, seconds, start, vehicle_type)
+                    DO UPDATE SET free_change = {table}.free_change + EXCLUDED.free_change,
+                                  taken = {table}.taken + EXCLUDED.taken,
+                                  freed = {table}.freed + EXCLUDED.freed""",
+                params,
+            )
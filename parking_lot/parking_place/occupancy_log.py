@@ -0,0 +1,148 @@
+"""
+A log of every change to the number of free places of each vehicle_type in
+each lot, kept so that /stats/history can show how occupancy has moved.
+
+OccupancyCounter.adjust hands each change to the process's EventLog once its
+transaction commits. The log holds them in four arrays, one per column, rather
+than as objects, and every settings.PARKING_EVENT_LOG_INTERVAL seconds (0 for
+at once) a background thread writes them in one transaction: appended to
+OccupancyEvent, with COPY on PostgreSQL, and added to the per-minute and
+per-hour OccupancyRollups. So the rollups are always exactly the sum of the
+events written, and reads of the history never scan events.
+
+Changes not yet written are lost if the process dies. The history is counted
+back from the lot's current free places (see views.lot_history), so a lost
+batch misplaces only the changes in it rather than every count before it.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from array import array
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SECONDS = (60, 3600)
+
+
+def record(changes: List[Tuple[int, str, int]]) -> None:
+    """
+    Log each (lot id, vehicle_type, change in free places) made in the current
+    transaction, once it commits.
+    """
+    changes = [change for change in changes if change[2]]
+    if changes:
+        transaction.on_commit(lambda: get_log().append(time.time(), changes))
+
+
+class EventLog:
+    """The events not yet written, in columns, and the thread writing them."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.columns = self.empty()
+
+    @staticmethod
+    def empty() -> Tuple[array, array, array, array]:
+        """Return empty columns: time, lot id, vehicle_type code, change."""
+        return array("d"), array("q"), array("b"), array("l")
+
+    def append(self, at: float, changes: List[Tuple[int, str, int]]) -> None:
+        from parking_place.models import ParkingPlace
+
+        with self.lock:
+            times, lots, types, free_changes = self.columns
+            for lot_id, vehicle_type, change in changes:
+                times.append(at)
+                lots.append(lot_id)
+                types.append(ParkingPlace.db_value("vehicle_type", vehicle_type))
+                free_changes.append(change)
+            if self.interval > 0 and self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="parking-event-log", daemon=True
+                )
+                self.thread.start()
+        if self.interval <= 0:
+            # This runs once the change's transaction has committed, so a
+            # failure to log it mustn't fail the request that made it.
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't write occupancy events; will retry.")
+
+    def flush(self) -> None:
+        """Write every pending event, and add them to the rollups, in one transaction."""
+        with self.lock:
+            columns, self.columns = self.columns, self.empty()
+        if not columns[0]:
+            return
+        try:
+            write(*columns)
+        except Exception:
+            # Put the events back, before any logged since, to retry next time.
+            with self.lock:
+                for pending, failed in zip(self.columns, columns):
+                    failed.extend(pending)
+                self.columns = columns
+            raise
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            # Replace a connection broken by a database restart or an idle
+            # timeout, as at the start of a request, rather than fail every
+            # write on it.
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't write occupancy events; will retry.")
+
+
+def write(times: array, lots: array, types: array, changes: array) -> None:
+    from parking_place.models import OccupancyEvent, OccupancyRollup
+
+    # (free_change, taken, freed) by (lot id, seconds, vehicle_type code, start).
+    totals = defaultdict(lambda: [0, 0, 0])
+    for at, lot_id, code, change in zip(times, lots, types, changes):
+        for seconds in ROLLUP_SECONDS:
+            period = totals[(lot_id, seconds, code, at - at % seconds)]
+            period[0] += change
+            period[1 if change < 0 else 2] += abs(change)
+    with transaction.atomic():
+        OccupancyEvent.append(times, lots, types, changes)
+        OccupancyRollup.add({key: tuple(sums) for key, sums in totals.items()})
+
+
+_log: Optional[EventLog] = None
+_log_lock = threading.Lock()
+
+
+def get_log() -> EventLog:
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = EventLog(settings.PARKING_EVENT_LOG_INTERVAL)
+            atexit.register(_log.flush)
+        return _log
+
+
+def reset() -> None:
+    """
+    Forget the log, and the events it hasn't written, as between tests, so the
+    next uses the current settings.
+    """
+    global _log
+    with _log_lock:
+        log, _log = _log, None
+    if log is not None:
+        with log.lock:
+            log.columns = log.empty()
@@ -0,0 +1,69 @@
+"""
+Server-side prepared statements for the queries on the parking path, so that
+PostgreSQL parses and plans each of them once per connection rather than on
+every park. Elsewhere, or with settings.DB_PREPARE_STATEMENTS off (as it must be
+behind a pooler that shares server connections between clients, such as
+PgBouncer in transaction mode), statements are executed as plain SQL.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection
+
+PLACEHOLDER = re.compile(r"%%|%s")
+
+
+class Statement:
+    """
+    One query, written with %s placeholders as for cursor.execute. Values the
+    planner needs to see, such as those matching a partial index's condition,
+    must be written into the SQL rather than passed as parameters, as a
+    prepared statement may be planned once for any parameters.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.params = 0
+
+        def number(match):
+            if match.group() == "%%":
+                return "%"
+            self.params += 1
+            return f"${self.params}"
+
+        self.server_sql = PLACEHOLDER.sub(number, sql)
+
+    def prepare(self, cursor) -> bool:
+        """
+        Prepare the statement on the cursor's connection unless it already is,
+        and return whether it is prepared.
+        """
+        if connection.vendor != "postgresql" or not settings.DB_PREPARE_STATEMENTS:
+            return False
+        prepared = prepared_on_connection()
+        if self.name not in prepared:
+            cursor.execute(f"PREPARE {self.name} AS {self.server_sql}")
+            prepared.add(self.name)
+        return True
+
+    def execute(self, cursor, params) -> None:
+        if self.prepare(cursor):
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {self.name}({placeholders})", params)
+        else:
+            cursor.execute(self.sql, params)
+
+
+def prepared_on_connection() -> set:
+    """
+    Return the names of the statements prepared on the current connection. A
+    statement lasts as long as its connection, so the set is replaced whenever
+    Django opens a new one.
+    """
+    raw = connection.connection
+    if getattr(connection, "prepared_for", None) is not raw:
+        connection.prepared_for = raw
+        connection.prepared_statements = set()
+    return connection.prepared_statements
@@ -0,0 +1,103 @@
+"""
+A cache of the read endpoints' answers, in Django's default cache, for lots
+answered from the database.
+
+Each lot has a version, bumped whenever its occupancy counters change, and an
+answer is cached under the version it was computed at. A read looks up the
+lot's version and then the answer for it, so between writes it costs two cache
+lookups and no queries, and after a write the next read computes afresh. The
+version is bumped in the writing transaction and again once it commits, so an
+answer read from before the commit in the meantime isn't kept.
+
+The default cache is local memory, so each process has its own, and a process
+doesn't see the versions another bumps: with more than one process serving the
+database backend, point CACHES at a shared cache such as Redis or memcached.
+Answers also expire after settings.PARKING_READ_CACHE_TIMEOUT seconds.
+
+Hits and misses are counted per endpoint, in each process; see metrics().
+"""
+
+import threading
+import time
+from collections import Counter
+from functools import partial
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+PREFIX = "parking-read"
+
+_lock = threading.Lock()
+_hits: Counter = Counter()
+_misses: Counter = Counter()
+
+
+def version_key(lot_id: int) -> str:
+    return f"{PREFIX}:version:{lot_id}"
+
+
+def lot_version(lot_id: int) -> int:
+    """
+    Return the lot's version. One that has fallen out of the cache starts again
+    from the clock, so answers cached under an earlier version aren't reused.
+    """
+    version = cache.get(version_key(lot_id))
+    if version is None:
+        cache.add(version_key(lot_id), time.time_ns())
+        version = cache.get(version_key(lot_id))
+    return version
+
+
+def bump(lot_id: int) -> None:
+    try:
+        cache.incr(version_key(lot_id))
+    except ValueError:
+        # Not cached, so neither is anything read under it.
+        pass
+
+
+def lot_changed(lot_id: int) -> None:
+    """Invalidate the lot's cached answers, now and once the current transaction commits."""
+    bump(lot_id)
+    transaction.on_commit(partial(bump, lot_id))
+
+
+def cached(lot_id: int, endpoint: str, compute: Callable[[int], dict]) -> dict:
+    """Return compute(lot_id) as of the lot's current version, computing it only once."""
+    key = f"{PREFIX}:{lot_id}:{lot_version(lot_id)}"
+    answer = cache.get(key)
+    with _lock:
+        (_misses if answer is None else _hits)[endpoint] += 1
+    if answer is None:
+        answer = compute(lot_id)
+        cache.set(key, answer, settings.PARKING_READ_CACHE_TIMEOUT)
+    return answer
+
+
+def default_lot_id(resolve: Callable[[], int]) -> int:
+    """Return the default lot's id, calling resolve only if it isn't cached."""
+    key = f"{PREFIX}:default-lot"
+    lot_id = cache.get(key)
+    if lot_id is None:
+        lot_id = resolve()
+        cache.set(key, lot_id, None)
+    return lot_id
+
+
+def metrics() -> Dict[str, Dict[str, int]]:
+    """Return this process's hits and misses for each endpoint since it started."""
+    with _lock:
+        return {
+            endpoint: {"hits": _hits[endpoint], "misses": _misses[endpoint]}
+            for endpoint in sorted(set(_hits) | set(_misses))
+        }
+
+
+def reset() -> None:
+    """Empty the cache and the metrics, as between tests."""
+    cache.clear()
+    with _lock:
+        _hits.clear()
+        _misses.clear()
@@ -0,0 +1,227 @@
+"""
+Runs of contiguous open car spaces: OpenRuns, which the in-memory backend
+(parking_place.engine) and parking_lot.py park vans with, and plan_van_runs,
+which parking_lot.py and parking_place.van_runs plan to open them with. Only
+the Django project is shipped in the Docker image, so this lives in its
+package, and parking_lot.py adds the project to the path. Nothing here
+imports Django.
+"""
+
+import re
+from bisect import bisect_right, insort
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+# Number of contiguous car spaces a van takes when no van space is free.
+VAN_RUN_LENGTH = 3
+
+
+class OpenRuns:
+    """
+    Maximal runs of contiguous open spaces, numbered so that adjacent spaces
+    are consecutive, so that a run long enough for a van can be found without
+    scanning every open space. Each run is kept by its
+    first and last space and bucketed by length; runs at least `min_length`
+    long are also kept together, so finding one is O(1). Opening or taking a
+    space merges or splits at most two runs, and finding the run that holds a
+    given space is a bisect over the sorted run starts.
+    """
+
+    def __init__(self, min_length: int = VAN_RUN_LENGTH):
+        self.min_length = min_length
+        self.start_to_end: Dict[int, int] = {}
+        self.end_to_start: Dict[int, int] = {}
+        self.starts: List[int] = []
+        self.runs_by_length: Dict[int, set[int]] = {}
+        self.long_runs: set[int] = set()
+
+    @classmethod
+    def from_runs(
+        cls, runs: List[Tuple[int, int]], min_length: int = VAN_RUN_LENGTH
+    ) -> "OpenRuns":
+        """
+        Return the runs given as (first, last), in order and with a taken space
+        between each, built in one pass rather than a space at a time.
+        """
+        open_runs = cls(min_length)
+        open_runs.starts = [start for start, _ in runs]
+        ends = [end for _, end in runs]
+        open_runs.start_to_end = dict(zip(open_runs.starts, ends))
+        open_runs.end_to_start = dict(zip(ends, open_runs.starts))
+        by_length = open_runs.runs_by_length
+        for start, end in runs:
+            length = end - start + 1
+            if length in by_length:
+                by_length[length].add(start)
+            else:
+                by_length[length] = {start}
+        open_runs.long_runs = {
+            start for start, end in runs if end - start + 1 >= min_length
+        }
+        return open_runs
+
+    def _add_run(self, start: int, end: int) -> None:
+        self.start_to_end[start] = end
+        self.end_to_start[end] = start
+        insort(self.starts, start)
+        length = end - start + 1
+        self.runs_by_length.setdefault(length, set()).add(start)
+        if length >= self.min_length:
+            self.long_runs.add(start)
+
+    def _remove_run(self, start: int) -> int:
+        end = self.start_to_end.pop(start)
+        del self.end_to_start[end]
+        del self.starts[bisect_right(self.starts, start) - 1]
+        length = end - start + 1
+        bucket = self.runs_by_length[length]
+        bucket.remove(start)
+        if not bucket:
+            del self.runs_by_length[length]
+        self.long_runs.discard(start)
+        return end
+
+    def run_containing(self, space: int) -> Optional[Tuple[int, int]]:
+        """Return (first, last) of the run holding space, or None if it's not open."""
+        i = bisect_right(self.starts, space) - 1
+        if i < 0:
+            return None
+        start = self.starts[i]
+        end = self.start_to_end[start]
+        return (start, end) if space <= end else None
+
+    def add(self, space: int) -> None:
+        """Mark space as open, joining it to the runs on either side."""
+        start = end = space
+        if space - 1 in self.end_to_start:
+            start = self.end_to_start[space - 1]
+            self._remove_run(start)
+        if space + 1 in self.start_to_end:
+            end = self._remove_run(space + 1)
+        self._add_run(start, end)
+
+    def remove(self, space: int) -> None:
+        """Mark space as taken, splitting the run that held it."""
+        run = self.run_containing(space)
+        if run is None:
+            return
+        start, end = run
+        self._remove_run(start)
+        if start < space:
+            self._add_run(start, space - 1)
+        if space < end:
+            self._add_run(space + 1, end)
+
+    def find_long_run(self) -> Optional[Tuple[int, int]]:
+        """Return (first, last) of some run at least min_length long, or None."""
+        for start in self.long_runs:
+            return start, self.start_to_end[start]
+        return None
+
+
+def penalized_runs(
+    costs: List[int], penalty: int
+) -> Tuple[List[int], List[int], List[int]]:
+    """
+    For each prefix of a lot's spaces, return the least total cost of runs
+    taken in it, less `penalty` for each run, and the most and fewest runs
+    that come to that. costs[i] is the cost of the run ending at space i, or
+    -1 if there's none.
+    """
+    best, most, fewest = [0], [0], [0]
+    for i, cost in enumerate(costs):
+        b, m, f = best[i], most[i], fewest[i]
+        if cost >= 0:
+            j = i - VAN_RUN_LENGTH + 1
+            with_run = best[j] + cost - penalty
+            if with_run < b:
+                b, m, f = with_run, most[j] + 1, fewest[j] + 1
+            elif with_run == b:
+                m = max(m, most[j] + 1)
+                f = min(f, fewest[j] + 1)
+        best.append(b)
+        most.append(m)
+        fewest.append(f)
+    return best, most, fewest
+
+
+def plan_van_runs(
+    layout: bytes, count: int
+) -> Optional[Tuple[List[int], List[Tuple[int, int]]]]:
+    """
+    Plan the fewest moves of vehicles between car spaces that would leave
+    `count` runs of VAN_RUN_LENGTH open car spaces, none sharing a space, for
+    vans. Return the first space of each run and the moves, as (from, to), or
+    None if no moves would do. Vans in car spaces stay where they are, and
+    vehicles only move into car spaces, so no move takes a van space.
+
+    Only C and c in the layout (see LAYOUT_LETTERS in parking_lot.py) count;
+    anything else, such as a space between two rows, ends a run of car spaces.
+
+    A run costs the number of its spaces that are taken. Runs are chosen by
+    dynamic programming over the spaces with a penalty for each run taken,
+    which is raised until the cheapest choice takes `count` runs, so the plan
+    takes a few passes over the lot however many runs are asked for. Vehicles
+    are moved into the shortest runs of open car spaces left, the first along
+    the row to the first space, and so on.
+    """
+    costs = [-1] * len(layout)
+    most_runs = 0
+    for run in re.finditer(rb"[Cc]+", layout):
+        start, end = run.span()
+        most_runs += (end - start) // VAN_RUN_LENGTH
+        for i in range(start + VAN_RUN_LENGTH - 1, end):
+            costs[i] = layout.count(b"c", i - VAN_RUN_LENGTH + 1, i + 1)
+    # Every vehicle moved out of a run needs an open car space outside them.
+    if count > most_runs or VAN_RUN_LENGTH * count > layout.count(b"C"):
+        return None
+    if count <= 0:
+        return [], []
+
+    # The least cost of n runs rises by a whole number, no less than the last,
+    # with each run added. So the least penalty at which a cheapest choice
+    # takes `count` runs is the rise to `count`, and a choice of `count` runs
+    # that's cheapest at that penalty is the cheapest of any `count` runs.
+    low, high = 0, 1
+    while penalized_runs(costs, high)[1][-1] < count:
+        low, high = high + 1, high * 2
+    while low < high:
+        mid = (low + high) // 2
+        if penalized_runs(costs, mid)[1][-1] >= count:
+            high = mid
+        else:
+            low = mid + 1
+    best, most, fewest = penalized_runs(costs, high)
+
+    # Walk back from the end, taking a run wherever a cheapest choice with the
+    # runs still wanted does.
+    starts = []
+    end, wanted = len(costs), count
+    while wanted:
+        cost = costs[end - 1]
+        start = end - VAN_RUN_LENGTH
+        if (
+            cost >= 0
+            and best[start] + cost - high == best[end]
+            and fewest[start] < wanted <= most[start] + 1
+        ):
+            starts.append(start)
+            wanted -= 1
+            end = start
+        else:
+            end -= 1
+    starts.reverse()
+
+    planned = bytearray(layout)
+    moved = []
+    for start in starts:
+        for space in range(start, start + VAN_RUN_LENGTH):
+            if planned[space] == ord("c"):
+                moved.append(space)
+            planned[space] = ord("V")
+    spare = sorted(
+        (run.span() for run in re.finditer(rb"C+", planned)),
+        key=lambda span: (span[1] - span[0], span[0]),
+    )
+    to = sorted(islice((s for span in spare for s in range(*span)), len(moved)))
+    return starts, list(zip(moved, to))
@@ -0,0 +1,62 @@
+"""
+Plans for opening runs of car places for vans by moving the vehicles parked in
+them, for the plan_van_runs command. A lot's places are written as a layout and
+planned with parking_place.runs.plan_van_runs, as ParkingLot's spaces are.
+
+Vans take VAN_RUN_LENGTH adjacent car places once the van places are full, and
+parks leave open car places scattered, so a lot can turn vans away with plenty
+of car places free. A plan is the fewest moves of cars and motorcycles from one
+car place to another that would leave the number of runs asked for open. Vans
+in car places and held places stay where they are, and nothing is moved into a
+van place, as that would only take one van's place to make another's.
+
+A plan is read from the places as they are, without locking them, and isn't
+carried out: attendants move the vehicles and unpark and park them as usual,
+so parks in the meantime can spoil it. Lots held in memory are read from the
+database, which lags them by up to a flush.
+"""
+
+from typing import List, Optional, Tuple
+
+from parking_place.models import ParkingPlace
+from parking_place.runs import VAN_RUN_LENGTH, plan_van_runs
+
+# (id, level, row, position) of a place.
+Place = Tuple[int, int, int, int]
+
+# How each place is written in the layout planned over: open and taken car
+# places, and x for any other. A space separates places that aren't adjacent.
+LETTERS = {("Car", "Empty"): ord("C"), ("Car", "Full"): ord("c")}
+
+
+def plan(
+    lot_id: int, count: int
+) -> Optional[Tuple[List[List[Place]], List[Tuple[Place, Place]]]]:
+    """
+    Return the places of each of `count` runs for vans in a lot, and the fewest
+    moves of vehicles between car places, as (from, to), that would open them;
+    or None if the lot hasn't the car places to open that many.
+    """
+    layout = bytearray()
+    places: List[Optional[Place]] = []
+    last = None
+    for place_id, vehicle_type, status, level, row, position in (
+        ParkingPlace.objects.filter(lot_id=lot_id)
+        .order_by("level", "row", "position")
+        .values_list("id", "vehicle_type", "status", "level", "row", "position")
+        .iterator()
+    ):
+        if last != (level, row, position - 1):
+            layout.append(ord(" "))
+            places.append(None)
+        last = (level, row, position)
+        layout.append(LETTERS.get((vehicle_type, status), ord("x")))
+        places.append((place_id, level, row, position))
+    planned = plan_van_runs(bytes(layout), count)
+    if planned is None:
+        return None
+    starts, moves = planned
+    return (
+        [places[start : start + VAN_RUN_LENGTH] for start in starts],
+        [(places[i], places[to]) for i, to in moves],
+    )
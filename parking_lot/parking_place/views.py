@@ -1,169 +1,1150 @@
 import json
+import operator
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache, reduce
+from typing import Dict, List, Optional, Tuple
 
-from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
-from django.db import connection
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.sql import UpdateQuery
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import close_old_connections, connection, transaction
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.views.decorators.http import require_POST
 
-from parking_place.models import ParkingPlace
+from parking_place import engine, events, read_cache
+from parking_place.prepared import Statement
+from parking_place.models import (
+    SPACE_PREFERENCE,
+    ConcurrentUpdate,
+    Lot,
+    OccupancyCounter,
+    OccupancyRollup,
+    ParkingPlace,
+    ParkingSession,
+    default_lot_id,
+    retry_on_conflict,
+)
+from parking_place.runs import VAN_RUN_LENGTH
 
 
 def set_place_values(place_id: int, vehicle_type: str = None, status: str = None):
     """
     Change the vehicle_type and status of the parking place at id==place_id.
-    Change only types that are not None.
+    Change only types that are not None. If the place is changed by someone
+    else while this is, it's read and changed again.
     """
-    place = ParkingPlace.objects.get(id=place_id)
-    if vehicle_type:
-        place.vehicle_type = vehicle_type
-    if status:
-        place.status = status
-    place.save()
 
+    def change():
+        place = ParkingPlace.objects.get(id=place_id)
+        if vehicle_type:
+            place.vehicle_type = vehicle_type
+        if status:
+            place.status = status
+        place.save()
 
-def free_space(request):
+    retry_on_conflict(change)
+
+
+def get_lot_id(lot_id: Optional[int]) -> int:
+    """
+    Return the id of the lot a request is for: the one in its url, or the
+    default lot for the top-level routes, whose id is cached so that they
+    don't look it up. Raise Http404 if there is no such lot.
+    """
+    if lot_id is None:
+        return read_cache.default_lot_id(default_lot_id)
+    return get_object_or_404(Lot, id=lot_id).id
+
+
+def lot_stats(lot_id: int) -> dict:
+    """
+    Return the number of free places of each type, whether the lot is full, and
+    the number of places used by vans, all from the lot's occupancy counters.
+    """
+    counts = OccupancyCounter.totals(lot_id)
+    free = {
+        "motorcycle": counts.get(("Motorcycle", "Empty"), 0),
+        "car": counts.get(("Car", "Empty"), 0),
+        "van": counts.get(("Van", "Empty"), 0),
+    }
+    adjacent = sum(n for (_, status), n in counts.items() if status == "Adjacent")
+    return {
+        "free": free,
+        "full": sum(free.values()) == 0,
+        # Each van in car places has two adjacent places and takes three.
+        "van-usage": counts.get(("Van", "Full"), 0) + adjacent // 2 * 3,
+    }
+
+
+def in_memory() -> bool:
+    """
+    Return whether requests are answered by the in-memory engine rather than
+    the database. See engine.py.
+    """
+    backend = settings.PARKING_BACKEND
+    if backend not in ("database", "memory"):
+        raise ImproperlyConfigured(f"Unknown parking backend: {backend}")
+    return backend == "memory"
+
+
+def get_stats(lot_id: Optional[int]) -> dict:
+    """Return lot_stats for the lot a request is for, from whichever backend is in use."""
+    if in_memory():
+        return engine.get_engine(lot_id).stats()
+    return lot_stats(get_lot_id(lot_id))
+
+
+def read_stats(lot_id: Optional[int], endpoint: str) -> dict:
+    """
+    Return get_stats for a read endpoint. From the database, answers are cached
+    until the lot next changes, unless settings.PARKING_READ_CACHE is off; see
+    read_cache.py.
+    """
+    if in_memory() or not settings.PARKING_READ_CACHE:
+        return get_stats(lot_id)
+    if lot_id is None:
+        return read_cache.cached(get_lot_id(None), endpoint, lot_stats)
+    # Only a lot that exists is ever cached.
+    return read_cache.cached(lot_id, endpoint, lambda i: lot_stats(get_lot_id(i)))
+
+
+@lru_cache(maxsize=None)
+def db_executor() -> ThreadPoolExecutor:
+    """
+    Return the threads the async views run database work in. Each thread keeps
+    its connection for settings.CONN_MAX_AGE, so this is the process's pool of
+    connections, settings.DB_POOL_SIZE of them at most.
+    """
+    return ThreadPoolExecutor(
+        max_workers=settings.DB_POOL_SIZE, thread_name_prefix="parking-db"
+    )
+
+
+def in_db_thread(func):
+    """
+    Return an async version of func, which uses the ORM, for the async views.
+    It runs in one of db_executor's threads, so requests waiting on the
+    database don't queue for the single thread Django otherwise gives
+    synchronous code, unless settings.PARKING_DB_THREAD_SENSITIVE is set. Each
+    thread's connection is checked as at the start of a request, and replaced
+    if it's broken or older than settings.CONN_MAX_AGE.
+    """
+
+    def run(*args):
+        if not connection.in_atomic_block:
+            close_old_connections()
+        return func(*args)
+
+    if settings.PARKING_DB_THREAD_SENSITIVE:
+        return sync_to_async(run, thread_sensitive=True)
+    return sync_to_async(run, thread_sensitive=False, executor=db_executor())
+
+
+async def call(func, lot_id: Optional[int], *args, writes: bool = True):
+    """
+    Call func(lot_id, *args) for an async view. If the lot is held in memory
+    it's called on the event loop, without a thread, unless it writes and
+    writes are flushed to the database at once. Otherwise it runs in a worker
+    thread, as the ORM is synchronous.
+    """
+    if (
+        in_memory()
+        and engine.is_loaded(lot_id)
+        and not (writes and settings.PARKING_ENGINE_FLUSH_INTERVAL <= 0)
+    ):
+        return func(lot_id, *args)
+    return await in_db_thread(func)(lot_id, *args)
+
+
+async def free_space(request, lot_id: int = None):
     """Return number of remaining open spaces, motorcycle + car + van."""
-    motorcycle_res = ParkingPlace.objects.filter(
-        Q(vehicle_type="Motorcycle") & Q(status="Empty")
-    ).count()
-    car_res = ParkingPlace.objects.filter(
-        Q(vehicle_type="Car") & Q(status="Empty")
-    ).count()
-    van_res = ParkingPlace.objects.filter(
-        Q(vehicle_type="Van") & Q(status="Empty")
-    ).count()
-    return JsonResponse({"motorcycle": motorcycle_res, "car": car_res, "van": van_res})
-
-
-def how_many_spaces_are_vans(request):
+    return JsonResponse((await call(read_stats, lot_id, "free", writes=False))["free"])
+
+
+async def how_many_spaces_are_vans(request, lot_id: int = None):
     """Return the total number of spaces used by vans."""
-    van_spaces = ParkingPlace.objects.filter(
-        Q(vehicle_type="Van") & Q(status="Full")
-    ).count()
-    adjacent_spaces = ParkingPlace.objects.filter(status="Adjacent").count()
-    total = van_spaces + adjacent_spaces // 2 * 3
-    return JsonResponse({"van-usage": total})
+    lot = await call(read_stats, lot_id, "vans-usage", writes=False)
+    return JsonResponse({"van-usage": lot["van-usage"]})
+
 
+async def stats(request, lot_id: int = None):
+    """Return everything /free, /is-full and /vans-usage do, in one response."""
+    return JsonResponse(await call(read_stats, lot_id, "stats", writes=False))
 
-def park(request, vehicle_type: str) -> JsonResponse:
+
+# The periods /stats/history can give, and how many it gives by default.
+HISTORY_PERIODS = {
+    "minute": (OccupancyRollup.MINUTE, 60),
+    "hour": (OccupancyRollup.HOUR, 24),
+}
+
+
+def lot_history(lot_id: Optional[int], seconds: int, periods: int) -> dict:
     """
-    Attempt to park a vehicle (motorcycle, car, or van). If succesful, return
-    space number. Otherwise, return -1.
-    """
-
-    # Move a space from an "open" set to a "full" set. For each incoming
-    # vehicle type check for open spaces in increasing order of size.
-
-    # Note that, for any given vehicle to be parked, a space is chosen at random,
-    # meaning that over time vans may become more difficult to park. I believe
-    # that Python sets are lrus, but choosing from an ordered list might be more
-    # efficient.
-    if json.loads(is_full(request).content)["full"]:
-        return JsonResponse({"id": -1})
-
-    space_dict = json.loads(free_space(request).content)
-    if vehicle_type.lower() == "motorcycle":
-        # Check first for motorcycle spaces, then cars spaces, then van spaces.
-        if space_dict["motorcycle"]:
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Motorcycle") & Q(status="Empty")
-            )[0]["id"]
-        elif space_dict["car"]:
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Car") & Q(status="Empty")
-            )[0]["id"]
-        else:
-            # There must be a van space available.
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Van") & Q(status="Empty")
-            )[0]["id"]
-        set_place_values(space_number, status="Full")
-        return JsonResponse({"id": space_number})
-    elif vehicle_type.lower() == "car":
-        # Check first for car spaces, then for van spaces.
-        if space_dict["car"]:
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Car") & Q(status="Empty")
-            )[0]["id"]
+    Return the lot's free places of each type at the end of each of the last
+    `periods` periods of `seconds`, the current one last, with the places taken
+    and freed in each, and a forecast for the next period from the average
+    change over them. It reads the lot's free places now and the rollups of
+    those periods, and counts back from one by the other, so it costs the same
+    however busy the lot has been.
+    """
+    if in_memory():
+        lot = engine.get_engine(lot_id)
+        lot_id, now_free = lot.lot_id, lot.stats()["free"]
+    else:
+        lot_id = get_lot_id(lot_id)
+        now_free = lot_stats(lot_id)["free"]
+    current = int(time.time() // seconds * seconds)
+    first = current - (periods - 1) * seconds
+    types = [t for t, _ in ParkingPlace.VEHICLE_CHOICES]
+    zeros = dict.fromkeys(types, 0)
+    changes = [dict(zeros) for _ in range(periods)]
+    taken = [dict(zeros) for _ in range(periods)]
+    freed = [dict(zeros) for _ in range(periods)]
+    for start, vehicle_type, change, n_taken, n_freed in OccupancyRollup.objects.filter(
+        lot_id=lot_id,
+        seconds=seconds,
+        start__gte=datetime.fromtimestamp(first, timezone.utc),
+    ).values_list("start", "vehicle_type", "free_change", "taken", "freed"):
+        i = (int(start.timestamp()) - first) // seconds
+        if i < periods:
+            changes[i][vehicle_type] = change
+            taken[i][vehicle_type] = n_taken
+            freed[i][vehicle_type] = n_freed
+    free = [None] * periods
+    end = {t: now_free[t.lower()] for t in types}
+    for i in reversed(range(periods)):
+        free[i] = end
+        end = {t: end[t] - changes[i][t] for t in types}
+    forecast = {
+        t.lower(): max(0, round(free[-1][t] + sum(c[t] for c in changes) / periods))
+        for t in types
+    }
+    return {
+        "seconds": seconds,
+        "periods": [
+            {
+                "start": datetime.fromtimestamp(first + i * seconds, timezone.utc),
+                "free": {t.lower(): n for t, n in free[i].items()},
+                "taken": {t.lower(): n for t, n in taken[i].items()},
+                "freed": {t.lower(): n for t, n in freed[i].items()},
+            }
+            for i in range(periods)
+        ],
+        "forecast": {
+            "start": datetime.fromtimestamp(current + seconds, timezone.utc),
+            "free": forecast,
+        },
+    }
+
+
+async def stats_history(request, lot_id: int = None) -> JsonResponse:
+    """
+    Return the lot's free places over time, from the rollups of the occupancy
+    log: ?period=minute (the default) or hour, and ?periods=N of them.
+    """
+    period = request.GET.get("period", "minute")
+    if period not in HISTORY_PERIODS:
+        return JsonResponse({"error": "period must be minute or hour."}, status=400)
+    seconds, periods = HISTORY_PERIODS[period]
+    try:
+        periods = int(request.GET.get("periods", periods))
+    except ValueError:
+        periods = 0
+    if not 1 <= periods <= 1440:
+        return JsonResponse({"error": "periods must be from 1 to 1440."}, status=400)
+    return JsonResponse(await in_db_thread(lot_history)(lot_id, seconds, periods))
+
+
+def cache_stats(request) -> JsonResponse:
+    """Return this process's read cache hits and misses for each endpoint."""
+    return JsonResponse(read_cache.metrics())
+
+
+# The policies other than lowest-id choose among the lot's RUN_CANDIDATES
+# lowest empty car places, by the length of the run of empty car places each
+# is in. Lengths are counted from the places up to RUN_REACH - 1 positions
+# either side, so runs of RUN_REACH or more are all taken as that long.
+RUN_CANDIDATES = 64
+RUN_REACH = 4 * VAN_RUN_LENGTH
+
+# How each placement policy other than lowest-id orders empty car places, given
+# the length of the run of empty car places each one is in.
+RUN_ORDERING = {
+    # Take from the shortest run first.
+    "best-fit": "w.run_length, p.id",
+    # Take from runs too short for a van first, then from runs whose length
+    # isn't a multiple of a van's, where one place costs no van capacity. A run
+    # too long to measure might cost one, so comes last.
+    "protect-runs": f"""CASE WHEN w.run_length < {VAN_RUN_LENGTH} THEN 0
+                             WHEN w.run_length = {RUN_REACH} THEN 2
+                             WHEN w.run_length %% {VAN_RUN_LENGTH} <> 0 THEN 1
+                             ELSE 2 END,
+                        w.run_length, p.id""",
+}
+
+
+def skip_locked(*tables: str) -> str:
+    """
+    Return the clause locking the rows of the given table aliases for a raw
+    query claiming places. SQLite, used for quick local runs, has no row locks
+    at all.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        return f"FOR UPDATE OF {', '.join(tables)} SKIP LOCKED"
+    return ""
+
+
+@lru_cache(maxsize=None)
+def claim_place_statement(vehicle_type: str) -> Statement:
+    """Return the statement locking a lot's lowest empty place of vehicle_type."""
+    return Statement(
+        f"claim_{vehicle_type.lower()}_place",
+        f"""SELECT id FROM parking_place_parkingplace
+            WHERE lot_id = %s
+              AND vehicle_type = {ParkingPlace.db_value("vehicle_type", vehicle_type)}
+              AND status = {ParkingPlace.db_value("status", "Empty")}
+            ORDER BY id
+            LIMIT 1
+            {skip_locked("parking_place_parkingplace")}""",
+    )
+
+
+def claim_place(lot_id: int, vehicle_types: List[str]) -> Optional[Tuple[int, str]]:
+    """
+    Lock the lot's first empty place whose vehicle_type is in vehicle_types,
+    preferring types in the order given, and return its id and vehicle_type, or
+    None if there is no such place. Rows already locked by a concurrent park are
+    skipped rather than waited on. Must be called inside a transaction.
+    """
+    policy = settings.PARKING_PLACEMENT_POLICY
+    # One query per type, so each can read the lowest id straight off that
+    # type's partial index of empty places. Usually the first type has room.
+    for t in vehicle_types:
+        if t == "Car" and policy != "lowest-id":
+            space_number = claim_car_place(lot_id, policy)
         else:
-            # There must be a van space available.
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Van") & Q(status="Empty")
-            )[0]["id"]
-        set_place_values(space_number, status="Full")
-        return JsonResponse({"id": space_number})
-    elif vehicle_type.lower() == "van":
-        # It's a van. Look for van spaces, if not available try for three
-        # car spaces.
-        if space_dict["van"]:
-            space_number = ParkingPlace.objects.values("id").filter(
-                Q(vehicle_type="Van") & Q(status="Empty")
-            )[0]["id"]
-            set_place_values(space_number, status="Full")
-            return JsonResponse({"id": space_number})
-        elif space_dict["car"] > 2:
             with connection.cursor() as cursor:
-                cursor.execute("""SELECT p.id FROM parking_place_parkingplace p
-                                  JOIN parking_place_parkingplace q ON p.id - 1 = q.id
-                                  JOIN parking_place_parkingplace r ON p.id + 1 = r.id
-                    WHERE p.vehicle_type = 'Car'
-                      AND p.status = 'Empty'
-                      AND q.vehicle_type = 'Car'
-                      AND q.status='Empty'
-                      AND r.vehicle_type='Car'
-                      AND r.status='Empty'
-                    LIMIT 1;""")
-                space_number = cursor.fetchone()[0]
-                set_place_values(space_number, status="Van")
-                set_place_values(space_number - 1, status="Adjacent")
-                set_place_values(space_number + 1, status="Adjacent")
-                return JsonResponse({"id": space_number})
-        else:
-            # There were no van spaces and not enough car spaces.
-            return JsonResponse({"id": -1})
+                claim_place_statement(t).execute(cursor, [lot_id])
+                row = cursor.fetchone()
+            space_number = row[0] if row else None
+        if space_number is not None:
+            return space_number, t
+    return None
+
+
+@lru_cache(maxsize=None)
+def claim_car_place_statement(policy: str) -> Statement:
+    """Return the statement locking the empty car place a policy prefers in a lot."""
+    if policy not in RUN_ORDERING:
+        raise ImproperlyConfigured(f"Unknown placement policy: {policy}")
+    car = ParkingPlace.db_value("vehicle_type", "Car")
+    empty = ParkingPlace.db_value("status", "Empty")
+    # The candidates are read off the partial index of empty car places, and
+    # their neighbours off that of empty car runs. Consecutive positions in a
+    # row less their order among the row's empty car places nearby are
+    # constant along a run, so they identify it.
+    return Statement(
+        f"claim_car_place_{policy.replace('-', '_')}",
+        f"""WITH c AS (
+                SELECT id, level, "row", position FROM parking_place_parkingplace
+                WHERE lot_id = %s AND vehicle_type = {car} AND status = {empty}
+                ORDER BY id
+                LIMIT {RUN_CANDIDATES}),
+            nearby AS (
+                SELECT DISTINCT n.level, n."row", n.position
+                FROM c JOIN parking_place_parkingplace n
+                  ON n.level = c.level AND n."row" = c."row"
+                 AND n.position BETWEEN c.position - {RUN_REACH - 1}
+                                    AND c.position + {RUN_REACH - 1}
+                WHERE n.lot_id = %s AND n.vehicle_type = {car} AND n.status = {empty}),
+            w AS (
+                SELECT level, "row", position,
+                       CASE WHEN seen < {RUN_REACH} THEN seen ELSE {RUN_REACH} END
+                           AS run_length
+                FROM (SELECT level, "row", position,
+                             COUNT(*) OVER (PARTITION BY level, "row", position - seq)
+                                 AS seen
+                      FROM (SELECT level, "row", position,
+                                   ROW_NUMBER() OVER (PARTITION BY level, "row"
+                                                      ORDER BY position) AS seq
+                            FROM nearby) e) r)
+            SELECT p.id FROM parking_place_parkingplace p
+            JOIN c ON c.id = p.id
+            JOIN w ON w.level = c.level AND w."row" = c."row" AND w.position = c.position
+            WHERE p.vehicle_type = {car}
+              AND p.status = {empty}
+            ORDER BY {RUN_ORDERING[policy]}
+            LIMIT 1
+            {skip_locked("p")}""",
+    )
+
+
+def claim_car_place(lot_id: int, policy: str) -> Optional[int]:
+    """
+    Lock and return the id of the lot's empty car place the placement policy
+    prefers, or None if there is none. Only the RUN_CANDIDATES lowest empty car
+    places, and the places near them, are read, however large the lot. If a
+    concurrent park has locked every candidate, the lowest empty car place not
+    locked is taken instead.
+    """
+    statement = claim_car_place_statement(policy)
+    with connection.cursor() as cursor:
+        statement.execute(cursor, [lot_id, lot_id])
+        row = cursor.fetchone()
+        if row is None:
+            claim_place_statement("Car").execute(cursor, [lot_id])
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@lru_cache(maxsize=None)
+def car_run_starts_statement(policy: str) -> Statement:
+    """
+    Return the statement finding runs of empty car places for a policy, with
+    the key each is ordered by, (run length, id of its first place), from
+    after a given key.
+    """
+    car = ParkingPlace.db_value("vehicle_type", "Car")
+    empty = ParkingPlace.db_value("status", "Empty")
+    if policy == "lowest-id":
+        # A place starts a run if the empty car place length - 1 after it in
+        # its row is length - 1 positions on. Runs are ordered by id alone.
+        return Statement(
+            "car_run_starts_lowest_id",
+            f"""SELECT level, "row", position, 0, id FROM (
+                    SELECT id, level, "row", position,
+                           LEAD(position, %s) OVER (PARTITION BY level, "row"
+                                                    ORDER BY position) AS last
+                    FROM parking_place_parkingplace
+                    WHERE lot_id = %s AND vehicle_type = {car} AND status = {empty}) e
+                WHERE last = position + %s AND id > %s
+                ORDER BY id
+                LIMIT %s""",
+        )
+    # Gaps and islands: consecutive positions in a row less their order among
+    # the row's empty car places are constant along a run. Shortest runs first,
+    # as in ParkingLot._choose_van_run.
+    return Statement(
+        "car_run_starts_shortest",
+        f"""SELECT level, "row", MIN(position), COUNT(*), MIN(id) FROM (
+                SELECT id, level, "row", position,
+                       position - ROW_NUMBER() OVER (PARTITION BY level, "row"
+                                                     ORDER BY position)
+                           AS island
+                FROM parking_place_parkingplace
+                WHERE lot_id = %s AND vehicle_type = {car} AND status = {empty}) e
+            GROUP BY level, "row", island
+            HAVING COUNT(*) >= %s
+               AND (COUNT(*) > %s OR (COUNT(*) = %s AND MIN(id) > %s))
+            ORDER BY COUNT(*), MIN(id)
+            LIMIT %s""",
+    )
+
+
+def car_run_starts(
+    lot_id: int,
+    length: int,
+    policy: str,
+    limit: int,
+    after: Tuple[int, int] = (0, 0),
+) -> List[Tuple[int, int, int, Tuple[int, int]]]:
+    """
+    Return the level, row, and first position of up to `limit` runs of
+    `length` contiguous empty car places in the lot, in the order the placement
+    policy prefers them, starting after the run whose key is `after`. Each
+    comes with its own key, to pass as `after` for the runs that follow it.
+    Only the partial index of empty car places is read.
+    """
+    run_length, start_id = after
+    if policy == "lowest-id":
+        params = [length - 1, lot_id, length - 1, start_id, limit]
+    else:
+        params = [lot_id, length, run_length, run_length, start_id, limit]
+    with connection.cursor() as cursor:
+        car_run_starts_statement(policy).execute(cursor, params)
+        return [
+            (level, row, start, (n, first_id))
+            for level, row, start, n, first_id in cursor.fetchall()
+        ]
+
+
+def hot_statements() -> List[Statement]:
+    """Return every statement the park and unpark paths may prepare."""
+    return (
+        [claim_place_statement(t) for t, _ in ParkingPlace.VEHICLE_CHOICES]
+        + [claim_car_place_statement(policy) for policy in RUN_ORDERING]
+        + [car_run_starts_statement(policy) for policy in ["lowest-id", *RUN_ORDERING]]
+        + [OccupancyCounter.adjust_statement(rows) for rows in range(1, 4)]
+        + [
+            ParkingSession.open_statement(1),
+            ParkingSession.close_statement(),
+            ParkingSession.confirm_statement(),
+        ]
+    )
+
+
+# Runs claim_car_run reads at a time.
+CAR_RUN_BATCH = 8
+
+
+def claim_car_run(lot_id: int, length: int) -> Optional[List[int]]:
+    """
+    Lock `length` contiguous empty car places in the lot and return their ids
+    in row order, or None if there are no such places. Runs with a place
+    already locked or taken by a concurrent park are passed over, and the runs
+    after them are read CAR_RUN_BATCH at a time until one can be locked or
+    there are none left. Must be called inside a transaction.
+    """
+    policy = settings.PARKING_PLACEMENT_POLICY
+    after = (0, 0)
+    while True:
+        starts = car_run_starts(lot_id, length, policy, CAR_RUN_BATCH, after)
+        for level, row, start, after in starts:
+            locked = lock_car_run(lot_id, level, row, start, length)
+            if locked is not None:
+                return locked
+        if len(starts) < CAR_RUN_BATCH:
+            return None
+
+
+def lock_car_run(
+    lot_id: int, level: int, row: int, start: int, length: int
+) -> Optional[List[int]]:
+    """
+    Lock the run of `length` empty car places from the start given and return
+    their ids in row order, or None if any of them is locked or no longer empty.
+    """
+    locked = list(
+        ParkingPlace.objects.select_for_update(skip_locked=True)
+        .filter(
+            lot_id=lot_id,
+            level=level,
+            row=row,
+            position__range=(start, start + length - 1),
+            vehicle_type="Car",
+            status="Empty",
+        )
+        .order_by("position")
+        .values_list("id", flat=True)
+    )
+    return locked if len(locked) == length else None
+
+
+def set_statuses(
+    lot_id: int, statuses: Dict[int, str], versions: Optional[Dict[int, int]] = None
+) -> None:
+    """
+    Set the status of each of the lot's places in one UPDATE, and announce the
+    changes to the lot's event streams, with a NOTIFY in the same statement
+    where there is one. The occupancy counters are left to the caller.
+
+    If the versions the places were read at are given, the UPDATE only matches
+    places still at them, and ConcurrentUpdate is raised, so that the caller's
+    transaction is rolled back, unless it matches every place.
+    """
+    by_status = defaultdict(list)
+    for place_id, status in statuses.items():
+        by_status[status].append(place_id)
+    if not by_status:
+        return
+    payloads = events.places_changed(lot_id, statuses)
+    places = ParkingPlace.objects.filter(id__in=list(statuses))
+    if versions is not None:
+        places = places.filter(
+            reduce(operator.or_, [Q(id=i, version=v) for i, v in versions.items()])
+        )
+    if len(by_status) == 1:
+        status = next(iter(by_status))
+    else:
+        field = ParkingPlace._meta.get_field("status")
+        status = Case(
+            *[
+                When(id__in=ids, then=Value(status, output_field=field))
+                for status, ids in by_status.items()
+            ],
+            output_field=field,
+        )
+    values = {"status": status, "version": F("version") + 1}
+    if payloads:
+        updated = update_and_notify(places, values, payloads)
+    else:
+        updated = places.update(**values)
+    if versions is not None and updated != len(statuses):
+        raise ConcurrentUpdate(f"{len(statuses) - updated} places changed since read.")
+
+
+def update_and_notify(places, values: dict, payloads: List[str]) -> int:
+    """
+    Update places as places.update(**values) does, and NOTIFY each payload on
+    the events channel in the same statement, returning the number of places
+    updated. PostgreSQL only.
+    """
+    query = places.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    sql, params = query.get_compiler(places.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""WITH updated AS ({sql} RETURNING 1),
+                     notified AS (SELECT pg_notify(%s, payload)
+                                  FROM unnest(%s::text[]) AS payload)
+                SELECT (SELECT COUNT(*) FROM updated), (SELECT COUNT(*) FROM notified)""",
+            [*params, events.CHANNEL, payloads],
+        )
+        return cursor.fetchone()[0]
+
+
+def parked_statuses(places: List[int]) -> Dict[int, str]:
+    """Return the status of each place a vehicle takes, given as its session lists them."""
+    if len(places) == 1:
+        return {places[0]: "Full"}
+    # A van in car places: its space number, then the places either side.
+    statuses = {place_id: "Adjacent" for place_id in places}
+    statuses[places[0]] = "Van"
+    return statuses
+
+
+def park_van_in_car_places(
+    lot_id: int,
+    ticket: Optional[uuid.UUID] = None,
+    held_until: Optional[datetime] = None,
+) -> List[int]:
+    """
+    Park a van in contiguous car places in the lot, under the ticket, and
+    return the places, its space number (the middle place) first, or none if
+    there is no room. With held_until, the places are only held until then.
+    Must be called inside a transaction.
+    """
+    run = claim_car_run(lot_id, VAN_RUN_LENGTH)
+    if run is None:
+        return []
+    space_number = run[1]
+    places = [space_number] + [place_id for place_id in run if place_id != space_number]
+    if held_until is None:
+        statuses = parked_statuses(places)
     else:
+        statuses = dict.fromkeys(places, "Held")
+    set_statuses(lot_id, statuses)
+    changes = Counter({(lot_id, "Car", "Empty"): -VAN_RUN_LENGTH})
+    for status in statuses.values():
+        changes[(lot_id, "Car", status)] += 1
+    OccupancyCounter.adjust(changes)
+    ParkingSession.open(
+        lot_id, [(ticket or uuid.uuid4(), "Van", "Car", places)], held_until
+    )
+    return places
+
+
+def park_vehicle(
+    lot_id: int,
+    vehicle_type: str,
+    ticket: Optional[uuid.UUID] = None,
+    held_until: Optional[datetime] = None,
+) -> int:
+    """
+    Park one vehicle (motorcycle, car, or van) in the lot and return its space
+    number, or -1 if there is no room or the type is unknown. Must be called
+    inside a transaction. Its session is opened under the ticket, or a new one
+    if none is given. With held_until, its places are only held until then.
+    """
+    places = park_vehicle_places(lot_id, vehicle_type, ticket, held_until)
+    return places[0] if places else -1
+
+
+def park_vehicle_places(
+    lot_id: int,
+    vehicle_type: str,
+    ticket: Optional[uuid.UUID] = None,
+    held_until: Optional[datetime] = None,
+) -> List[int]:
+    """
+    Park one vehicle as park_vehicle does, and return every place it takes,
+    its space number first, or none if it couldn't be parked.
+    """
+
+    # Claiming a place is a single locking SELECT followed by a single UPDATE of
+    # the place and one of the occupancy counters. Because locked rows are
+    # skipped, concurrent parks never wait on each other and never get the same
+    # place.
+
+    # Which place is chosen depends on settings.PARKING_PLACEMENT_POLICY. With
+    # the default, lowest-id, vans may become more difficult to park over time.
+    vehicle_type = vehicle_type.lower()
+    if vehicle_type not in SPACE_PREFERENCE:
         # The input is bad
-        return JsonResponse({"id": -1})
-    return JsonResponse({"id": space_number})
+        return []
+    place = claim_place(lot_id, SPACE_PREFERENCE[vehicle_type])
+    if place is not None:
+        space_number, place_type = place
+        status = "Full" if held_until is None else "Held"
+        set_statuses(lot_id, {space_number: status})
+        OccupancyCounter.adjust(
+            {(lot_id, place_type, "Empty"): -1, (lot_id, place_type, status): 1}
+        )
+        ParkingSession.open(
+            lot_id,
+            [(ticket or uuid.uuid4(), vehicle_type.title(), place_type, [space_number])],
+            held_until,
+        )
+        return [space_number]
+    if vehicle_type == "van":
+        # No van spaces, so try for three car spaces.
+        return park_van_in_car_places(lot_id, ticket, held_until)
+    # There were not enough spaces.
+    return []
+
+
+def park_vehicles(
+    lot_id: int,
+    vehicle_types: List[str],
+    tickets: Optional[List[uuid.UUID]] = None,
+) -> List[int]:
+    """
+    Park each vehicle in turn in the lot and return their space numbers, -1 for any that
+    couldn't be parked. Must be called inside a transaction. Each vehicle's
+    session is opened under its ticket in `tickets`, if given.
+
+    With the lowest-id policy, places are claimed with at most one locking
+    SELECT per type of place, marked with one UPDATE for the whole batch, and
+    their sessions opened with one upsert. Vans that need car places are placed
+    after the rest of the batch.
+    """
+    vehicle_types = [t.lower() for t in vehicle_types]
+    if tickets is None:
+        tickets = [uuid.uuid4() for _ in vehicle_types]
+    if settings.PARKING_PLACEMENT_POLICY != "lowest-id":
+        # The other policies must see each place taken before choosing the next.
+        return [
+            park_vehicle(lot_id, t, ticket) for t, ticket in zip(vehicle_types, tickets)
+        ]
+
+    # Lock as many empty places of each type as the batch could use. Any left
+    # over stay empty, and are only unavailable to others until commit.
+    wanted = Counter(
+        place_type for t in vehicle_types for place_type in SPACE_PREFERENCE.get(t, [])
+    )
+    open_places = {
+        place_type: deque(
+            ParkingPlace.objects.select_for_update(skip_locked=True)
+            .filter(lot_id=lot_id, vehicle_type=place_type, status="Empty")
+            .order_by("id")
+            .values_list("id", flat=True)[:n]
+        )
+        for place_type, n in wanted.items()
+    }
+    space_numbers = []
+    statuses = {}
+    changes = Counter()
+    stays = []
+    vans_for_car_places = []
+    for i, vehicle_type in enumerate(vehicle_types):
+        space_number = -1
+        for place_type in SPACE_PREFERENCE.get(vehicle_type, []):
+            if open_places[place_type]:
+                space_number = open_places[place_type].popleft()
+                statuses[space_number] = "Full"
+                changes[(lot_id, place_type, "Empty")] -= 1
+                changes[(lot_id, place_type, "Full")] += 1
+                stays.append(
+                    (tickets[i], vehicle_type.title(), place_type, [space_number])
+                )
+                break
+        else:
+            if vehicle_type == "van":
+                vans_for_car_places.append(i)
+        space_numbers.append(space_number)
+    set_statuses(lot_id, statuses)
+    OccupancyCounter.adjust(changes)
+    ParkingSession.open(lot_id, stays)
+    for i in vans_for_car_places:
+        places = park_van_in_car_places(lot_id, tickets[i])
+        space_numbers[i] = places[0] if places else -1
+    return space_numbers
+
+
+def van_sides(
+    lot_id: int, middles: List[Tuple[int, int, int]]
+) -> Dict[Tuple, Tuple[int, int]]:
+    """
+    Return the id and version of the adjacent places either side of each given
+    (level, row, position) of a van parked in car places, by (level, row,
+    position).
+    """
+    if not middles:
+        return {}
+    sides = Q()
+    for level, row, position in middles:
+        sides |= Q(level=level, row=row, position__in=(position - 1, position + 1))
+    return {
+        (level, row, position): (place_id, version)
+        for place_id, level, row, position, version in ParkingPlace.objects.filter(
+            sides, lot_id=lot_id, vehicle_type="Car", status="Adjacent"
+        ).values_list("id", "level", "row", "position", "version")
+    }
+
+
+def unpark_places(lot_id: int, space_numbers: List[int]) -> List[bool]:
+    """
+    Remove the vehicles from the given spaces in the lot and return, for each,
+    whether a vehicle was removed. The places are read with one SELECT, or two
+    if vans parked in car places are among them, without locking them, and
+    emptied with one UPDATE that only matches them if they're still as read.
+    If one isn't, ConcurrentUpdate is raised, and the transaction, which this
+    must be called inside, should be retried; see unpark_in_lot.
+    """
+    # Ending the sessions first locks them before the places, in the same
+    # order as leave_by_ticket does.
+    ParkingSession.close_at(lot_id, space_numbers)
+    places = {
+        place_id: (vehicle_type, status, (level, row, position), version)
+        for place_id, vehicle_type, status, level, row, position, version in (
+            ParkingPlace.objects.filter(lot_id=lot_id, id__in=space_numbers).values_list(
+                "id", "vehicle_type", "status", "level", "row", "position", "version"
+            )
+        )
+    }
+    sides = van_sides(
+        lot_id,
+        [where for _, status, where, _ in places.values() if status == "Van"],
+    )
+    # Places to empty, with what they were, and the versions they were read at.
+    emptied = {}
+    versions = {}
+    successes = []
+    for space_number in space_numbers:
+        if space_number not in places or space_number in emptied:
+            successes.append(False)
+            continue
+        vehicle_type, status, (level, row, position), version = places[space_number]
+        if status == "Held":
+            # A hold is released by its ticket, or when it expires.
+            successes.append(False)
+            continue
+        if vehicle_type == "Motorcycle" or vehicle_type == "Van":
+            # We don't have to worry about the special case of a van taking
+            # three spaces.
+            emptied[space_number] = (vehicle_type, status)
+        elif status == "Van":
+            # We need to worry about adjacent spaces.
+            emptied[space_number] = (vehicle_type, status)
+            for side in (position - 1, position + 1):
+                side_id, side_version = sides[(level, row, side)]
+                emptied[side_id] = ("Car", "Adjacent")
+                versions[side_id] = side_version
+        elif status != "Adjacent":
+            # We know it's not adjacent and it's not a van or motorcycle space.
+            # We can just set it to Empty.
+            emptied[space_number] = (vehicle_type, status)
+        else:
+            # An adjacent place is freed through the van's middle place.
+            successes.append(False)
+            continue
+        versions[space_number] = version
+        successes.append(True)
+
+    set_statuses(lot_id, {place_id: "Empty" for place_id in emptied}, versions)
+    changes = Counter()
+    for vehicle_type, status in emptied.values():
+        changes[(lot_id, vehicle_type, status)] -= 1
+        changes[(lot_id, vehicle_type, "Empty")] += 1
+    OccupancyCounter.adjust(changes)
+    return successes
+
+
+def leave_by_ticket(lot_id: int, ticket: uuid.UUID) -> bool:
+    """
+    Remove the vehicle parked under the ticket from the lot, or release its
+    hold, and return whether it was there. Its session says which places it
+    took and what they were, so this is one UPDATE ending the session, one
+    emptying its places, and the counters. Must be called inside a transaction.
+    """
+    session = ParkingSession.close(lot_id, ticket)
+    if session is None:
+        return False
+    place_type, places, held = session
+    taken = dict.fromkeys(places, "Held") if held else parked_statuses(places)
+    set_statuses(lot_id, {place_id: "Empty" for place_id in places})
+    changes = Counter()
+    for status in taken.values():
+        changes[(lot_id, place_type, status)] -= 1
+        changes[(lot_id, place_type, "Empty")] += 1
+    OccupancyCounter.adjust(changes)
+    return True
+
+
+def confirm_hold(lot_id: int, ticket: uuid.UUID) -> bool:
+    """
+    Park the vehicle the lot's hold under the ticket is for in the places held,
+    and return whether the hold was still open and unexpired. Must be called
+    inside a transaction.
+    """
+    session = ParkingSession.confirm(lot_id, ticket)
+    if session is None:
+        return False
+    place_type, places = session
+    statuses = parked_statuses(places)
+    set_statuses(lot_id, statuses)
+    changes = Counter()
+    for status in statuses.values():
+        changes[(lot_id, place_type, "Held")] -= 1
+        changes[(lot_id, place_type, status)] += 1
+    OccupancyCounter.adjust(changes)
+    return True
+
+
+def expire_holds(now: Optional[datetime] = None) -> int:
+    """
+    Release every hold in every lot that has expired by now, and return how
+    many there were. This is one transaction, whatever their number: one
+    UPDATE ending their sessions, one emptying their places for each lot, and
+    one upsert of the counters. A hold confirmed or released meanwhile is left
+    alone, as its session's row is locked.
+    """
+    with transaction.atomic():
+        expired = ParkingSession.expire(now or timezone.now())
+        emptied = defaultdict(dict)
+        changes = Counter()
+        for lot_id, place_type, places in expired:
+            for place_id in places:
+                emptied[lot_id][place_id] = "Empty"
+            changes[(lot_id, place_type, "Held")] -= len(places)
+            changes[(lot_id, place_type, "Empty")] += len(places)
+        for lot_id, statuses in emptied.items():
+            set_statuses(lot_id, statuses)
+        OccupancyCounter.adjust(changes)
+    return len(expired)
 
 
-def unpark(request, space_number: int):
+def read_batch(request, key: str) -> Optional[list]:
+    """Return the list under key in the request's JSON body, or None if there isn't one."""
+    try:
+        items = json.loads(request.body)[key]
+    except (ValueError, KeyError, TypeError):
+        return None
+    return items if isinstance(items, list) else None
+
+
+def park_in_lot(
+    lot_id: Optional[int], vehicle_type: str, ticket: Optional[uuid.UUID] = None
+) -> int:
+    """
+    Park one vehicle in the lot a request is for, with whichever backend is in
+    use, and return its space number or -1. The database backend records its
+    session under the ticket.
+    """
+    places = park_places_in_lot(lot_id, vehicle_type, ticket)
+    return places[0] if places else -1
+
+
+def park_places_in_lot(
+    lot_id: Optional[int], vehicle_type: str, ticket: Optional[uuid.UUID] = None
+) -> List[int]:
+    """As park_in_lot, but return every place taken, its space number first."""
+    if in_memory():
+        return engine.get_engine(lot_id).park_places(vehicle_type)
+    lot_id = get_lot_id(lot_id)
+    with transaction.atomic():
+        return park_vehicle_places(lot_id, vehicle_type, ticket)
+
+
+def park_many_in_lot(
+    lot_id: Optional[int],
+    vehicle_types: List[str],
+    tickets: Optional[List[uuid.UUID]] = None,
+) -> List[int]:
+    """Park a batch of vehicles in the lot a request is for, in one transaction."""
+    if in_memory():
+        return engine.get_engine(lot_id).park_many(vehicle_types)
+    lot_id = get_lot_id(lot_id)
+    with transaction.atomic():
+        return park_vehicles(lot_id, vehicle_types, tickets)
+
+
+def unpark_in_lot(lot_id: Optional[int], space_numbers: List[int]) -> List[bool]:
+    """
+    Unpark spaces in the lot a request is for, in one transaction, retried if
+    another changes the places in the meantime.
+    """
+    if in_memory():
+        return engine.get_engine(lot_id).unpark(space_numbers)
+    lot_id = get_lot_id(lot_id)
+
+    def unpark_once():
+        with transaction.atomic():
+            return unpark_places(lot_id, space_numbers)
+
+    return retry_on_conflict(unpark_once)
+
+
+def leave_lot(lot_id: Optional[int], ticket: uuid.UUID) -> bool:
+    """Remove the vehicle parked under a ticket from the lot a request is for."""
+    lot_id = get_lot_id(lot_id)
+    with transaction.atomic():
+        return leave_by_ticket(lot_id, ticket)
+
+
+def hold_in_lot(
+    lot_id: Optional[int], vehicle_type: str, ticket: uuid.UUID, held_until: datetime
+) -> int:
+    """Hold places for one vehicle in the lot a request is for, until held_until."""
+    lot_id = get_lot_id(lot_id)
+    with transaction.atomic():
+        return park_vehicle(lot_id, vehicle_type, ticket, held_until)
+
+
+def confirm_in_lot(lot_id: Optional[int], ticket: uuid.UUID) -> bool:
+    """Confirm a hold in the lot a request is for."""
+    lot_id = get_lot_id(lot_id)
+    with transaction.atomic():
+        return confirm_hold(lot_id, ticket)
+
+
+def issue_tickets(n: int) -> List[Optional[uuid.UUID]]:
+    """
+    Return a ticket for each of n vehicles about to park. The memory backend
+    doesn't record sessions, so it issues none.
+    """
+    return [None if in_memory() else uuid.uuid4() for _ in range(n)]
+
+
+async def park(request, vehicle_type: str, lot_id: int = None) -> JsonResponse:
+    """
+    Attempt to park a vehicle (motorcycle, car, or van). If succesful, return
+    space number, every place the vehicle takes (a van in car places takes the
+    places either side too), and the ticket to unpark it with. Otherwise,
+    return -1.
+    """
+    [ticket] = issue_tickets(1)
+    places = await call(park_places_in_lot, lot_id, vehicle_type, ticket)
+    return JsonResponse(
+        {
+            "id": places[0] if places else -1,
+            "places": places,
+            "ticket": ticket if places else None,
+        }
+    )
+
+
+@csrf_exempt
+@require_POST
+def park_batch(request, lot_id: int = None) -> JsonResponse:
+    """
+    Park every vehicle in a body of the form {"vehicle_types": ["car", ...]} in
+    one transaction. Return their space numbers, in the same order, with -1 for
+    any that couldn't be parked, and their tickets, null for those.
+    """
+    vehicle_types = read_batch(request, "vehicle_types")
+    if vehicle_types is None or not all(isinstance(t, str) for t in vehicle_types):
+        return JsonResponse({"error": "Expected a list of vehicle_types."}, status=400)
+    tickets = issue_tickets(len(vehicle_types))
+    space_numbers = park_many_in_lot(lot_id, vehicle_types, tickets)
+    return JsonResponse(
+        {
+            "ids": space_numbers,
+            "tickets": [
+                ticket if space_number != -1 else None
+                for space_number, ticket in zip(space_numbers, tickets)
+            ],
+        }
+    )
+
+
+async def unpark(request, space_number: int, lot_id: int = None):
     """
     Remove the vehicle from a space. Return True if the space was taken, False
     otherwise. Only a boolean is returned because the type of vehicle in a
     given space has not been tracked.
     """
-    space_vals = ParkingPlace.objects.values("status", "vehicle_type").get(id=space_number)
-    if space_vals["vehicle_type"] == "Motorcycle" or space_vals["vehicle_type"] == "Van":
-        # We don't have to worry about the special case of a van taking three
-        # spaces.
-        set_place_values(space_number, status="Empty")
-        return JsonResponse({"success": True})
+    successes = await call(unpark_in_lot, lot_id, [space_number])
+    return JsonResponse({"success": successes[0]})
+
+
+async def unpark_ticket(request, ticket: uuid.UUID, lot_id: int = None):
+    """
+    Remove the vehicle parked under a ticket. Return True if it was still
+    parked, False otherwise. Only the database backend issues tickets.
+    """
+    if in_memory():
+        return JsonResponse(
+            {"error": "Tickets are only issued by the database backend."}, status=400
+        )
+    return JsonResponse({"success": await in_db_thread(leave_lot)(lot_id, ticket)})
+
+
+@csrf_exempt
+@require_POST
+def unpark_batch(request, lot_id: int = None) -> JsonResponse:
+    """
+    Unpark every space in a body of the form {"ids": [12, ...]} in one
+    transaction. Return, in the same order, whether each space was taken.
+    """
+    space_numbers = read_batch(request, "ids")
+    if space_numbers is None or not all(type(n) is int for n in space_numbers):
+        return JsonResponse({"error": "Expected a list of ids."}, status=400)
+    return JsonResponse({"success": unpark_in_lot(lot_id, space_numbers)})
 
-    if space_vals["status"] == "Van":
-        # We need to worry about adjacent spaces.
-        set_place_values(space_number, status="Empty")
-        set_place_values(space_number - 1, status="Empty")
-        set_place_values(space_number + 1, status="Empty")
-        return JsonResponse({"success": True})
 
-    if space_vals["status"] != "Adjacent":
-        # We know it's not adjacent and it's not a van or motorcycle space.
-        # We can just set it to Empty.
-        set_place_values(space_number, status="Empty")
-        return JsonResponse({"success": True})
+async def hold(request, vehicle_type: str, lot_id: int = None) -> JsonResponse:
+    """
+    Hold a space for a vehicle (motorcycle, car, or van) that hasn't arrived
+    yet, for settings.PARKING_HOLD_SECONDS. Return the space number, or -1 if
+    there is no room, the hold id, which is also its ticket, and when it
+    expires. Held spaces aren't counted as free. Only the database backend
+    holds spaces.
+    """
+    if in_memory():
+        return JsonResponse(
+            {"error": "Holds are only made by the database backend."}, status=400
+        )
+    ticket = uuid.uuid4()
+    held_until = timezone.now() + timedelta(seconds=settings.PARKING_HOLD_SECONDS)
+    space_number = await in_db_thread(hold_in_lot)(
+        lot_id, vehicle_type, ticket, held_until
+    )
+    if space_number == -1:
+        return JsonResponse({"id": -1, "hold": None, "expires": None})
+    return JsonResponse({"id": space_number, "hold": ticket, "expires": held_until})
 
-    # If we got this far something went wrong.
-    return JsonResponse({"success": False})
 
+async def confirm(request, hold_id: uuid.UUID, lot_id: int = None) -> JsonResponse:
+    """
+    Park the vehicle a hold is for in its space, as it arrives. Return True if
+    the hold was still open and unexpired, False otherwise. The hold id is then
+    the ticket to unpark with.
+    """
+    if in_memory():
+        return JsonResponse(
+            {"error": "Holds are only made by the database backend."}, status=400
+        )
+    return JsonResponse({"success": await in_db_thread(confirm_in_lot)(lot_id, hold_id)})
 
 
-def is_full(request):
+async def is_full(request, lot_id: int = None):
     """
     Return True if lot is full, False otherwise. Note this does not mean there
     is space for a van or a car, as for instance, only a single motorcycle
     space might be available.
     """
-    res = ParkingPlace.objects.filter(status__exact="Empty").count()
-    return JsonResponse({"full": res == 0})
+    lot = await call(read_stats, lot_id, "is-full", writes=False)
+    return JsonResponse({"full": lot["full"]})
 
 
+def event_stream(request, lot_id: int = None) -> StreamingHttpResponse:
+    """
+    Stream the lot's stats, and each change to its places, as server-sent
+    events. This serves them under WSGI; see events.py.
+    """
+    response = StreamingHttpResponse(
+        events.stream(get_lot_id(lot_id)), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    return response